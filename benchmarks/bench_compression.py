@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Measure the compression ratio and the reactor time taken by compressing
+JSON responses of growing sizes, shaped after VOLTHA device lists (see
+bench_transcoding), through the response encoder of the gateway, at
+several compression levels. Responses are written through the encoder in
+the chunks of a streamed response.
+
+Usage: python -m chameleon.benchmarks.bench_compression [repeat]
+"""
+
+import sys
+from timeit import default_timer
+
+from twisted.web.http_headers import Headers
+
+from chameleon.benchmarks.bench_transcoding import make_classes, \
+    make_devices
+from chameleon.web_server.compression import ENCODINGS, ResponseCompression
+from chameleon.web_server.json_stream import JsonEncoder
+
+
+class FakeRequest(object):
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.responseHeaders = Headers(
+            {'content-type': ['application/json']})
+
+    def getHeader(self, name):
+        return self.encoding
+
+
+def compress(chunks, encoding, level):
+    encoder = ResponseCompression(1024, level).encoderForRequest(
+        FakeRequest(encoding))
+    size = sum(len(encoder.encode(chunk)) for chunk in chunks)
+    return size + len(encoder.finish())
+
+
+def main(repeat):
+    message_class, _ = make_classes()
+    print '%32s %10s %8s %6s %10s %8s' % (
+        'message', 'JSON bytes', 'encoding', 'level', 'ratio', 'ms')
+    for devices, ports, flows in ((1, 16, 64), (16, 16, 64), (128, 16, 64)):
+        message = make_devices(message_class, devices, ports, flows)
+        chunks = list(JsonEncoder().iterencode(message))
+        size = sum(len(chunk) for chunk in chunks)
+        for encoding in ENCODINGS:
+            for level in (1, 3, 6, 9):
+                t0 = default_timer()
+                for _ in xrange(repeat):
+                    compressed = compress(chunks, encoding, level)
+                ms = 1e3 * (default_timer() - t0) / repeat
+                print '%32s %10d %8s %6d %9.1fx %8.2f' % (
+                    '%d devices, %d ports, %d flows' % (devices, ports,
+                                                         flows),
+                    size, encoding, level, float(size) / compressed, ms)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
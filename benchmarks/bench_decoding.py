@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compare the cost of building input messages from JSON request bodies with
+ParseDict against the gateway's MessageDecoder, on VOLTHA-shaped write
+requests (see bench_transcoding).
+
+Usage: python -m chameleon.benchmarks.bench_decoding [repeat]
+"""
+
+import sys
+from timeit import default_timer
+
+from google.protobuf.json_format import MessageToDict, ParseDict
+from simplejson import dumps, loads
+
+from chameleon.benchmarks.bench_transcoding import make_classes, \
+    make_devices
+from chameleon.web_server.transcoding import MessageDecoder
+
+
+def bench(parse, body, repeat):
+    t0 = default_timer()
+    for _ in xrange(repeat):
+        parse(body)
+    return 1e6 * (default_timer() - t0) / repeat
+
+
+def main(repeat):
+    message_class, _ = make_classes()
+    device_class = message_class('bench.Device')
+    decoder = MessageDecoder(device_class.DESCRIPTOR)
+
+    def parse_dict(body):
+        data = loads(body)
+        data.update({'id': 'from-path'})
+        return ParseDict(data, device_class())
+
+    def decode(body):
+        req = device_class()
+        decoder.decode(loads(body), req)
+        decoder.decode({'id': 'from-path'}, req)
+        return req
+
+    print '%20s %8s %14s %14s %8s' % (
+        'request', 'bytes', 'ParseDict', 'decoder', 'speedup')
+    for ports, flows in ((0, 0), (4, 0), (16, 16), (16, 256)):
+        device = make_devices(message_class, 1, ports, flows).items[0]
+        body = dumps(MessageToDict(device, True, True))
+        assert parse_dict(body) == decode(body)
+        reflective = bench(parse_dict, body, repeat)
+        table_driven = bench(decode, body, repeat)
+        print '%20s %8d %12.1fus %12.1fus %7.1fx' % (
+            '%d ports, %d flows' % (ports, flows), len(body), reflective,
+            table_driven, reflective / table_driven)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compare the gateway-side cost of answering a polling GET whose response
+did not change with 304 Not Modified (computing the ETag of the serialized
+response, as received from the backend) against sending the JSON body
+again (computing the ETag, then parsing the response and encoding its
+body), on VOLTHA-shaped messages (see bench_transcoding).
+
+Usage: python -m chameleon.benchmarks.bench_etags [repeat]
+"""
+
+import sys
+from timeit import default_timer
+
+from simplejson import dumps
+
+from chameleon.benchmarks.bench_transcoding import make_classes, \
+    make_devices
+from chameleon.web_server.etags import make_etag
+
+
+def bench(f, data, repeat):
+    t0 = default_timer()
+    for _ in xrange(repeat):
+        f(data)
+    return 1e3 * (default_timer() - t0) / repeat
+
+
+def main(repeat):
+    message_class, encoders = make_classes()
+    devices_class = message_class('bench.Devices')
+    encode = encoders['bench.Devices']
+
+    def full(data):
+        return make_etag(data), dumps(encode(devices_class.FromString(data)))
+
+    print '%32s %10s %12s %12s' % ('message', 'JSON bytes', '304', '200')
+    for devices, ports, flows in ((1, 16, 64), (16, 16, 64), (128, 16, 64)):
+        data = make_devices(message_class, devices, ports,
+                            flows).SerializeToString()
+        print '%32s %10d %10.3fms %10.2fms' % (
+            '%d devices, %d ports, %d flows' % (devices, ports, flows),
+            len(full(data)[1]), bench(make_etag, data, repeat),
+            bench(full, data, repeat))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
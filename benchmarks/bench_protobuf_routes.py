@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compare the gateway-side cost of a unary call spoken in JSON against one
+spoken in serialized protobuf, on VOLTHA-shaped messages (see
+bench_transcoding): the JSON call parses the request body into a message,
+serializes it for the backend, parses the backend's response and
+transcodes it to JSON; the protobuf call passes the bytes through both
+ways.
+
+Usage: python -m chameleon.benchmarks.bench_protobuf_routes [repeat]
+"""
+
+import sys
+from StringIO import StringIO
+from timeit import default_timer
+
+import structlog
+from google.protobuf.json_format import MessageToDict
+from simplejson import dumps
+
+from chameleon.benchmarks.bench_transcoding import make_classes, \
+    make_devices
+from chameleon.web_server.gateway import GatewayRoute, PROTOBUF
+
+
+class FakeRequest(object):
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.headers = {'content-type': content_type}
+
+    @property
+    def content(self):
+        return StringIO(self.body)
+
+    def getHeader(self, name):
+        return self.headers.get(name)
+
+
+def bench(call, repeat):
+    t0 = default_timer()
+    for _ in xrange(repeat):
+        call()
+    return 1e3 * (default_timer() - t0) / repeat
+
+
+def main(repeat):
+    message_class, encoders = make_classes()
+    devices_class = message_class('bench.Devices')
+    route = GatewayRoute(None, 'Bench_Update', 'post', '/bench', '*', None,
+                         'Update', devices_class, encoders=encoders,
+                         service='bench.Bench')
+
+    print '%32s %10s %10s %12s %12s' % (
+        'message', 'JSON bytes', 'PB bytes', 'JSON', 'protobuf')
+    for devices, ports, flows in ((1, 16, 0), (1, 16, 256), (16, 16, 64),
+                                  (128, 16, 64)):
+        message = make_devices(message_class, devices, ports, flows)
+        wire = message.SerializeToString()
+        body = dumps(MessageToDict(message, True, True))
+        json_request = FakeRequest(body, 'application/json')
+        protobuf_request = FakeRequest(wire, PROTOBUF)
+
+        def json_call():
+            # the typed stub serializes the request, deserializes the reply
+            req = route.parse_request(json_request, {})
+            res = devices_class.FromString(req.SerializeToString())
+            return route.transcode(res)
+
+        def protobuf_call():
+            return route.parse_raw_request(protobuf_request, {})
+
+        assert protobuf_call() == wire
+        print '%32s %10d %10d %10.2fms %10.3fms' % (
+            '%d devices, %d ports, %d flows' % (devices, ports, flows),
+            len(body), len(wire), bench(json_call, repeat),
+            bench(protobuf_call, repeat))
+
+
+if __name__ == '__main__':
+    # the debug logs of the transcoded responses are dropped, as they would
+    # be at the default log level
+    structlog.configure(processors=[],
+                        logger_factory=structlog.ReturnLoggerFactory())
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
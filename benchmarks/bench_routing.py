@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compare route lookup cost of the gateway's RouteTrie against werkzeug
+routing (as used by Klein) for growing route tables.
+
+Usage: python -m chameleon.benchmarks.bench_routing [lookups]
+"""
+
+import sys
+from random import Random
+from timeit import default_timer
+
+from werkzeug.routing import Map, Rule
+
+from chameleon.web_server.route_trie import RouteTrie
+
+# route shapes as found in the VOLTHA API, (verb, path template)
+SHAPES = [
+    ('get', '/api/v1/svc{n}/devices'),
+    ('post', '/api/v1/svc{n}/devices'),
+    ('get', '/api/v1/svc{n}/devices/{id}'),
+    ('delete', '/api/v1/svc{n}/devices/{id}'),
+    ('get', '/api/v1/svc{n}/devices/{id}/ports/{port_no}'),
+]
+
+
+def make_routes(count):
+    routes = []
+    for i in xrange(count):
+        verb, template = SHAPES[i % len(SHAPES)]
+        routes.append((verb, template.replace('{n}', str(i / len(SHAPES)))))
+    return routes
+
+
+def make_requests(routes, count, seed=0):
+    rnd = Random(seed)
+    requests = []
+    for _ in xrange(count):
+        verb, template = routes[rnd.randrange(len(routes))]
+        path = template.replace('{id}', 'dev%d' % rnd.randrange(1000))
+        path = path.replace('{port_no}', str(rnd.randrange(64)))
+        requests.append((verb.upper(), path))
+    return requests
+
+
+def klein_path(path):
+    return path.replace('{', '<string:').replace('}', '>')
+
+
+def bench_werkzeug(routes, requests):
+    url_map = Map()
+    for i, (verb, path) in enumerate(routes):
+        url_map.add(Rule(klein_path(path), methods=[verb.upper()],
+                         endpoint='route%d' % i))
+    adapter = url_map.bind('localhost')
+    adapter.match('/api/v1/svc0/devices', method='GET')  # compile the map
+    t0 = default_timer()
+    for verb, path in requests:
+        adapter.match(path, method=verb)
+    return default_timer() - t0
+
+
+def bench_trie(routes, requests):
+    trie = RouteTrie()
+    for i, (verb, path) in enumerate(routes):
+        trie.add(verb, path, i, {'port_no': int})
+    t0 = default_timer()
+    for verb, path in requests:
+        trie.match(verb, path)
+    return default_timer() - t0
+
+
+def main(lookups):
+    print '%8s %16s %16s %8s' % ('routes', 'werkzeug us/op', 'trie us/op',
+                                 'speedup')
+    for count in (100, 1000, 5000):
+        routes = make_routes(count)
+        requests = make_requests(routes, lookups)
+        t_werkzeug = bench_werkzeug(routes, requests)
+        t_trie = bench_trie(routes, requests)
+        print '%8d %16.2f %16.2f %7.1fx' % (
+            count, 1e6 * t_werkzeug / lookups, 1e6 * t_trie / lookups,
+            t_werkzeug / t_trie)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compare the response cache hit rate of N worker processes, each with its
+own ResponseCache, against N workers sharing a SharedResponseCache.
+Requests over a Zipf-distributed key set are spread round robin over the
+workers, as SO_REUSEPORT would; misses fill the cache as the gateway
+does after a backend call.
+
+Usage: python -m chameleon.benchmarks.bench_shared_cache [requests]
+"""
+
+import os
+import sys
+import tempfile
+from multiprocessing import Process, Queue
+from random import Random
+from timeit import default_timer
+
+from chameleon.web_server.response_cache import ResponseCache
+from chameleon.web_server.shared_cache import SharedResponseCache
+
+KEYS = 5000
+BODY = 'x' * 2000
+HEADERS = [('Content-Type', 'application/json')]
+CACHE_SIZE = 16 * 1024 * 1024  # holds all keys
+TTL = 30
+
+
+def make_requests(count, seed=0):
+    # Zipf (s=1) over KEYS keys, by inverting the cumulative weights
+    rnd = Random(seed)
+    weights = [1.0 / (i + 1) for i in xrange(KEYS)]
+    total = sum(weights)
+    cumulative, acc = [], 0
+    for w in weights:
+        acc += w / total
+        cumulative.append(acc)
+    requests = []
+    for _ in xrange(count):
+        x, lo, hi = rnd.random(), 0, KEYS - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if cumulative[mid] < x:
+                lo = mid + 1
+            else:
+                hi = mid
+        requests.append(lo)
+    return requests
+
+
+def worker(cache, requests, results):
+    hits = 0
+    t0 = default_timer()
+    for k in requests:
+        key = ('DeviceService_GetDevice', str(k))
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            cache.put(key, HEADERS, BODY, TTL, '/api/v1/devices/%d' % k,
+                      cache.generation)
+    results.put((hits, default_timer() - t0))
+
+
+def run(workers, requests, make_cache):
+    results = Queue()
+    processes = [
+        Process(target=worker,
+                args=(make_cache(), requests[i::workers], results))
+        for i in xrange(workers)]
+    for p in processes:
+        p.start()
+    outcomes = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    hits = sum(h for h, _ in outcomes)
+    elapsed = max(t for _, t in outcomes)
+    return float(hits) / len(requests), 1e6 * elapsed / len(requests)
+
+
+def main(count):
+    requests = make_requests(count)
+    print '%8s %14s %14s %14s %14s' % (
+        'workers', 'local hits', 'local us/op', 'shared hits', 'shared us/op')
+    for workers in (1, 2, 4, 8):
+        filename = tempfile.mktemp(prefix='chameleon-cache-')
+        try:
+            local_rate, local_us = run(
+                workers, requests, lambda: ResponseCache(CACHE_SIZE))
+            shared_rate, shared_us = run(
+                workers, requests,
+                lambda: SharedResponseCache(filename, CACHE_SIZE))
+        finally:
+            if os.path.exists(filename):
+                os.remove(filename)
+        print '%8d %13.1f%% %14.2f %13.1f%% %14.2f' % (
+            workers, 100 * local_rate, local_us, 100 * shared_rate, shared_us)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 40000)
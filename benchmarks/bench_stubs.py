@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compare the per-call cost of looking up the multi-callable of a gateway
+call: building a fresh stub on each call (as invoke used to) against the
+per-channel stub cache of the balancer's backends.
+
+Usage: python -m chameleon.benchmarks.bench_stubs [lookups]
+"""
+
+import sys
+from timeit import default_timer
+
+import grpc
+from google.protobuf.empty_pb2 import Empty
+
+from chameleon.grpc_client.balancer import Backend
+
+
+def make_stub_class(method_count):
+    """
+    Equivalent of a generated *_pb2_grpc.<Service>Stub class
+    """
+    names = ['Method%d' % i for i in xrange(method_count)]
+
+    def __init__(stub, channel):
+        for name in names:
+            setattr(stub, name, channel.unary_unary(
+                '/bench.BenchService/' + name,
+                request_serializer=Empty.SerializeToString,
+                response_deserializer=Empty.FromString))
+
+    return type('BenchServiceStub', (object,), {'__init__': __init__}), names
+
+
+def bench_uncached(channel, stub, names, lookups):
+    t0 = default_timer()
+    for i in xrange(lookups):
+        getattr(stub(channel), names[i % len(names)])
+    return default_timer() - t0
+
+
+def bench_cached(channel, stub, names, lookups):
+    backend = Backend('localhost:1', channel)
+    t0 = default_timer()
+    for i in xrange(lookups):
+        backend.method(stub, names[i % len(names)])
+    return default_timer() - t0
+
+
+def main(lookups):
+    channel = grpc.insecure_channel('localhost:1')  # never connected
+    print '%8s %16s %16s %8s' % ('methods', 'uncached us/op',
+                                 'cached us/op', 'speedup')
+    for count in (1, 10, 50):
+        stub, names = make_stub_class(count)
+        t_uncached = bench_uncached(channel, stub, names, lookups)
+        t_cached = bench_cached(channel, stub, names, lookups)
+        print '%8d %16.2f %16.2f %7.1fx' % (
+            count, 1e6 * t_uncached / lookups, 1e6 * t_cached / lookups,
+            t_uncached / t_cached)
+    channel.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Measure the reactor lag caused by transcoding responses of growing sizes to
+JSON, inline on the reactor versus offloaded to the transcoding thread
+pool. The lag is sampled by a timer due every PROBE_INTERVAL, while
+gateway routes are fetching responses back to back.
+
+Usage: python -m chameleon.benchmarks.bench_transcode_offload [fetches]
+"""
+
+import sys
+from timeit import default_timer
+
+import structlog
+from google.protobuf import descriptor_pb2
+from twisted.internet import reactor, task
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from chameleon.web_server.gateway import GatewayRoute, GatewaySettings
+
+PROBE_INTERVAL = 0.005
+
+
+class FakeClient(object):
+
+    schema_key = None
+
+    def __init__(self, response):
+        self.response = response
+
+    def invoke(self, stub, method_name, request, metadata, retry=1):
+        # responses arrive through the reactor, as gRPC ones do
+        return task.deferLater(reactor, 0, lambda: (self.response, []))
+
+
+class FakeRequest(object):
+
+    def getAllHeaders(self):
+        return {}
+
+
+def make_response(files):
+    """
+    :return: a FileDescriptorSet of files copies of descriptor.proto, as a
+    stand-in for large, deeply nested responses
+    """
+    fds = descriptor_pb2.FileDescriptorSet()
+    descriptor_pb2.DESCRIPTOR.CopyToProto(fds.file.add())
+    for _ in xrange(files - 1):
+        fds.file.add().CopyFrom(fds.file[0])
+    return fds
+
+
+@inlineCallbacks
+def run(response, offload, fetches):
+    settings = GatewaySettings(transcode_offload=offload)
+    settings.start()
+    route = GatewayRoute(FakeClient(response), 'Bench_Get', 'get', '/bench',
+                         '', None, 'Get', descriptor_pb2.FileDescriptorSet)
+    route.configure(settings)
+
+    lags = []
+    last = [default_timer()]
+
+    def probe():
+        now = default_timer()
+        lags.append(max(now - last[0] - PROBE_INTERVAL, 0))
+        last[0] = now
+
+    probe_loop = task.LoopingCall(probe)
+    probe_loop.start(PROBE_INTERVAL)
+    t0 = default_timer()
+    for _ in xrange(fetches):
+        _, body = yield route.fetch(FakeRequest(), None)
+        yield body.get()
+    elapsed = default_timer() - t0
+    probe_loop.stop()
+    settings.stop()
+
+    lags.sort()
+    returnValue((1e3 * lags[-1], 1e3 * lags[int(len(lags) * 0.99)],
+                 1e3 * elapsed / fetches))
+
+
+@inlineCallbacks
+def main(fetches):
+    print '%10s %8s %12s %12s %12s' % (
+        'bytes', 'mode', 'max lag ms', 'p99 lag ms', 'ms/fetch')
+    for files in (1, 4, 16, 64):
+        response = make_response(files)
+        for mode, offload in (('inline', 0), ('offload', 1)):
+            max_lag, p99_lag, ms = yield run(response, offload, fetches)
+            print '%10d %8s %12.1f %12.1f %12.1f' % (
+                response.ByteSize(), mode, max_lag, p99_lag, ms)
+    reactor.stop()
+
+
+if __name__ == '__main__':
+    # the debug logs of the transcoded responses are dropped, as they would
+    # be at the default log level
+    structlog.configure(processors=[],
+                        logger_factory=structlog.ReturnLoggerFactory())
+    reactor.callWhenRunning(
+        main, int(sys.argv[1]) if len(sys.argv) > 1 else 10)
+    reactor.run()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compare the cost of converting response messages to JSON objects with
+MessageToDict against the encoders generated by gw_gen, on messages shaped
+after the VOLTHA device, port and flow table messages.
+
+Usage: python -m chameleon.benchmarks.bench_transcoding [repeat]
+"""
+
+import sys
+from timeit import default_timer
+
+from google.protobuf import descriptor_pool, text_format
+from google.protobuf.descriptor_pb2 import FileDescriptorProto
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message_factory import MessageFactory
+
+from chameleon.protoc_plugins.gw_gen import generate_encoders
+from chameleon.web_server.transcoding import load_encoders
+
+PROTO = """
+name: "bench_voltha.proto"
+package: "bench"
+syntax: "proto3"
+enum_type {
+  name: "AdminState"
+  value { name: "UNKNOWN" number: 0 }
+  value { name: "ENABLED" number: 1 }
+  value { name: "DISABLED" number: 2 }
+}
+message_type {
+  name: "Port"
+  field { name: "port_no" number: 1 label: LABEL_OPTIONAL type: TYPE_UINT32 }
+  field { name: "label" number: 2 label: LABEL_OPTIONAL type: TYPE_STRING }
+  field { name: "admin_state" number: 3 label: LABEL_OPTIONAL
+          type: TYPE_ENUM type_name: ".bench.AdminState" }
+  field { name: "rx_bytes" number: 4 label: LABEL_OPTIONAL type: TYPE_UINT64 }
+  field { name: "tx_bytes" number: 5 label: LABEL_OPTIONAL type: TYPE_UINT64 }
+}
+message_type {
+  name: "OfpOxmField"
+  field { name: "type" number: 1 label: LABEL_OPTIONAL type: TYPE_UINT32 }
+  field { name: "in_port" number: 2 label: LABEL_OPTIONAL type: TYPE_UINT32
+          oneof_index: 0 }
+  field { name: "vlan_vid" number: 3 label: LABEL_OPTIONAL type: TYPE_UINT32
+          oneof_index: 0 }
+  field { name: "metadata" number: 4 label: LABEL_OPTIONAL type: TYPE_UINT64
+          oneof_index: 0 }
+  oneof_decl { name: "value" }
+}
+message_type {
+  name: "OfpFlowStats"
+  field { name: "id" number: 1 label: LABEL_OPTIONAL type: TYPE_UINT64 }
+  field { name: "table_id" number: 2 label: LABEL_OPTIONAL type: TYPE_UINT32 }
+  field { name: "priority" number: 3 label: LABEL_OPTIONAL type: TYPE_UINT32 }
+  field { name: "cookie" number: 4 label: LABEL_OPTIONAL type: TYPE_UINT64 }
+  field { name: "packet_count" number: 5 label: LABEL_OPTIONAL
+          type: TYPE_UINT64 }
+  field { name: "byte_count" number: 6 label: LABEL_OPTIONAL
+          type: TYPE_UINT64 }
+  field { name: "match" number: 7 label: LABEL_REPEATED type: TYPE_MESSAGE
+          type_name: ".bench.OfpOxmField" }
+}
+message_type {
+  name: "Device"
+  field { name: "id" number: 1 label: LABEL_OPTIONAL type: TYPE_STRING }
+  field { name: "type" number: 2 label: LABEL_OPTIONAL type: TYPE_STRING }
+  field { name: "serial_number" number: 3 label: LABEL_OPTIONAL
+          type: TYPE_STRING }
+  field { name: "admin_state" number: 4 label: LABEL_OPTIONAL
+          type: TYPE_ENUM type_name: ".bench.AdminState" }
+  field { name: "vlan" number: 5 label: LABEL_OPTIONAL type: TYPE_UINT32 }
+  field { name: "ports" number: 6 label: LABEL_REPEATED type: TYPE_MESSAGE
+          type_name: ".bench.Port" }
+  field { name: "flows" number: 7 label: LABEL_REPEATED type: TYPE_MESSAGE
+          type_name: ".bench.OfpFlowStats" }
+}
+message_type {
+  name: "Devices"
+  field { name: "items" number: 1 label: LABEL_REPEATED type: TYPE_MESSAGE
+          type_name: ".bench.Device" }
+}
+"""
+
+
+def make_classes():
+    proto_file = text_format.Parse(PROTO, FileDescriptorProto())
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(proto_file)
+    factory = MessageFactory(pool)
+    encoders = load_encoders(generate_encoders([proto_file], ['bench.Devices']))
+    return (lambda name: factory.GetPrototype(
+        pool.FindMessageTypeByName(name))), encoders
+
+
+def make_devices(message_class, devices, ports, flows):
+    result = message_class('bench.Devices')()
+    for i in xrange(devices):
+        device = result.items.add(
+            id='%016x' % i, type='openolt', serial_number='SN%08d' % i,
+            admin_state=1, vlan=i % 4096)
+        for p in xrange(ports):
+            device.ports.add(port_no=p, label='port-%d' % p, admin_state=1,
+                             rx_bytes=p << 32, tx_bytes=p << 33)
+        for f in xrange(flows):
+            flow = device.flows.add(id=f << 40, table_id=f % 4, priority=1000,
+                                    cookie=f << 36, packet_count=f,
+                                    byte_count=f * 64)
+            flow.match.add(type=0, in_port=f % ports if ports else 0)
+            flow.match.add(type=6, vlan_vid=4096 + f % 4096)
+            flow.match.add(type=2, metadata=f << 32)
+    return result
+
+
+def bench(convert, message, repeat):
+    t0 = default_timer()
+    for _ in xrange(repeat):
+        convert(message)
+    return 1e3 * (default_timer() - t0) / repeat
+
+
+def main(repeat):
+    message_class, encoders = make_classes()
+    encode = encoders['bench.Devices']
+    print '%32s %10s %14s %14s %8s' % (
+        'message', 'bytes', 'MessageToDict', 'generated', 'speedup')
+    for devices, ports, flows in ((1, 16, 0), (1, 16, 256), (16, 16, 64),
+                                  (128, 16, 64)):
+        message = make_devices(message_class, devices, ports, flows)
+        assert encode(message) == MessageToDict(message, True, True)
+        reflective = bench(lambda m: MessageToDict(m, True, True), message,
+                           repeat)
+        generated = bench(encode, message, repeat)
+        print '%32s %10d %12.2fms %12.2fms %7.1fx' % (
+            '%d devices, %d ports, %d flows' % (devices, ports, flows),
+            message.ByteSize(), reflective, generated,
+            reflective / generated)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,159 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Client-side load balancing over the gRPC channels of all known backend
+instances. Each request goes to the less loaded of two randomly chosen
+backends ("power of two choices" over the outstanding request counts).
+"""
+
+from random import sample
+
+from structlog import get_logger
+from twisted.internet import reactor
+from werkzeug.exceptions import ServiceUnavailable
+
+log = get_logger()
+
+
+class Backend(object):
+
+    def __init__(self, endpoint, channel):
+        self.endpoint = endpoint
+        self.channel = channel
+        self.in_flight = 0
+        self.requests = 0
+        self.draining = False
+        self.methods = {}  # (stub class, method name) -> multi-callable
+
+    def method(self, stub, method_name, streaming=False):
+        """
+        :return: the multi-callable of method_name, on a stub instance bound
+        to this backend's channel. Both are built once per channel, instead
+        of once per call. With no stub, method_name is the full path of a
+        unary (or if streaming, server-streaming) method, as in
+        /<package>.<Service>/<Method>, called with serialized requests and
+        returning serialized responses.
+        """
+        try:
+            return self.methods[stub, method_name]
+        except KeyError:
+            if stub is None:
+                method = (self.channel.unary_stream if streaming
+                          else self.channel.unary_unary)(method_name)
+            else:
+                method = getattr(stub(self.channel), method_name)
+            self.methods[stub, method_name] = method
+            return method
+
+
+class Balancer(object):
+
+    # grpc polls the connectivity of a channel every 0.2s; give the poller
+    # of a just unsubscribed channel the time to stop before closing it
+    CLOSE_DELAY = 1
+
+    def __init__(self, channel_factory):
+        """
+        :param channel_factory: channel_factory(endpoint) -> grpc.Channel
+        """
+        self.channel_factory = channel_factory
+        self.backends = {}  # endpoint -> Backend
+        self.active = []  # backends not draining
+
+    def update(self, endpoints):
+        """
+        Make the given endpoints the active set. Backends no longer listed
+        are drained: they get no new requests, and their channel is closed
+        once their outstanding requests completed.
+        """
+        for endpoint in endpoints:
+            backend = self.backends.get(endpoint)
+            if backend is None:
+                self.backends[endpoint] = Backend(
+                    endpoint, self.channel_factory(endpoint))
+            elif backend.draining:
+                log.info('backend-restored', endpoint=endpoint)
+                backend.draining = False
+
+        for backend in self.backends.values():
+            if backend.endpoint not in endpoints and not backend.draining:
+                log.info('backend-draining', endpoint=backend.endpoint,
+                         in_flight=backend.in_flight)
+                backend.draining = True
+                self._remove_if_drained(backend)
+
+        self.active = [b for b in self.backends.itervalues()
+                       if not b.draining]
+
+    def clear_stubs(self):
+        """
+        Drop the cached stubs, e.g. since their classes went stale with a
+        schema change
+        """
+        for backend in self.backends.itervalues():
+            backend.methods.clear()
+
+    def reset(self):
+        """
+        Drain all backends, so that the next update() connects to its
+        endpoints on fresh channels. As with update(), the channels of the
+        drained backends are closed once their outstanding requests
+        completed.
+        """
+        backends, self.backends = self.backends, {}
+        self.active = []
+        for backend in backends.itervalues():
+            if not backend.draining:
+                log.info('backend-draining', endpoint=backend.endpoint,
+                         in_flight=backend.in_flight)
+                backend.draining = True
+            self._remove_if_drained(backend)
+
+    def pick(self):
+        """
+        :return: the Backend to send the next request to
+        """
+        if not self.active:
+            raise ServiceUnavailable()
+        if len(self.active) == 1:
+            return self.active[0]
+        a, b = sample(self.active, 2)
+        return a if a.in_flight <= b.in_flight else b
+
+    def acquire(self):
+        backend = self.pick()
+        backend.in_flight += 1
+        backend.requests += 1
+        return backend
+
+    def release(self, backend):
+        backend.in_flight -= 1
+        self._remove_if_drained(backend)
+
+    def _remove_if_drained(self, backend):
+        if backend.draining and backend.in_flight == 0:
+            log.info('backend-removed', endpoint=backend.endpoint)
+            if self.backends.get(backend.endpoint) is backend:
+                del self.backends[backend.endpoint]
+            backend.methods.clear()
+            reactor.callLater(self.CLOSE_DELAY, backend.channel.close)
+
+    def stats(self):
+        return dict((b.endpoint, dict(in_flight=b.in_flight,
+                                      requests=b.requests,
+                                      draining=b.draining))
+                    for b in self.backends.itervalues())
@@ -0,0 +1,155 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Watch of the healthy instances of a service registered in Consul. Uses
+Consul blocking queries over the asynchronous Twisted HTTP client, so the
+endpoint set is refreshed as soon as Consul sees a change, without
+polling and without ever blocking the reactor.
+"""
+
+from urllib import quote
+
+from simplejson import loads
+from structlog import get_logger
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred, \
+    inlineCallbacks, returnValue, succeed
+from twisted.web.client import Agent, readBody
+
+from chameleon.utils.asleep import asleep
+
+log = get_logger()
+
+
+class ConsulServiceWatch(object):
+
+    RETRY_BACKOFF = [0.5, 1, 2, 5]
+
+    def __init__(self, consul_endpoint, service_name, wait=30,
+                 change_callback=None):
+        """
+        :param consul_endpoint: <host>:<port> of the Consul agent
+        :param service_name: name of the watched service
+        :param wait: max seconds a blocking query waits for a change
+        :param change_callback: called with the endpoint set after each
+        change of the set
+        """
+        self.base_url = 'http://%s/v1/health/service/%s' % (
+            consul_endpoint.strip(), quote(service_name))
+        self.service_name = service_name
+        self.wait = wait
+        self.change_callback = change_callback
+
+        self.agent = Agent(reactor, connectTimeout=5)
+        self.endpoints = set()  # '<host>:<port>' strings, updated in place
+        self.index = None
+        self.retries = 0
+        self.stopped = False
+        self._query = None
+        self._waiting = []  # Deferreds waiting for a non-empty set
+
+    def start(self):
+        log.debug('starting', service_name=self.service_name)
+        reactor.callLater(0, self._watch)
+        return self
+
+    def stop(self):
+        self.stopped = True
+        if self._query is not None:
+            self._query.cancel()
+        log.info('stopped', service_name=self.service_name)
+
+    def get_endpoints(self):
+        """
+        :return: Deferred fired with the (sorted) list of healthy endpoints,
+        as soon as there is at least one
+        """
+        if self.endpoints:
+            return succeed(sorted(self.endpoints))
+        d = Deferred()
+        self._waiting.append(d)
+        return d
+
+    @inlineCallbacks
+    def _watch(self):
+        while not self.stopped:
+            try:
+                index, entries = yield self._blocking_query()
+            except CancelledError:
+                break
+            except Exception as e:
+                if self.stopped:
+                    break  # the query was cancelled while under way
+                wait_time = self.RETRY_BACKOFF[min(
+                    self.retries, len(self.RETRY_BACKOFF) - 1)]
+                self.retries += 1
+                log.warning('consul-query-failed', e=e, retry_in=wait_time,
+                            service_name=self.service_name)
+                yield asleep(wait_time)
+                continue
+
+            self.retries = 0
+            # per Consul docs, start over if the index goes backwards
+            self.index = index if index >= self.index else None
+            self._update(entries)
+
+    @inlineCallbacks
+    def _blocking_query(self):
+        url = '%s?passing&wait=%ds' % (self.base_url, self.wait)
+        if self.index is not None:
+            url += '&index=%d' % self.index
+        log.debug('consul-query', url=url)
+
+        self._query = self.agent.request('GET', url)
+        self._query.addTimeout(self.wait + 10, reactor)
+        try:
+            response = yield self._query
+            body = yield readBody(response)
+        finally:
+            self._query = None
+
+        if response.code != 200:
+            raise Exception('consul returned %d: %s' % (response.code, body))
+        index = int(response.headers.getRawHeaders(
+            'X-Consul-Index', ['0'])[0])
+        returnValue((index, loads(body)))
+
+    def _update(self, entries):
+        endpoints = set()
+        for entry in entries:
+            service = entry['Service']
+            address = service.get('Address') or entry['Node']['Address']
+            endpoints.add('%s:%d' % (address, service['Port']))
+
+        if endpoints == self.endpoints:
+            return
+
+        log.info('consul-endpoints-changed', service_name=self.service_name,
+                 added=sorted(endpoints - self.endpoints),
+                 removed=sorted(self.endpoints - endpoints))
+        self.endpoints.intersection_update(endpoints)
+        self.endpoints.update(endpoints)
+        if not endpoints:
+            log.warning('no-service', service_name=self.service_name)
+
+        if self.change_callback is not None:
+            self.change_callback(self.endpoints)
+
+        if self.endpoints:
+            waiting, self._waiting = self._waiting, []
+            for d in waiting:
+                d.callback(sorted(self.endpoints))
@@ -20,20 +20,35 @@ end-point's schema by calling SchemaService.Schema(Empty) and all of its
 semantics are derived from the recovered schema.
 """
 
+import inspect
 import os
 import sys
-from random import randint
+from collections import deque
+from hashlib import sha256
+from time import time
 from zlib import decompress
 
 import functools
 import grpc
-from consul import Consul
+import pkg_resources
+from google.protobuf.compiler.plugin_pb2 import CodeGeneratorRequest, \
+    CodeGeneratorResponse
+from google.protobuf.descriptor_pb2 import FileDescriptorSet
 from grpc._channel import _Rendezvous
+from grpc_tools import protoc
 from structlog import get_logger
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import CancelledError, Deferred, \
+    inlineCallbacks, returnValue
+from twisted.python.failure import Failure
 from werkzeug.exceptions import ServiceUnavailable
 
+from chameleon.grpc_client.balancer import Balancer
+from chameleon.grpc_client.consul_watch import ConsulServiceWatch
+from chameleon.grpc_client.response_stream import ResponseStream
+from chameleon.grpc_client.schema_cache import SchemaCache
+from chameleon.protoc_plugins import descriptor_parser, gw_gen, \
+    swagger_gen, swagger_template
 from chameleon.protos.schema_pb2_grpc import SchemaServiceStub
 from google.protobuf.empty_pb2 import Empty
 
@@ -42,6 +57,32 @@ from chameleon.utils.asleep import asleep
 log = get_logger()
 
 
+def future_to_deferred(future):
+    """
+    Bridge a gRPC future (as returned by the multi-callable's future()
+    method) into a Twisted Deferred. The gRPC completion callback runs on
+    a gRPC thread, so the result is handed back to the reactor thread
+    before the Deferred is fired. Cancelling the Deferred cancels the RPC.
+    :param future: A grpc.Future that is also a grpc.Call
+    :return: Deferred fired with (response, trailing_metadata)
+    """
+    d = Deferred(canceller=lambda _: future.cancel())
+
+    def _fire(f):
+        if d.called:
+            return  # already cancelled
+        try:
+            response = f.result()
+        except Exception:
+            d.errback(Failure())
+        else:
+            d.callback((response, f.trailing_metadata()))
+
+    future.add_done_callback(
+        lambda f: reactor.callFromThread(_fire, f))
+    return d
+
+
 class GrpcClient(object):
     """
     Connect to a gRPC server, fetch its schema, and process the downloaded
@@ -49,27 +90,48 @@ class GrpcClient(object):
     of Chameleon.
     """
     RETRY_BACKOFF = [0.05, 0.1, 0.2, 0.5, 1, 2, 5]
+    DESCRIPTOR_SET = 'schema.desc'
+
+    # keep HTTP/2 stream windows at their initial size; grown by BDP
+    # probing, they let a server stream run megabytes ahead of a paused
+    # ResponseStream, defeating its backpressure
+    CHANNEL_OPTIONS = [('grpc.http2.bdp_probe', 0)]
 
     def __init__(self, consul_endpoint, work_dir, endpoint='localhost:50055',
-                 reconnect_callback=None, credentials=None, restart_on_disconnect=False):
+                 reconnect_callback=None, credentials=None, restart_on_disconnect=False,
+                 schema_cache_dir=None, schema_cache_size=4,
+                 dynamic_gateway=False, recover_on_disconnect=False):
         self.consul_endpoint = consul_endpoint
         self.endpoint = endpoint
         self.work_dir = work_dir
         self.reconnect_callback = reconnect_callback
         self.credentials = credentials
         self.restart_on_disconnect = restart_on_disconnect
+        self.recover_on_disconnect = recover_on_disconnect
+        self.dynamic_gateway = dynamic_gateway
+        self.schema_cache = None if dynamic_gateway else SchemaCache(
+            schema_cache_dir or os.path.join(work_dir, 'schemas'),
+            schema_cache_size, salt=self._generator_fingerprint())
 
         self.google_api_dir = os.path.abspath(os.path.join(
             os.path.dirname(__file__), '../protos'))
-        self.plugin_dir = os.path.abspath(os.path.join(
-            os.path.dirname(__file__), '../protoc_plugins'))
+        self.well_known_dir = pkg_resources.resource_filename(
+            'grpc_tools', '_proto')
 
-        self.channel = None
+        self.balancer = Balancer(self._make_channel)
+        self.channel = None  # channel for the schema and connectivity
+        self.connectivity_subscription = None
+        self.consul_watch = None
         self.schema = None
+        self.schema_key = None
+        self.schema_dir = None  # directory of the active compiled schema
         self.retries = 0
         self.shutting_down = False
         self.connected = False
+        self.connecting = False
         self.was_connected = False
+        self.recovery_started = None
+        self.recovery_times = deque(maxlen=100)  # seconds, most recent last
 
     def start(self):
         log.debug('starting')
@@ -83,6 +145,10 @@ class GrpcClient(object):
         if self.shutting_down:
             return
         self.shutting_down = True
+        if self.consul_watch is not None:
+            self.consul_watch.stop()
+        self._unmonitor_channel()
+        self.balancer.reset()
         log.info('stopped')
 
     def set_reconnect_callback(self, reconnect_callback):
@@ -91,8 +157,12 @@ class GrpcClient(object):
 
     def connectivity_callback(self, client, connectivity):
         if (self.was_connected) and (connectivity in [connectivity.TRANSIENT_FAILURE, connectivity.SHUTDOWN]):
-            log.info("connectivity lost -- restarting")
-            os.execv(sys.executable, ['python'] + sys.argv)
+            if self.recover_on_disconnect:
+                log.info("connectivity lost -- recovering")
+                self.was_connected = False
+                reactor.callFromThread(self._recover)
+                return
+            self._restart('connectivity lost')
 
         if (connectivity == connectivity.READY):
             self.was_connected = True
@@ -104,40 +174,103 @@ class GrpcClient(object):
             # The result will probably show IDLE, but passing in True has the side effect of reconnecting if the
             # connection has been lost, which will trigger the TRANSIENT_FALURE we were looking for.
 
+    @staticmethod
+    def _restart(reason):
+        log.info('%s -- restarting' % reason)
+        os.execv(sys.executable, ['python'] + sys.argv)
+
+    def _recover(self):
+        """
+        In-process alternative to restarting on connectivity loss: drop the
+        channel and reconnect, while the web server keeps serving (failing
+        gateway requests with 503 until the connection is back).
+        """
+        if self.shutting_down or self.recovery_started is not None:
+            return
+        self.recovery_started = time()
+        self.connected = False
+        self._unmonitor_channel()
+        self.balancer.reset()
+        self.connect()
+
+    def _make_channel(self, endpoint):
+        if self.credentials:
+            log.info('securely connecting', endpoint=endpoint)
+            return grpc.secure_channel(endpoint, self.credentials,
+                                       options=self.CHANNEL_OPTIONS)
+        else:
+            log.info('insecurely connecting', endpoint=endpoint)
+            return grpc.insecure_channel(endpoint,
+                                         options=self.CHANNEL_OPTIONS)
+
+    def _monitor_channel(self):
+        """
+        Pick the channel used to retrieve the schema, and to watch the
+        connectivity (if asked for) on
+        """
+        self._unmonitor_channel()
+        self.channel = self.balancer.pick().channel
+        if self.restart_on_disconnect or self.recover_on_disconnect:
+            self.connectivity_subscription = functools.partial(
+                self.connectivity_callback, self)
+            self.channel.subscribe(self.connectivity_subscription)
+
+    def _unmonitor_channel(self):
+        if self.connectivity_subscription is not None:
+            self.channel.unsubscribe(self.connectivity_subscription)
+            self.connectivity_subscription = None
+        self.channel = None
+        self.was_connected = False
+
+    def _endpoints_changed(self, endpoints):
+        if not endpoints or self.balancer.active == []:
+            return  # nothing to balance on, or (re)connecting
+        monitored = [b.endpoint for b in self.balancer.active
+                     if b.channel is self.channel]
+        if not set(monitored) & endpoints:
+            # stop watching the channel before the balancer drains it
+            self._unmonitor_channel()
+        self.balancer.update(sorted(endpoints))
+        if self.channel is None:
+            self._monitor_channel()
+
     @inlineCallbacks
     def connect(self):
         """
         (Re-)Connect to end-point
         """
 
-        if self.shutting_down or self.connected:
+        if self.shutting_down or self.connected or self.connecting:
             return
+        self.connecting = True  # until connected, or the retry is scheduled
 
         try:
             if self.endpoint.startswith('@'):
-                _endpoint = yield self._get_endpoint_from_consul(
+                endpoints = yield self._get_endpoints_from_consul(
                     self.endpoint[1:])
             else:
-                _endpoint = self.endpoint
-
-            if self.credentials:
-                log.info('securely connecting', endpoint=_endpoint)
-                self.channel = grpc.secure_channel(_endpoint, self.credentials)
-            else:
-                log.info('insecurely connecting', endpoint=_endpoint)
-                self.channel = grpc.insecure_channel(_endpoint)
+                endpoints = [self.endpoint]
 
-            if self.restart_on_disconnect:
-                connectivity_callback = functools.partial(self.connectivity_callback, self)
-                self.channel.subscribe(connectivity_callback)
+            self.balancer.update(endpoints)
+            self._monitor_channel()
 
-            swagger_from = self._retrieve_schema()
-            self._compile_proto_files(swagger_from)
+            schemas = yield self._retrieve_schema()
+            schema_changed = schemas != self.schema
+            # generated routes look up the channel on each call, so they
+            # only need to be reloaded if the schema changed
+            if schema_changed:
+                self._activate_schema(schemas)
+            else:
+                log.info('schema-unchanged')
             self._clear_backoff()
 
             self.connected = True
-            if self.reconnect_callback is not None:
-                reactor.callLater(0, self.reconnect_callback)
+            self.connecting = False
+            if self.recovery_started is not None:
+                self.recovery_times.append(time() - self.recovery_started)
+                self.recovery_started = None
+                log.info('recovered', duration=self.recovery_times[-1],
+                         schema_changed=schema_changed)
 
             return
 
@@ -149,12 +282,42 @@ class GrpcClient(object):
             yield self._backoff('not-available')
 
         except Exception as e:
-            if not self.shutting_down:
-                log.exception('cannot-connect', endpoint=_endpoint)
+            if self.shutting_down or isinstance(e, CancelledError):
+                self.connecting = False
+                return  # given up on, not to be retried
+            log.exception('cannot-connect', endpoint=self.endpoint)
             yield self._backoff('unknown-error')
 
+        self.connecting = False
         reactor.callLater(0, self.connect)
 
+    def _activate_schema(self, schemas):
+        """
+        Load schemas, and have the reconnect callback build and swap in its
+        routes. Should either fail, the previous schema and its routes stay
+        active, and the next connect() tries again.
+        """
+        if not self.dynamic_gateway and self.schema is not None:
+            # the generated modules of the new schema cannot be imported
+            # next to the old ones, which hold on to their files in the
+            # default descriptor pool
+            self._restart('schema changed')
+
+        previous = self.schema, self.schema_dir, self.schema_key
+        try:
+            if not self.dynamic_gateway:
+                self._load_schema(schemas)
+            else:
+                self.schema_key = sha256(
+                    schemas.SerializeToString()).hexdigest()
+            self.schema = schemas  # the dynamic gateway is built from it
+            if self.reconnect_callback is not None:
+                self.reconnect_callback()
+        except Exception:
+            self.schema, self.schema_dir, self.schema_key = previous
+            raise
+        self.balancer.clear_stubs()
+
     def _backoff(self, msg):
         wait_time = self.RETRY_BACKOFF[min(self.retries,
                                            len(self.RETRY_BACKOFF) - 1)]
@@ -167,129 +330,179 @@ class GrpcClient(object):
             log.info('reconnected', after_retries=self.retries)
             self.retries = 0
 
-    @inlineCallbacks
-    def _get_endpoint_from_consul(self, service_name):
+    def _get_endpoints_from_consul(self, service_name):
         """
-        Look up an appropriate grpc endpoint (host, port) from
-        consul, under the service name specified by service-name
+        Look up all healthy grpc endpoints (host:port) from consul, under
+        the service name specified by service-name. The balancer follows
+        later changes of the set.
         """
-        host = self.consul_endpoint.split(':')[0].strip()
-        port = int(self.consul_endpoint.split(':')[1].strip())
-
-        while True:
-            log.debug('consul-lookup', host=host, port=port)
-            consul = Consul(host=host, port=port)
-            _, services = consul.catalog.service(service_name)
-            log.debug('consul-response', services=services)
-            if services:
-                break
-            log.warning('no-service', consul_host=host, consul_port=port,
-                        service_name=service_name)
-            yield asleep(1.0)
-
-        # pick local addresses when resolving a service via consul
-        # see CORD-815 (https://jira.opencord.org/browse/CORD-815)
-
-        service = services[randint(0, len(services) - 1)]
-        endpoint = '{}:{}'.format(service['ServiceAddress'],
-                                  service['ServicePort'])
-        returnValue(endpoint)
+        if self.consul_watch is None:
+            self.consul_watch = ConsulServiceWatch(
+                self.consul_endpoint, service_name,
+                change_callback=self._endpoints_changed).start()
+        return self.consul_watch.get_endpoints()
 
+    @inlineCallbacks
     def _retrieve_schema(self):
         """
-        Retrieve schema from gRPC end-point, and save all *.proto files in
-        the work directory.
+        Retrieve schema from gRPC end-point, without blocking the reactor,
+        so that the web server keeps serving while a backend is slow to
+        answer.
+        :return: Deferred fired with the Schemas protobuf message
         """
         assert isinstance(self.channel, grpc.Channel)
         stub = SchemaServiceStub(self.channel)
-        # try:
-        schemas = stub.GetSchema(Empty(), timeout=120)
-        # except _Rendezvous, e:
-        #     if e.code == grpc.StatusCode.UNAVAILABLE:
-        #
-        #     else:
-        #         raise e
-
-        os.system('mkdir -p %s' % self.work_dir)
-        os.system('rm -fr /tmp/%s/*' %
-                  self.work_dir.replace('/tmp/', ''))  # safer
+        schemas, _ = yield future_to_deferred(
+            stub.GetSchema.future(Empty(), timeout=120))
+        returnValue(schemas)
 
+    def _load_schema(self, schemas):
+        """
+        Make the compiled form of schemas the active one, compiling it only
+        if the schema cache holds no entry for it yet.
+        """
+        key = self.schema_cache.key_for(schemas)
+        schema_dir = self.schema_cache.lookup(key)
+        if schema_dir is None:
+            log.info('schema-cache-miss', key=key)
+            schema_dir = self.schema_cache.build(
+                key, lambda d: self._build_schema(d, schemas))
+        else:
+            log.info('schema-cache-hit', key=key)
+        self._import_schema(schema_dir)
+        self.schema_key = key
+
+    @staticmethod
+    def _generator_fingerprint():
+        """
+        Digest of the code generators, so that cached schemas compiled by a
+        different version of chameleon are not picked up.
+        """
+        return sha256(''.join(
+            inspect.getsource(m) for m in (gw_gen, swagger_gen,
+                                           swagger_template,
+                                           descriptor_parser))).hexdigest()
+
+    def _build_schema(self, schema_dir, schemas):
+        self._save_proto_files(schema_dir, schemas)
+        self._compile_proto_files(schema_dir, schemas.swagger_from)
+
+    def _save_proto_files(self, schema_dir, schemas):
+        """
+        Save all *.proto files and their descriptors in schema_dir.
+        """
         for proto_file in schemas.protos:
             proto_fname = proto_file.file_name
             proto_content = proto_file.proto
-            log.debug('saving-proto', fname=proto_fname, dir=self.work_dir,
+            log.debug('saving-proto', fname=proto_fname, dir=schema_dir,
                       length=len(proto_content))
-            with open(os.path.join(self.work_dir, proto_fname), 'w') as f:
+            with open(os.path.join(schema_dir, proto_fname), 'w') as f:
                 f.write(proto_content)
 
             desc_content = decompress(proto_file.descriptor)
             desc_fname = proto_fname.replace('.proto', '.desc')
-            log.debug('saving-descriptor', fname=desc_fname, dir=self.work_dir,
+            log.debug('saving-descriptor', fname=desc_fname, dir=schema_dir,
                       length=len(desc_content))
-            with open(os.path.join(self.work_dir, desc_fname), 'wb') as f:
+            with open(os.path.join(schema_dir, desc_fname), 'wb') as f:
                 f.write(desc_content)
-        return schemas.swagger_from
 
-    def _compile_proto_files(self, swagger_from):
+    def _compile_proto_files(self, schema_dir, swagger_from):
         """
-        For each *.proto file in the work directory, compile the proto
-        file into the respective *_pb2.py file as well as generate the
-        web server gateway python file *_gw.py.
+        Compile all *.proto files in schema_dir in a single,
+        in-process protoc pass into the respective *_pb2.py and
+        *_pb2_grpc.py files, then run the gateway (*_gw.py) and swagger
+        generators as library calls on the resulting descriptors.
         :return: None
         """
 
-        chameleon_base_dir = os.path.abspath(os.path.join(
-            os.path.dirname(__file__), '../..'
-        ))
-
-        for fname in [f for f in os.listdir(self.work_dir)
-                      if f.endswith('.proto')]:
-
-            need_swagger = fname == swagger_from
-            log.debug('compiling', file=fname, need_swagger=need_swagger)
-            cmd = (
-                'cd %s && '
-                'env PATH=%s PYTHONPATH=%s '
-                'python -m grpc.tools.protoc '
-                '-I. -I %s '
-                '--python_out=. '
-                '--grpc_python_out=. '
-                '--plugin=protoc-gen-gw=%s/gw_gen.py '
-                '--gw_out=. '
-                '--plugin=protoc-gen-swagger=%s/swagger_gen.py '
-                '%s'
-                '%s' % (
-                    self.work_dir,
-                    ':'.join([os.environ['PATH'], self.plugin_dir]),
-                    chameleon_base_dir,
-                    self.google_api_dir,
-                    self.plugin_dir,
-                    self.plugin_dir,
-                    '--swagger_out=. ' if need_swagger else '',
-                    fname)
-            )
-            log.debug('executing', cmd=cmd, file=fname)
-            os.system(cmd)
-            log.info('compiled', file=fname)
-
-        # test-load each _pb2 file to see all is right
-        if self.work_dir not in sys.path:
-            sys.path.insert(0, self.work_dir)
-
-        for fname in [f for f in os.listdir(self.work_dir)
+        protos = sorted(f for f in os.listdir(schema_dir)
+                        if f.endswith('.proto'))
+        desc_fname = os.path.join(schema_dir, self.DESCRIPTOR_SET)
+
+        t0 = time()
+        log.debug('compiling', files=protos)
+        rc = protoc.main([
+            'grpc_tools.protoc',
+            '-I%s' % schema_dir,
+            '-I%s' % self.google_api_dir,
+            '-I%s' % self.well_known_dir,
+            '--python_out=%s' % schema_dir,
+            '--grpc_python_out=%s' % schema_dir,
+            '--include_imports',
+            '--include_source_info',
+            '--descriptor_set_out=%s' % desc_fname
+        ] + [os.path.join(schema_dir, f) for f in protos])
+        if rc != 0:
+            raise Exception('protoc failed with exit code %d' % rc)
+
+        descriptor_set = FileDescriptorSet()
+        with open(desc_fname, 'rb') as f:
+            descriptor_set.ParseFromString(f.read())
+        t1 = time()
+
+        request = CodeGeneratorRequest(file_to_generate=protos)
+        request.proto_file.extend(descriptor_set.file)
+        response = CodeGeneratorResponse()
+        gw_gen.generate_code(request, response)
+        self._write_generated_files(schema_dir, response)
+        t2 = time()
+
+        if swagger_from:
+            with open(os.path.join(schema_dir, 'swagger.json'), 'w') as f:
+                f.write(swagger_gen.generate_swagger(descriptor_set.file,
+                                                    swagger_from))
+        t3 = time()
+
+        log.info('compiled', files=len(protos), swagger_from=swagger_from,
+                 protoc_time=t1 - t0, gw_time=t2 - t1, swagger_time=t3 - t2)
+
+    def _import_schema(self, schema_dir):
+        """
+        Make the generated modules in schema_dir importable, and test-load
+        each _pb2 file to see all is right. The modules are never unloaded:
+        the routes built from them use them for as long as they serve, and
+        a changed schema restarts chameleon (see connect()).
+        """
+        self.schema_dir = schema_dir
+
+        if schema_dir not in sys.path:
+            sys.path.insert(0, schema_dir)
+
+        t0 = time()
+        for fname in [f for f in os.listdir(schema_dir)
                       if f.endswith('_pb2.py')]:
             modname = fname[:-len('.py')]
             log.debug('test-import', modname=modname)
             _ = __import__(modname)
+        log.info('imported', schema_dir=schema_dir, import_time=time() - t0)
+
+    def _write_generated_files(self, schema_dir, response):
+        if response.error:
+            raise Exception('code generation failed: %s' % response.error)
+        for generated in response.file:
+            fname = os.path.join(schema_dir, generated.name)
+            dirname = os.path.dirname(fname)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            log.debug('saving-generated', fname=generated.name,
+                      length=len(generated.content))
+            with open(fname, 'w') as f:
+                f.write(generated.content)
 
     @inlineCallbacks
-    def invoke(self, stub, method_name, request, metadata, retry=1):
+    def invoke(self, stub, method_name, request, metadata, retry=1,
+               on_call=None):
         """
         Invoke a gRPC call to the remote server and return the response.
-        :param stub: Reference to the *_pb2 service stub
-        :param method_name: The method name inside the service stub
+        The call is issued through the gRPC future API, so the reactor is
+        free to serve other requests while the call is outstanding.
+        :param stub: Reference to the *_pb2 service stub, or None to call
+        the method with a serialized request, for a serialized response
+        :param method_name: The method name inside the service stub, or
+        the full method path (/<package>.<Service>/<Method>) if no stub
         :param request: The request protobuf message
         :param metadata: [(str, str), (str, str), ...]
+        :param on_call: on_call(call), called with the gRPC call once issued
         :return: The response protobuf message and returned trailing metadata
         """
 
@@ -297,9 +510,22 @@ class GrpcClient(object):
             raise ServiceUnavailable()
 
         try:
-            method = getattr(stub(self.channel), method_name)
-            response, rendezvous = method.with_call(request, metadata=metadata)
-            returnValue((response, rendezvous.trailing_metadata()))
+            backend = self.balancer.acquire()
+            try:
+                method = backend.method(stub, method_name)
+                future = method.future(request, metadata=metadata)
+                if on_call is not None:
+                    on_call(future)
+                response, trailing_metadata = yield future_to_deferred(
+                    future)
+            finally:
+                self.balancer.release(backend)
+            returnValue((response, trailing_metadata))
+
+        except grpc.FutureCancelledError:
+            # cancelled through on_call, e.g. on a bad request message
+            log.debug('call-cancelled', method=method_name)
+            raise
 
         except grpc._channel._Rendezvous as e:
             code = e.code()
@@ -312,7 +538,8 @@ class GrpcClient(object):
                     if retry > 0:
                         response = yield self.invoke(stub, method_name,
                                                      request, metadata,
-                                                     retry=retry - 1)
+                                                     retry=retry - 1,
+                                                     on_call=on_call)
                         returnValue(response)
 
             elif code in (
@@ -328,3 +555,47 @@ class GrpcClient(object):
                 log.exception(e)
 
             raise e
+
+    def invoke_stream(self, stub, method_name, request, metadata,
+                      on_response):
+        """
+        Invoke a server-streaming gRPC call.
+        :param stub: Reference to the *_pb2 service stub, or None to call
+        the method with a serialized request, for serialized responses
+        :param method_name: The method name inside the service stub, or
+        the full method path (/<package>.<Service>/<Method>) if no stub
+        :param request: The request protobuf message
+        :param metadata: [(str, str), (str, str), ...]
+        :param on_response: on_response(response), called for each response
+        protobuf message as it arrives
+        :return: ResponseStream, to be registered as producer with the
+        consumer of the responses, and started
+        """
+
+        if not self.connected:
+            raise ServiceUnavailable()
+
+        backend = self.balancer.acquire()
+        try:
+            call = backend.method(stub, method_name, streaming=True)(
+                request, metadata=metadata)
+        except Exception:
+            self.balancer.release(backend)
+            raise
+
+        stream = ResponseStream(call, on_response)
+
+        def ended(result):
+            self.balancer.release(backend)
+            if isinstance(result, Failure) and \
+                    result.check(_Rendezvous) and \
+                    result.value.code() == grpc.StatusCode.UNAVAILABLE:
+                if self.connected:
+                    self.connected = False
+                    self.connect()
+                if stream.count == 0:
+                    return Failure(ServiceUnavailable())
+            return result
+
+        stream.done.addBoth(ended)
+        return stream
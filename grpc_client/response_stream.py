@@ -0,0 +1,116 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Server-streaming gRPC calls as Twisted push producers. The responses are
+read off the call in a dedicated thread, as reading blocks until the next
+response arrives, which can take arbitrarily long on event streams. They
+are handed over to the reactor with at most WINDOW of them pending, and
+no further response is read while the consumer paused the producer, so
+that gRPC flow control pushes back on the server in turn.
+"""
+
+from threading import Event, Semaphore, Thread
+
+from structlog import get_logger
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IPushProducer
+from twisted.python.failure import Failure
+from zope.interface import implementer
+
+log = get_logger()
+
+
+@implementer(IPushProducer)
+class ResponseStream(object):
+
+    WINDOW = 16  # max responses read, but not yet delivered
+
+    def __init__(self, call, on_response):
+        """
+        :param call: the response iterator of a server-streaming call
+        :param on_response: on_response(response), called in the reactor
+        thread for each response
+        """
+        self.call = call
+        self.on_response = on_response
+        self.count = 0  # responses delivered so far
+        self.done = Deferred(lambda _: self.stopProducing())
+        self._resumed = Event()
+        self._resumed.set()
+        self._credits = Semaphore(self.WINDOW)
+        self._stopped = False
+
+    def start(self):
+        """
+        :return: Deferred fired once all responses were delivered, or with
+        the failure of the call
+        """
+        thread = Thread(target=self._read, name='grpc-response-stream')
+        thread.daemon = True
+        thread.start()
+        return self.done
+
+    def pauseProducing(self):
+        self._resumed.clear()
+
+    def resumeProducing(self):
+        self._resumed.set()
+
+    def stopProducing(self):
+        self._stopped = True
+        self._resumed.set()
+        self._credits.release()
+        self.call.cancel()
+
+    def _read(self):
+        try:
+            while True:
+                self._resumed.wait()
+                self._credits.acquire()
+                if self._stopped:
+                    return
+                try:
+                    response = next(self.call)
+                except StopIteration:
+                    break
+                reactor.callFromThread(self._deliver, response)
+            result = None
+        except Exception:
+            result = Failure()
+        if not self._stopped:
+            reactor.callFromThread(self._finish, result)
+
+    def _deliver(self, response):
+        self._credits.release()
+        if self._stopped or self.done.called:
+            return
+        self.count += 1
+        try:
+            self.on_response(response)
+        except Exception:
+            failure = Failure()
+            self.stopProducing()
+            self.done.errback(failure)
+
+    def _finish(self, result):
+        if self.done.called:
+            return  # cancelled meanwhile
+        if isinstance(result, Failure):
+            self.done.errback(result)
+        else:
+            self.done.callback(self.count)
@@ -0,0 +1,105 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Content-addressed, on-disk cache of compiled schemas. Every entry is a
+directory named after the hash of the Schemas message it was compiled
+from, holding the saved protos as well as the generated *_pb2.py,
+*_pb2_grpc.py, *_gw.py and swagger.json files. Since entries never change
+once complete, a reconnect (or a restart) against a backend serving an
+identical schema can use an existing entry as-is.
+"""
+
+import os
+import shutil
+from hashlib import sha256
+from tempfile import mkdtemp
+
+from structlog import get_logger
+
+log = get_logger()
+
+
+class SchemaCache(object):
+
+    COMPLETE_MARKER = '.complete'
+    STAGING_PREFIX = '.staging-'
+
+    def __init__(self, cache_dir, max_entries=4, salt=''):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_entries = max_entries
+        self.salt = salt
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def key_for(self, schemas):
+        """
+        Return the cache key of a Schemas message
+        """
+        return sha256(self.salt + schemas.SerializeToString()).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key):
+        """
+        Return the directory of a complete entry for key, or None. A hit
+        refreshes the entry's position in the LRU order.
+        """
+        marker = os.path.join(self.path_for(key), self.COMPLETE_MARKER)
+        if not os.path.exists(marker):
+            return None
+        os.utime(marker, None)
+        return self.path_for(key)
+
+    def build(self, key, builder):
+        """
+        Create the entry for key by calling builder(staging_dir), and
+        atomically move it in place once builder returned. If another
+        process completed the same entry in the meantime, that one wins.
+        :return: directory of the complete entry
+        """
+        staging_dir = mkdtemp(prefix=self.STAGING_PREFIX, dir=self.cache_dir)
+        try:
+            builder(staging_dir)
+            open(os.path.join(staging_dir, self.COMPLETE_MARKER), 'w').close()
+            os.rename(staging_dir, self.path_for(key))
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            if self.lookup(key) is None:
+                raise
+            log.debug('schema-cache-lost-race', key=key)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        self.evict(keep=key)
+        return self.path_for(key)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries beyond max_entries
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            marker = os.path.join(self.cache_dir, name, self.COMPLETE_MARKER)
+            if name != keep and os.path.exists(marker):
+                entries.append((os.path.getmtime(marker), name))
+
+        entries.sort(reverse=True)
+        for _, name in entries[max(self.max_entries - 1, 0):]:
+            log.info('schema-cache-evict', key=name)
+            shutil.rmtree(self.path_for(name), ignore_errors=True)
@@ -22,13 +22,16 @@ import os
 import sys
 
 import yaml
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.task import LoopingCall
 
 from chameleon.utils.dockerhelpers import get_my_containers_name
 from chameleon.utils.nethelpers import get_my_primary_local_ipv4
 from chameleon.utils.structlog_setup import setup_logging
 
 from chameleon.grpc_client.grpc_client import GrpcClient
+from chameleon.supervisor import Supervisor
+from chameleon.web_server.gateway import GatewaySettings
 from chameleon.web_server.web_server import WebServer
 
 
@@ -44,7 +47,21 @@ defs = dict(
                                          get_my_primary_local_ipv4()),
     rest_port=os.environ.get('REST_PORT', 8881),
     work_dir=os.environ.get('WORK_DIR', '/tmp/chameleon'),
+    schema_cache_dir=os.environ.get('SCHEMA_CACHE_DIR', None),
+    schema_cache_size=int(os.environ.get('SCHEMA_CACHE_SIZE', 4)),
+    dynamic_gateway=os.environ.get('DYNAMIC_GATEWAY', 'False') == 'True',
+    single_flight=os.environ.get('SINGLE_FLIGHT', ''),
+    response_cache=os.environ.get('RESPONSE_CACHE', ''),
+    response_cache_size=int(os.environ.get('RESPONSE_CACHE_SIZE',
+                                           16 * 1024 * 1024)),
+    response_cache_file=os.environ.get('RESPONSE_CACHE_FILE', None),
+    transcode_offload=int(os.environ.get('TRANSCODE_OFFLOAD', 16 * 1024)),
+    transcode_threads=int(os.environ.get('TRANSCODE_THREADS', 4)),
+    stream_threshold=int(os.environ.get('STREAM_THRESHOLD', 1024 * 1024)),
+    compress_threshold=int(os.environ.get('COMPRESS_THRESHOLD', 1024)),
+    compress_level=int(os.environ.get('COMPRESS_LEVEL', 6)),
     swagger_url=os.environ.get('SWAGGER_URL', ''),
+    workers=int(os.environ.get('WORKERS', 1)),
     enable_tls=os.environ.get('ENABLE_TLS', "True"),
     key=os.environ.get('KEY', '/chameleon/pki/voltha.key'),
     cert=os.environ.get('CERT', '/chameleon/pki/voltha.crt'),
@@ -151,6 +168,141 @@ def parse_args():
                         default=defs['work_dir'],
                         help=_help)
 
+    _help = ('directory of the compiled schema cache; point it at a '
+             'persistent volume to skip recompilation across container '
+             'restarts (default: <work-dir>/schemas)')
+    parser.add_argument('--schema-cache-dir',
+                        dest='schema_cache_dir',
+                        action='store',
+                        default=defs['schema_cache_dir'],
+                        help=_help)
+
+    _help = ('number of compiled schemas kept in the schema cache '
+             '(default: %d)' % defs['schema_cache_size'])
+    parser.add_argument('--schema-cache-size',
+                        dest='schema_cache_size',
+                        action='store',
+                        type=int,
+                        default=defs['schema_cache_size'],
+                        help=_help)
+
+    _help = ('build the REST gateway in memory from the descriptors of the '
+             'retrieved schema instead of compiling and importing generated '
+             'code')
+    parser.add_argument('--dynamic-gateway',
+                        dest='dynamic_gateway',
+                        action='store_true',
+                        default=defs['dynamic_gateway'],
+                        help=_help)
+
+    _help = ('comma separated names (<Service>_<Method>) of the GET routes '
+             'whose identical concurrent requests share one gRPC call, '
+             '\'*\' for all, \'\' for none (default: %s)'
+             % defs['single_flight'])
+    parser.add_argument('--single-flight',
+                        dest='single_flight',
+                        action='store',
+                        default=defs['single_flight'],
+                        help=_help)
+
+    _help = ('comma separated <Service>_<Method>=<seconds> time to live of '
+             'the cached responses of GET routes, with \'*\' naming all '
+             'other GET routes; writes to overlapping paths invalidate '
+             'cached responses (default: \'%s\', no caching)'
+             % defs['response_cache'])
+    parser.add_argument('--response-cache',
+                        dest='response_cache',
+                        action='store',
+                        default=defs['response_cache'],
+                        help=_help)
+
+    _help = ('bytes the cached responses may take, least recently used '
+             'ones are evicted first (default: %d)'
+             % defs['response_cache_size'])
+    parser.add_argument('--response-cache-size',
+                        dest='response_cache_size',
+                        action='store',
+                        type=int,
+                        default=defs['response_cache_size'],
+                        help=_help)
+
+    _help = ('keep the cached responses in this memory-mapped file (e.g. '
+             'under /dev/shm), shared by all Chameleon processes on the '
+             'host, instead of in process memory')
+    parser.add_argument('--response-cache-file',
+                        dest='response_cache_file',
+                        action='store',
+                        default=defs['response_cache_file'],
+                        help=_help)
+
+    _help = ('serialized size in bytes above which gRPC responses are '
+             'transcoded to JSON on a thread pool, keeping the reactor '
+             'responsive, 0 to always transcode inline (default: %d)'
+             % defs['transcode_offload'])
+    parser.add_argument('--transcode-offload',
+                        dest='transcode_offload',
+                        action='store',
+                        type=int,
+                        default=defs['transcode_offload'],
+                        help=_help)
+
+    _help = ('maximum number of threads transcoding large responses '
+             '(default: %d)' % defs['transcode_threads'])
+    parser.add_argument('--transcode-threads',
+                        dest='transcode_threads',
+                        action='store',
+                        type=int,
+                        default=defs['transcode_threads'],
+                        help=_help)
+
+    _help = ('serialized size in bytes above which the responses of '
+             'uncached routes are encoded and written out in chunks, as the '
+             'client takes them in, 0 to never stream them (default: %d)'
+             % defs['stream_threshold'])
+    parser.add_argument('--stream-threshold',
+                        dest='stream_threshold',
+                        action='store',
+                        type=int,
+                        default=defs['stream_threshold'],
+                        help=_help)
+
+    _help = ('size in bytes above which responses are compressed, if the '
+             'client accepts gzip (or brotli) encoded ones, 0 to never '
+             'compress them (default: %d)' % defs['compress_threshold'])
+    parser.add_argument('--compress-threshold',
+                        dest='compress_threshold',
+                        action='store',
+                        type=int,
+                        default=defs['compress_threshold'],
+                        help=_help)
+
+    _help = ('response compression level, from 1 (fastest) to 9 (smallest) '
+             '(default: %d)' % defs['compress_level'])
+    parser.add_argument('--compress-level',
+                        dest='compress_level',
+                        action='store',
+                        type=int,
+                        default=defs['compress_level'],
+                        help=_help)
+
+    _help = ('number of worker processes serving the REST port, through '
+             'SO_REUSEPORT; with more than 1, this process only supervises '
+             'them (default: %s)' % defs['workers'])
+    parser.add_argument('--workers',
+                        dest='workers',
+                        action='store',
+                        type=int,
+                        default=defs['workers'],
+                        help=_help)
+
+    # set by the supervisor on the command line of its workers
+    parser.add_argument('--worker-id',
+                        dest='worker_id',
+                        action='store',
+                        type=int,
+                        default=None,
+                        help=argparse.SUPPRESS)
+
     _help = ('use docker container name as Chameleon instance id'
              ' (overrides -i/--instance-id option)')
     parser.add_argument('--instance-id-is-container-name',
@@ -200,6 +352,17 @@ def parse_args():
                         default=False,
                         help=_help)
 
+    _help = ('Recover in-process, by rebuilding the gRPC channel and only '
+             'reloading the schema if it changed, if the gRPC connection is '
+             'disconnected (takes precedence over --restart). Unless in '
+             'dynamic gateway mode, a changed schema still restarts '
+             'chameleon.')
+    parser.add_argument('--recover',
+                        dest='recover',
+                        action='store_true',
+                        default=False,
+                        help=_help)
+
     args = parser.parse_args()
 
     # post-processing
@@ -207,6 +370,9 @@ def parse_args():
     if args.instance_id_is_container_name:
         args.instance_id = get_my_containers_name()
 
+    if args.worker_id is not None:
+        args.instance_id = '%s.%d' % (args.instance_id, args.worker_id)
+
     return args
 
 
@@ -253,6 +419,8 @@ class Main(object):
         # components
         self.rest_server = None
         self.grpc_client = None
+        self.supervisor = None
+        self.orphan_check = None
 
         if not args.no_banner:
             print_banner(self.log)
@@ -267,14 +435,37 @@ class Main(object):
         try:
             self.log.info('starting-internal-components')
             args = self.args
+            if args.workers > 1 and args.worker_id is None:
+                yield self.startup_supervisor()
+                return
+            if args.worker_id is not None:
+                self.watch_supervisor()
+
             self.grpc_client = yield \
-                GrpcClient(args.consul, args.work_dir, args.grpc_endpoint, restart_on_disconnect=args.restart)
+                GrpcClient(args.consul, args.work_dir, args.grpc_endpoint,
+                           restart_on_disconnect=args.restart,
+                           schema_cache_dir=args.schema_cache_dir,
+                           schema_cache_size=args.schema_cache_size,
+                           dynamic_gateway=args.dynamic_gateway,
+                           recover_on_disconnect=args.recover)
+            gateway_settings = GatewaySettings(
+                single_flight=args.single_flight,
+                response_cache=args.response_cache,
+                response_cache_size=args.response_cache_size,
+                response_cache_file=args.response_cache_file,
+                transcode_offload=args.transcode_offload,
+                transcode_threads=args.transcode_threads,
+                stream_threshold=args.stream_threshold,
+                compress_threshold=args.compress_threshold,
+                compress_level=args.compress_level)
 
             if args.enable_tls == "False":
                 self.log.info('tls-disabled-through-configuration')
                 self.rest_server = yield \
                     WebServer(args.rest_port, args.work_dir, args.swagger_url,
-                              self.grpc_client).start()
+                              self.grpc_client,
+                              gateway_settings=gateway_settings,
+                              worker_id=args.worker_id).start()
             else:
                 # If TLS is enabled, but the server key or cert is not found,
                 # then automatically disable TLS
@@ -288,14 +479,18 @@ class Main(object):
                     self.rest_server = yield \
                         WebServer(args.rest_port, args.work_dir,
                                   args.swagger_url,
-                                  self.grpc_client).start()
+                                  self.grpc_client,
+                                  gateway_settings=gateway_settings,
+                                  worker_id=args.worker_id).start()
                 else:
                     self.log.info('tls-enabled')
                     self.rest_server = yield \
                         WebServer(args.rest_port, args.work_dir,
                                   args.swagger_url,
                                   self.grpc_client, args.key,
-                                  args.cert).start()
+                                  args.cert,
+                                  gateway_settings=gateway_settings,
+                                  worker_id=args.worker_id).start()
 
             self.grpc_client.set_reconnect_callback(
                 self.rest_server.reload_generated_routes).start()
@@ -303,10 +498,46 @@ class Main(object):
         except Exception as e:
             self.log.exception('startup-failed', e=e)
 
+    @inlineCallbacks
+    def startup_supervisor(self):
+        """
+        Fetch and compile the schema once, into the schema cache the workers
+        then load it from, and start the workers
+        """
+        args = self.args
+        if not args.dynamic_gateway:
+            connected = Deferred()
+            grpc_client = GrpcClient(
+                args.consul, args.work_dir, args.grpc_endpoint,
+                reconnect_callback=lambda: connected.callback(None),
+                schema_cache_dir=args.schema_cache_dir,
+                schema_cache_size=args.schema_cache_size).start()
+            yield connected
+            grpc_client.stop()
+        self.supervisor = Supervisor(args.workers, sys.argv).start()
+        self.log.info('started-workers', workers=args.workers)
+
+    def watch_supervisor(self):
+        """Exit if the supervisor went away without stopping us"""
+        from twisted.internet import reactor
+        supervisor_pid = os.getppid()
+
+        def check():
+            if os.getppid() != supervisor_pid:
+                self.log.warning('supervisor-gone', pid=supervisor_pid)
+                reactor.stop()
+
+        self.orphan_check = LoopingCall(check)
+        self.orphan_check.start(1)
+
     @inlineCallbacks
     def shutdown_components(self):
         """Execute before the reactor is shut down"""
         self.log.info('exiting-on-keyboard-interrupt')
+        if self.orphan_check is not None and self.orphan_check.running:
+            self.orphan_check.stop()
+        if self.supervisor is not None:
+            yield self.supervisor.stop()
         if self.rest_server is not None:
             yield self.rest_server.stop()
         if self.grpc_client is not None:
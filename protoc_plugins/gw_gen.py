@@ -15,11 +15,13 @@
 # limitations under the License.
 #
 
+import keyword
 import sys
 
 from google.protobuf.compiler import plugin_pb2 as plugin
-from google.protobuf.descriptor_pb2 import ServiceDescriptorProto, \
-    MethodOptions
+from google.protobuf.descriptor_pb2 import FieldDescriptorProto, \
+    ServiceDescriptorProto, MethodOptions
+from google.protobuf.json_format import _WKTJSONMETHODS
 from jinja2 import Template
 from simplejson import dumps
 
@@ -28,12 +30,11 @@ from google.api import annotations_pb2, http_pb2
 template = Template("""
 # Generated file; please do not edit
 
-from simplejson import dumps, load
-from structlog import get_logger
-from google.protobuf.json_format import MessageToDict, ParseDict
-from twisted.internet.defer import inlineCallbacks, returnValue
-
-{% set package = file_name.replace('.proto', '') %}
+from chameleon.web_server.gateway import GatewayRoute, \
+    ClientStreamingRoute, ServerStreamingRoute, add_route
+from chameleon.web_server.grpc_web import GrpcWebRoute
+from chameleon.web_server.transcoding import encode_bytes, encode_double, \
+    encode_float, encode_wkt
 
 {% for pypackage, module in includes %}
 {% if pypackage %}
@@ -51,7 +52,7 @@ except ImportError:
 {% endif %}
 {% endfor %}
 
-log = get_logger()
+{{ encoders }}
 
 def add_routes(app, grpc_client):
 
@@ -59,46 +60,36 @@ def add_routes(app, grpc_client):
 
     {% for method in methods %}
     {% set method_name = method['service'].rpartition('.')[2] + '_' + method['method'] %}
-    {% set path = method['path'].replace('{', '<string:').replace('}', '>') %}
-    @app.route('{{ path }}', methods=['{{ method['verb'].upper() }}'])
-    @inlineCallbacks
-    def {{ method_name }}(server, request, **kw):
-        log.debug('{{ method_name }}', request=request, server=server, **kw)
-        {% if method['body'] == '*' %}
-        data = load(request.content)
-        data.update(kw)
-        {% elif method['body'] == '' %}
-        data = kw
-        {% else %}
-        raise NotImplementedError('cannot handle specific body field list')
-        {% endif %}
-        try:
-            req = ParseDict(data, {{ type_map[method['input_type']] }}())
-        except Exception, e:
-            log.error('cannot-convert-to-protobuf', e=e, data=data)
-            raise
-        res, metadata = yield grpc_client.invoke(
-            {{ stub_map[method['service']] }}Stub,
-            '{{ method['method'] }}', req, request.getAllHeaders().items())
-        try:
-            out_data = MessageToDict(res, True, True)
-        except AttributeError, e:
-            filename = '/tmp/chameleon_failed_to_convert_data.pbd'
-            with file(filename, 'w') as f:
-                f.write(res.SerializeToString())
-            log.error('cannot-convert-from-protobuf', outdata_saved=filename)
-            raise
-        for key, value in metadata:
-            request.setHeader(key, value)
-        request.setHeader('Content-Type', 'application/json')
-        log.debug('{{ method_name }}', **out_data)
-        returnValue(dumps(out_data))
+    {% if method['route_class'] %}
+    add_route(app, {{ method['route_class'] }}(
+        grpc_client, '{{ method_name }}', '{{ method['verb'] }}',
+        '{{ method['path'] }}', '{{ method['body'] }}',
+        {{ stub_map[method['service']] }}Stub, '{{ method['method'] }}',
+        {{ type_map[method['input_type']] }}, encoders=ENCODERS,
+        service='{{ method['service'] }}',
+        output_class={{ type_map[method['output_type']] }}))
+    {% endif %}
 
     {% endfor %}
+    {% for method in grpc_web_methods %}
+    add_route(app, GrpcWebRoute(
+        grpc_client, '{{ method['service'] }}', '{{ method['method'] }}',
+        client_streaming={{ method['client_streaming'] }},
+        server_streaming={{ method['server_streaming'] }}))
+    {% endfor %}
 
 """, trim_blocks=True, lstrip_blocks=True)
 
 
+# (client_streaming, server_streaming) -> gateway route class; there is no
+# REST mapping for bidirectional streaming methods
+ROUTE_CLASSES = {
+    (False, False): 'GatewayRoute',
+    (False, True): 'ServerStreamingRoute',
+    (True, False): 'ClientStreamingRoute',
+}
+
+
 def traverse_methods(proto_file):
 
     package = proto_file.name
@@ -151,15 +142,235 @@ def traverse_methods(proto_file):
                         'output_type': output_type,
                         'path': path,
                         'verb': verb,
-                        'body': body
+                        'body': body,
+                        'route_class': ROUTE_CLASSES.get(
+                            (method.client_streaming,
+                             method.server_streaming))
                     }
 
                     yield data
 
 
-def generate_gw_code(file_name, methods, type_map, stub_map, includes):
+def traverse_grpc_web_methods(proto_file):
+    """
+    Yield all the methods of the services of proto_file, annotated or not,
+    as served over gRPC-Web
+    """
+    for service in proto_file.service:
+        full_name = proto_file.package + '.' + service.name \
+            if proto_file.package else service.name
+        for method in service.method:
+            yield {
+                'service': full_name,
+                'method': method.name,
+                'client_streaming': method.client_streaming,
+                'server_streaming': method.server_streaming,
+            }
+
+
+encoders_template = Template("""
+{% for name, values in enum_tables %}
+{{ name }} = {{ values }}
+{% endfor %}
+
+{% for name, fields, optional_fields in encoders %}
+
+
+def {{ name }}(m):
+    d = {
+    {% for field, expr in fields %}
+        '{{ field }}': {{ expr }},
+    {% endfor %}
+    }
+    {% for field, expr in optional_fields %}
+    if m.HasField('{{ field }}'):
+        d['{{ field }}'] = {{ expr }}
+    {% endfor %}
+    return d
+{% endfor %}
+
+ENCODERS = {
+{% for full_name, name in names %}
+    '{{ full_name }}': {{ name }},
+{% endfor %}
+}
+""", trim_blocks=True, lstrip_blocks=True)
+
+
+_INT64_TYPES = (
+    FieldDescriptorProto.TYPE_INT64, FieldDescriptorProto.TYPE_UINT64,
+    FieldDescriptorProto.TYPE_SINT64, FieldDescriptorProto.TYPE_FIXED64,
+    FieldDescriptorProto.TYPE_SFIXED64)
+
+
+class EncoderGenerator(object):
+    """
+    Generates the source of JSON encoder functions specialized for message
+    types, converting messages to the same JSON objects as
+    MessageToDict(message, True, True): field names, enum name tables and
+    the encoding of each field are resolved once, at generation time. The
+    well-known types, and the message types with extension ranges, are left
+    to MessageToDict.
+    """
+
+    def __init__(self, proto_files):
+        """
+        :param proto_files: FileDescriptorProtos defining the message types
+        to generate encoders for, and all the types they refer to
+        """
+        self.messages = {}  # full name -> DescriptorProto
+        self.enums = {}  # full name -> EnumDescriptorProto
+        self.wrappers = set()  # full names of the wrapper types
+        for proto_file in proto_files:
+            self._index(proto_file.package, proto_file.message_type,
+                        proto_file.enum_type,
+                        proto_file.name == 'google/protobuf/wrappers.proto')
+        self.encoders = []  # (name, fields, optional fields)
+        self.names = {}  # message full name -> encoder name
+        self.enum_tables = {}  # enum full name -> table name
+
+    def _index(self, prefix, messages, enums, wrappers):
+        for enum in enums:
+            self.enums[self._full_name(prefix, enum.name)] = enum
+        for message in messages:
+            full_name = self._full_name(prefix, message.name)
+            self.messages[full_name] = message
+            if wrappers:
+                self.wrappers.add(full_name)
+            self._index(full_name, message.nested_type, message.enum_type,
+                        wrappers)
+
+    @staticmethod
+    def _full_name(prefix, name):
+        return prefix + '.' + name if prefix else name
+
+    def add(self, full_name):
+        """
+        Generate the encoder of message type full_name, and of the message
+        types it refers to
+        :return: name of the encoder
+        """
+        if full_name in self.names:
+            return self.names[full_name]
+        message = self.messages[full_name]
+        if message.extension_range:
+            # extensions are only known at run time
+            self.names[full_name] = 'encode_wkt'
+            return 'encode_wkt'
+        name = self.names[full_name] = self._name('_encode_', full_name,
+                                                  len(self.encoders))
+        encoder = (name, [], [])
+        self.encoders.append(encoder)
+
+        for field in message.field:
+            if field.HasField('extendee'):
+                continue
+            value = 'm.' + field.name if not keyword.iskeyword(field.name) \
+                else 'getattr(m, %r)' % str(field.name)
+            if field.label == FieldDescriptorProto.LABEL_REPEATED:
+                entry = self.messages.get(field.type_name.lstrip('.'))
+                if entry is not None and entry.options.map_entry:
+                    expr = self._map_expr(entry, value)
+                else:
+                    expr = self._list_expr(field, value)
+                encoder[1].append((field.name, expr))
+            elif field.type == FieldDescriptorProto.TYPE_MESSAGE or \
+                    field.HasField('oneof_index'):
+                # only present when set
+                encoder[2].append((field.name, self._expr(field, value)))
+            else:
+                encoder[1].append((field.name, self._expr(field, value)))
+        return name
+
+    def _expr(self, field, value):
+        """
+        :return: expression encoding value, a value of field
+        """
+        if field.type == FieldDescriptorProto.TYPE_MESSAGE:
+            type_name = field.type_name.lstrip('.')
+            if type_name in _WKTJSONMETHODS or type_name in self.wrappers:
+                return 'encode_wkt(%s)' % value
+            return '%s(%s)' % (self.add(type_name), value)
+        elif field.type == FieldDescriptorProto.TYPE_ENUM:
+            type_name = field.type_name.lstrip('.')
+            if type_name == 'google.protobuf.NullValue':
+                return 'None'
+            return '%s.get(%s, %s)' % (self._enum_table(type_name), value,
+                                       value)
+        elif field.type == FieldDescriptorProto.TYPE_BYTES:
+            return 'encode_bytes(%s)' % value
+        elif field.type in _INT64_TYPES:
+            return 'str(%s)' % value
+        elif field.type == FieldDescriptorProto.TYPE_DOUBLE:
+            return 'encode_double(%s)' % value
+        elif field.type == FieldDescriptorProto.TYPE_FLOAT:
+            return 'encode_float(%s)' % value
+        return value
+
+    def _list_expr(self, field, value):
+        expr = self._expr(field, 'v')
+        if expr == 'v':
+            return 'list(%s)' % value
+        return '[%s for v in %s]' % (expr, value)
+
+    def _map_expr(self, entry, value):
+        key_field, value_field = entry.field
+        if key_field.type == FieldDescriptorProto.TYPE_BOOL:
+            key = "('true' if k else 'false')"
+        else:
+            key = 'k'
+        expr = self._expr(value_field, 'v')
+        if key == 'k' and expr == 'v':
+            return 'dict(%s)' % value
+        return 'dict((%s, %s) for k, v in %s.iteritems())' % (key, expr,
+                                                                value)
+
+    def _enum_table(self, full_name):
+        if full_name not in self.enum_tables:
+            self.enum_tables[full_name] = self._name(
+                '_ENUM_', full_name, len(self.enum_tables))
+        return self.enum_tables[full_name]
+
+    @staticmethod
+    def _name(prefix, full_name, n):
+        """
+        :return: Python name for the n-th generated object of its kind;
+        full names alone could collide once flattened (a.b_c and a_b.c)
+        """
+        return '%s%d_%s' % (prefix, n, full_name.replace('.', '_'))
+
+    def source(self):
+        """
+        :return: source of the encoders generated so far, and of the
+        ENCODERS dict mapping message full names to them
+        """
+        enum_tables = []
+        for full_name, name in sorted(self.enum_tables.iteritems()):
+            values = dict((v.number, str(v.name))
+                          for v in reversed(self.enums[full_name].value))
+            enum_tables.append((name, values))
+        return encoders_template.render(
+            enum_tables=enum_tables, encoders=self.encoders,
+            names=sorted(self.names.iteritems()))
+
+
+def generate_encoders(proto_files, type_names):
+    """
+    :return: source of the JSON encoders of message types type_names, see
+    EncoderGenerator
+    """
+    generator = EncoderGenerator(proto_files)
+    for type_name in type_names:
+        generator.add(type_name)
+    return generator.source()
+
+
+def generate_gw_code(file_name, methods, type_map, stub_map, includes,
+                     encoders, grpc_web_methods):
     return template.render(file_name=file_name, methods=methods,
-                           type_map=type_map, stub_map=stub_map, includes=includes)
+                           type_map=type_map, stub_map=stub_map, includes=includes,
+                           encoders=encoders,
+                           grpc_web_methods=grpc_web_methods)
 
 
 class IncludeManager(object):
@@ -272,8 +483,13 @@ def generate_code(request, response):
         f = response.file.add()
         assert proto_file.name.endswith('.proto')
         f.name = proto_file.name.replace('.proto', '_gw.py')
+        encoders = generate_encoders(
+            request.proto_file, set(data['output_type'] for data in methods))
         f.content = generate_gw_code(proto_file.name,
-                                     methods, type_map, stub_map, includes)
+                                     methods, type_map, stub_map, includes,
+                                     encoders,
+                                     list(traverse_grpc_web_methods(
+                                         proto_file)))
 
 
 if __name__ == '__main__':
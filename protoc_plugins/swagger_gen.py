@@ -47,6 +47,34 @@ def generate_code(request, response):
     f.content = dumps(swagger)
 
 
+def dependency_closure(proto_files, file_name):
+    """
+    Return the subset of proto_files (in their original, dependency
+    first, order) needed to describe file_name.
+    """
+    by_name = dict((p.name, p) for p in proto_files)
+    needed = set()
+    pending = [file_name]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(by_name[name].dependency)
+    return [p for p in proto_files if p.name in needed]
+
+
+def generate_swagger(proto_files, file_name):
+    """
+    Generate the swagger.json content of file_name outside of a protoc
+    run, given a dependency first list of FileDescriptorProtos.
+    """
+    request = plugin.CodeGeneratorRequest(file_to_generate=[file_name])
+    request.proto_file.extend(dependency_closure(proto_files, file_name))
+    response = plugin.CodeGeneratorResponse()
+    generate_code(request, response)
+    return response.file[0].content
+
+
 if __name__ == '__main__':
 
     if len(sys.argv) >= 2:
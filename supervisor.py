@@ -0,0 +1,115 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Supervisor of the worker processes of the pre-fork (--workers N) mode.
+Each worker is a full Chameleon process (started with --worker-id) that
+accepts on the shared REST port through SO_REUSEPORT. Workers that die
+are restarted, with a backoff if they keep dying right after starting.
+"""
+
+import os
+import sys
+from time import time
+
+from structlog import get_logger
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.protocol import ProcessProtocol
+
+log = get_logger()
+
+
+class WorkerProtocol(ProcessProtocol):
+
+    def __init__(self, supervisor, worker_id):
+        self.supervisor = supervisor
+        self.worker_id = worker_id
+        self.pid = None
+
+    def connectionMade(self):
+        self.pid = self.transport.pid  # reset by the transport once ended
+
+    def processEnded(self, reason):
+        self.supervisor.worker_ended(self.worker_id, self.pid, reason)
+
+
+class Supervisor(object):
+
+    RESTART_BACKOFF = [1, 2, 5, 10]
+    STABLE_AFTER = 60  # seconds of uptime resetting the restart backoff
+
+    def __init__(self, workers, argv):
+        """
+        :param workers: number of worker processes
+        :param argv: command line of the supervisor, the workers get the
+        same one plus their --worker-id
+        """
+        self.workers = workers
+        self.argv = argv
+        self.processes = {}  # worker id -> IProcessTransport
+        self.started = {}  # worker id -> start time
+        self.restarts = {}  # worker id -> consecutive quick restarts
+        self.shutting_down = False
+        self._stopped = None  # Deferred fired once all workers ended
+
+    def start(self):
+        for worker_id in xrange(self.workers):
+            self._spawn(worker_id)
+        log.info('started', workers=self.workers)
+        return self
+
+    def stop(self):
+        """
+        :return: Deferred fired once all workers ended
+        """
+        self.shutting_down = True
+        if not self.processes:
+            return succeed(None)
+        self._stopped = Deferred()
+        for worker_id, process in self.processes.iteritems():
+            log.info('stopping-worker', worker_id=worker_id, pid=process.pid)
+            process.signalProcess('TERM')
+        return self._stopped
+
+    def _spawn(self, worker_id):
+        if self.shutting_down:
+            return
+        argv = [sys.executable] + self.argv + ['--worker-id', str(worker_id)]
+        process = reactor.spawnProcess(
+            WorkerProtocol(self, worker_id), sys.executable, argv,
+            env=os.environ, childFDs={0: 'w', 1: 1, 2: 2})
+        self.processes[worker_id] = process
+        self.started[worker_id] = time()
+        log.info('worker-started', worker_id=worker_id, pid=process.pid)
+
+    def worker_ended(self, worker_id, pid, reason):
+        del self.processes[worker_id]
+        if self.shutting_down:
+            log.info('worker-stopped', worker_id=worker_id, pid=pid)
+            if not self.processes and self._stopped is not None:
+                self._stopped.callback(None)
+            return
+
+        if time() - self.started[worker_id] > self.STABLE_AFTER:
+            self.restarts[worker_id] = 0
+        restarts = self.restarts.get(worker_id, 0)
+        delay = self.RESTART_BACKOFF[
+            min(restarts, len(self.RESTART_BACKOFF) - 1)]
+        self.restarts[worker_id] = restarts + 1
+        log.warning('worker-died', worker_id=worker_id, pid=pid,
+                    reason=reason.getErrorMessage(), restart_in=delay)
+        reactor.callLater(delay, self._spawn, worker_id)
@@ -0,0 +1,183 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Message types exercising the JSON mapping (maps, 64-bit integers, bytes,
+special floating point values, enums, oneofs, wrappers and other well-known
+types), compiled at test time
+"""
+
+import os
+import shutil
+import tempfile
+
+import pkg_resources
+from google.protobuf import descriptor_pool, message_factory
+from google.protobuf.descriptor_pb2 import FileDescriptorSet
+from grpc_tools import protoc
+
+PROTO = '''
+syntax = "proto3";
+
+package sample;
+
+import "google/protobuf/duration.proto";
+import "google/protobuf/struct.proto";
+import "google/protobuf/timestamp.proto";
+import "google/protobuf/wrappers.proto";
+
+enum Color {
+    RED = 0;
+    GREEN = 1;
+    BLUE = 2;
+}
+
+message Port {
+    uint32 port_no = 1;
+    string label = 2;
+    Color color = 3;
+}
+
+message Device {
+    string id = 1;
+    int64 counter = 2;
+    uint64 serial = 3;
+    sint64 offset = 4;
+    fixed64 mask = 5;
+    bytes payload = 6;
+    double ratio = 7;
+    float weight = 8;
+    bool enabled = 9;
+    Color color = 10;
+    repeated Color colors = 11;
+    repeated int64 counters = 12;
+    repeated double ratios = 13;
+    repeated Port ports = 14;
+    Port main_port = 15;
+    map<string, string> labels = 16;
+    map<int32, Port> ports_by_no = 17;
+    map<bool, string> flags = 18;
+    map<int64, bytes> blobs = 19;
+    map<string, Color> colors_by_name = 20;
+    oneof address {
+        string mac = 21;
+        uint32 vlan = 22;
+        Port via = 23;
+    }
+    google.protobuf.Int64Value max_counter = 24;
+    google.protobuf.StringValue nickname = 25;
+    google.protobuf.BoolValue active = 26;
+    google.protobuf.Timestamp created = 27;
+    google.protobuf.Duration uptime = 28;
+    google.protobuf.Struct extra = 29;
+    google.protobuf.Value anything = 30;
+    repeated google.protobuf.Timestamp history = 31;
+    int32 proto_name_differs = 32;
+    Device.Nested nested = 33;
+
+    message Nested {
+        enum Kind {
+            OLT = 0;
+            ONU = 1;
+        }
+        Kind kind = 1;
+        repeated Nested children = 2;
+    }
+}
+'''
+
+
+def compile_proto(file_name, source, imports=None):
+    """
+    :return: (FileDescriptorProtos of proto file file_name, of source, and
+    of its imports, pool holding them)
+    :param imports: file name -> source of the other proto files imported
+    """
+    proto_dir = tempfile.mkdtemp()
+    try:
+        sources = dict(imports or {})
+        sources[file_name] = source
+        for name, source in sources.iteritems():
+            with open(os.path.join(proto_dir, name), 'w') as f:
+                f.write(source)
+        desc_fname = os.path.join(proto_dir, 'out.desc')
+        rc = protoc.main([
+            'grpc_tools.protoc',
+            '-I%s' % proto_dir,
+            '-I%s' % pkg_resources.resource_filename('grpc_tools', '_proto'),
+            '--include_imports',
+            '--descriptor_set_out=%s' % desc_fname,
+            os.path.join(proto_dir, file_name)])
+        assert rc == 0, 'cannot compile %s' % file_name
+        with open(desc_fname, 'rb') as f:
+            files = FileDescriptorSet.FromString(f.read()).file
+    finally:
+        shutil.rmtree(proto_dir)
+    pool = descriptor_pool.DescriptorPool()
+    for proto_file in files:
+        pool.Add(proto_file)
+    return list(files), pool
+
+
+def message_classes(pool, *full_names):
+    factory = message_factory.MessageFactory(pool)
+    return [factory.GetPrototype(pool.FindMessageTypeByName(full_name))
+            for full_name in full_names]
+
+
+FILES, POOL = compile_proto('sample.proto', PROTO)
+Device, Port = message_classes(POOL, 'sample.Device', 'sample.Port')
+
+
+def sample_devices():
+    """
+    :return: Devices covering the JSON mapping, from the empty one up
+    """
+    full = Device(
+        id='olt-1', counter=-(1 << 62), serial=(1 << 64) - 1, offset=-5,
+        mask=1 << 40, payload='\x00\xff binary', ratio=0.25, weight=1.5,
+        enabled=True, color=2, colors=[0, 1, 2], counters=[1 << 53, -1],
+        ratios=[0.5, -2.0], mac='00:11:22:33:44:55', proto_name_differs=7)
+    full.ports.add(port_no=1, label='uplink', color=1)
+    full.ports.add()
+    full.main_port.port_no = 2
+    full.labels['site'] = 'north'
+    full.labels[''] = 'empty key'
+    full.ports_by_no[-1].label = 'negative key'
+    full.ports_by_no[7].color = 2
+    full.flags[True] = 'yes'
+    full.flags[False] = 'no'
+    full.blobs[1 << 40] = '\x01\x02'
+    full.colors_by_name['sky'] = 2
+    full.max_counter.value = 1 << 60
+    full.nickname.value = ''
+    full.active.value = False
+    full.created.seconds = 1500000000
+    full.created.nanos = 1000
+    full.uptime.seconds = 3600
+    full.extra['a'] = 1
+    full.extra.get_or_create_struct('b')['c'] = [True, None, 'x']
+    full.anything.string_value = 'any'
+    full.history.add(seconds=0)
+    full.nested.kind = 1
+    full.nested.children.add(kind=0).children.add(kind=1)
+
+    special = Device(ratio=float('nan'), weight=float('inf'),
+                     ratios=[float('-inf'), float('nan')], color=5,
+                     colors=[7], vlan=0)
+    special.via.SetInParent()
+
+    return [Device(), full, special]
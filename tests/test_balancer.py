@@ -0,0 +1,171 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+
+from twisted.internet.task import Clock
+from werkzeug.exceptions import ServiceUnavailable
+
+from chameleon.grpc_client import balancer
+from chameleon.grpc_client.balancer import Balancer
+
+
+class FakeChannel(object):
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestUpdate(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.reactor, balancer.reactor = balancer.reactor, self.clock
+        self.balancer = Balancer(FakeChannel)
+
+    def tearDown(self):
+        balancer.reactor = self.reactor
+
+    def test_no_backend(self):
+        self.assertRaises(ServiceUnavailable, self.balancer.pick)
+
+    def test_least_loaded_of_two_picked(self):
+        self.balancer.update(['a:1', 'b:1'])
+        busy = self.balancer.acquire()
+        for _ in range(20):
+            self.assertIsNot(self.balancer.pick(), busy)
+
+        # and the requests spread across the backends
+        self.balancer.release(busy)
+        for _ in range(20):
+            self.balancer.release(self.balancer.acquire())
+        self.assertTrue(all(stats['requests'] > 0 for stats in
+                            self.balancer.stats().itervalues()))
+
+    def test_removed_endpoint_drained(self):
+        self.balancer.update(['a:1', 'b:1'])
+        backend = self.balancer.backends['a:1']
+        backend.in_flight += 1  # a request outstanding
+        self.balancer.update(['b:1'])
+        for _ in range(20):
+            self.assertIsNot(self.balancer.pick(), backend)
+        self.assertTrue(self.balancer.stats()['a:1']['draining'])
+
+        self.balancer.release(backend)
+        self.assertEqual(self.balancer.stats().keys(), ['b:1'])
+        self.assertFalse(backend.channel.closed)
+        self.clock.advance(Balancer.CLOSE_DELAY)
+        self.assertTrue(backend.channel.closed)
+
+    def test_endpoint_back_before_drained_restored(self):
+        self.balancer.update(['a:1'])
+        backend = self.balancer.acquire()
+        self.balancer.update([])
+        self.assertRaises(ServiceUnavailable, self.balancer.pick)
+        self.balancer.update(['a:1'])
+        self.assertIs(self.balancer.pick(), backend)
+        self.assertFalse(backend.draining)
+
+
+class TestReset(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.reactor, balancer.reactor = balancer.reactor, self.clock
+        self.balancer = Balancer(FakeChannel)
+        self.balancer.update(['a:1'])
+
+    def tearDown(self):
+        balancer.reactor = self.reactor
+
+    def test_idle_channels_closed_after_delay(self):
+        channel = self.balancer.pick().channel
+        self.balancer.reset()
+        self.assertFalse(channel.closed)
+        self.clock.advance(Balancer.CLOSE_DELAY)
+        self.assertTrue(channel.closed)
+
+    def test_in_flight_calls_drain_before_close(self):
+        backend = self.balancer.acquire()
+        self.balancer.reset()
+        self.clock.advance(Balancer.CLOSE_DELAY)
+        self.assertFalse(backend.channel.closed)
+
+        self.balancer.release(backend)
+        self.clock.advance(Balancer.CLOSE_DELAY)
+        self.assertTrue(backend.channel.closed)
+
+    def test_update_after_reset_uses_fresh_channel(self):
+        backend = self.balancer.acquire()
+        self.balancer.reset()
+        self.balancer.update(['a:1'])
+        self.assertIsNot(self.balancer.pick().channel, backend.channel)
+
+        # releasing the drained backend leaves the new one in place
+        self.balancer.release(backend)
+        self.assertEqual(self.balancer.stats().keys(), ['a:1'])
+        self.assertFalse(self.balancer.pick().draining)
+
+
+class FakeStub(object):
+
+    instances = []
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.instances.append(self)
+
+    def GetDevice(self):
+        pass
+
+
+class TestStubs(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.reactor, balancer.reactor = balancer.reactor, self.clock
+        self.balancer = Balancer(FakeChannel)
+        self.balancer.update(['a:1'])
+        del FakeStub.instances[:]
+
+    def tearDown(self):
+        balancer.reactor = self.reactor
+
+    def test_stub_built_once_per_channel(self):
+        backend = self.balancer.pick()
+        method = backend.method(FakeStub, 'GetDevice')
+        self.assertEqual(method, backend.method(FakeStub, 'GetDevice'))
+        self.assertEqual(len(FakeStub.instances), 1)
+        self.assertIs(FakeStub.instances[0].channel, backend.channel)
+
+        # a fresh channel gets a stub of its own
+        self.balancer.reset()
+        self.balancer.update(['a:1'])
+        fresh = self.balancer.pick()
+        fresh.method(FakeStub, 'GetDevice')
+        self.assertEqual(len(FakeStub.instances), 2)
+        self.assertIs(FakeStub.instances[1].channel, fresh.channel)
+
+    def test_clear_stubs(self):
+        backend = self.balancer.pick()
+        backend.method(FakeStub, 'GetDevice')
+        self.balancer.clear_stubs()
+        backend.method(FakeStub, 'GetDevice')
+        self.assertEqual(len(FakeStub.instances), 2)
@@ -0,0 +1,184 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import zlib
+from gzip import GzipFile
+from StringIO import StringIO
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.trial.unittest import TestCase
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, \
+    readBody
+from twisted.web.http_headers import Headers
+from twisted.web.resource import EncodingResourceWrapper, NoResource
+from twisted.web.server import Site
+
+from chameleon.web_server import compression
+from chameleon.web_server.compression import ResponseCompression
+from chameleon.web_server.route_trie import DispatcherResource, RouteTrie
+
+THRESHOLD = 1024
+
+
+def gzip(data):
+    out = StringIO()
+    with GzipFile(fileobj=out, mode='wb') as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def echo(request):
+    request.setHeader('Content-Type', 'application/json')
+    return request.content.read()
+
+
+def body(request, size):
+    request.setHeader('Content-Type', 'application/json')
+    return 'x' * size
+
+
+def stream(request):
+    request.setHeader('Content-Type', 'application/x-ndjson')
+    for i in xrange(3):
+        request.write('{"n": %d}\n' % i)
+    request.finish()
+
+
+class TestCompression(TestCase):
+
+    def setUp(self):
+        self.patch(compression, 'ENCODINGS', ('gzip',))  # with brotli too
+        routes = RouteTrie()
+        routes.add('post', '/echo', echo)
+        routes.add('get', '/body/{size}', body, {'size': int})
+        routes.add('get', '/stream', stream)
+        resource = EncodingResourceWrapper(
+            DispatcherResource(routes, NoResource(), None),
+            [ResponseCompression(THRESHOLD)])
+        self.port = reactor.listenTCP(0, Site(resource),
+                                      interface='127.0.0.1')
+        self.pool = HTTPConnectionPool(reactor, persistent=False)
+        self.agent = Agent(reactor, pool=self.pool)
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.pool.closeCachedConnections()
+        yield self.port.stopListening()
+
+    @inlineCallbacks
+    def request(self, method, path, headers=None, data=None):
+        """
+        :return: Deferred fired with the response and its raw body
+        """
+        url = 'http://127.0.0.1:%d%s' % (self.port.getHost().port, path)
+        response = yield self.agent.request(
+            method, url, Headers(headers or {}),
+            FileBodyProducer(StringIO(data)) if data is not None else None)
+        response.body = yield readBody(response)
+        returnValue(response)
+
+    def header(self, response, name):
+        return response.headers.getRawHeaders(name, [None])[0]
+
+    @inlineCallbacks
+    def test_gzip_request_decoded(self):
+        document = '{"id": "%s"}' % ('d' * 5000)
+        response = yield self.request(
+            'POST', '/echo', {'Content-Encoding': ['gzip']}, gzip(document))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, document)
+
+    @inlineCallbacks
+    def test_invalid_gzip_request_rejected(self):
+        response = yield self.request(
+            'POST', '/echo', {'Content-Encoding': ['gzip']},
+            '{"not": "gzip"}')
+        self.assertEqual(response.code, 400)
+        self.assertIn('invalid gzip request body', response.body)
+
+    @inlineCallbacks
+    def test_truncated_gzip_request_rejected(self):
+        response = yield self.request(
+            'POST', '/echo', {'Content-Encoding': ['gzip']},
+            gzip('{"id": "d1"}')[:-12])
+        self.assertEqual(response.code, 400)
+
+    @inlineCallbacks
+    def test_unsupported_request_encoding(self):
+        response = yield self.request(
+            'POST', '/echo', {'Content-Encoding': ['deflate']}, 'x')
+        self.assertEqual(response.code, 415)
+
+    @inlineCallbacks
+    def test_below_threshold_left_alone(self):
+        response = yield self.request(
+            'GET', '/body/%d' % (THRESHOLD - 1),
+            {'Accept-Encoding': ['gzip']})
+        self.assertIsNone(self.header(response, 'content-encoding'))
+        self.assertEqual(self.header(response, 'vary'), 'Accept-Encoding')
+        self.assertEqual(response.body, 'x' * (THRESHOLD - 1))
+
+    @inlineCallbacks
+    def test_above_threshold_compressed(self):
+        response = yield self.request(
+            'GET', '/body/%d' % (THRESHOLD * 10),
+            {'Accept-Encoding': ['gzip']})
+        self.assertEqual(self.header(response, 'content-encoding'), 'gzip')
+        self.assertEqual(self.header(response, 'vary'), 'Accept-Encoding')
+        self.assertLess(len(response.body), THRESHOLD)
+        self.assertEqual(gunzip(response.body), 'x' * THRESHOLD * 10)
+
+    @inlineCallbacks
+    def test_not_accepted(self):
+        for accept in ([], ['identity'], ['gzip;q=0']):
+            response = yield self.request(
+                'GET', '/body/%d' % (THRESHOLD * 10),
+                {'Accept-Encoding': accept} if accept else {})
+            self.assertIsNone(self.header(response, 'content-encoding'))
+            self.assertEqual(len(response.body), THRESHOLD * 10)
+
+    @inlineCallbacks
+    def test_streams_compressed_whatever_their_size(self):
+        response = yield self.request('GET', '/stream',
+                                      {'Accept-Encoding': ['gzip']})
+        self.assertEqual(self.header(response, 'content-encoding'), 'gzip')
+        self.assertEqual(gunzip(response.body),
+                         '{"n": 0}\n{"n": 1}\n{"n": 2}\n')
+
+    def test_stream_writes_flushed_through(self):
+        request = FakeRequest('application/x-ndjson')
+        encoder = ResponseCompression(THRESHOLD).encoderForRequest(request)
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for line in ('{"n": 0}\n', '{"n": 1}\n'):
+            # each write decodes whole on its own, without waiting for more
+            self.assertEqual(decompressor.decompress(encoder.encode(line)),
+                             line)
+        decompressor.decompress(encoder.finish())
+        self.assertEqual(decompressor.unused_data, '')
+
+
+class FakeRequest(object):
+
+    def __init__(self, content_type):
+        self.responseHeaders = Headers({'content-type': [content_type]})
+
+    def getHeader(self, name):
+        return 'gzip' if name == 'accept-encoding' else None
@@ -0,0 +1,140 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from urlparse import parse_qs
+
+from simplejson import dumps
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import TestCase
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from chameleon.grpc_client.consul_watch import ConsulServiceWatch
+
+
+def entry(address, port, status='passing'):
+    return {'Node': {'Address': address},
+            'Service': {'Address': '', 'Port': port},
+            'Checks': [{'Status': status}]}
+
+
+class FakeConsul(Resource):
+    """
+    /v1/health/service/<name>, answering the queries with the scripted
+    (index, entries) responses in turn, and holding the queries beyond
+    them, as a blocking query sees no change
+    """
+
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.responses = []
+        self.queries = []  # args of the queries, in order
+        self.held = []
+        self.waiting = []  # (number of queries, Deferred)
+
+    def render_GET(self, request):
+        # twisted drops the valueless args, such as passing
+        args = parse_qs(request.uri.partition('?')[2],
+                        keep_blank_values=True)
+        self.queries.append((request.path, args))
+        for n, d in list(self.waiting):
+            if len(self.queries) >= n:
+                self.waiting.remove((n, d))
+                reactor.callLater(0, d.callback, None)
+        if not self.responses:
+            self.held.append(request)
+            return NOT_DONE_YET
+        index, entries = self.responses.pop(0)
+        if 'passing' in args:
+            entries = [e for e in entries
+                       if all(c['Status'] == 'passing' for c in e['Checks'])]
+        request.setHeader('X-Consul-Index', str(index))
+        return dumps(entries)
+
+    def wait_for_queries(self, n):
+        d = Deferred()
+        if len(self.queries) >= n:
+            d.callback(None)
+        else:
+            self.waiting.append((n, d))
+        return d
+
+
+class TestConsulServiceWatch(TestCase):
+
+    def setUp(self):
+        self.consul = FakeConsul()
+        self.port = reactor.listenTCP(0, Site(self.consul),
+                                      interface='127.0.0.1')
+        self.changes = []
+        self.watch = ConsulServiceWatch(
+            '127.0.0.1:%d' % self.port.getHost().port, 'voltha-grpc',
+            change_callback=lambda e: self.changes.append(sorted(e)))
+
+    @inlineCallbacks
+    def tearDown(self):
+        self.watch.stop()
+        for request in self.consul.held:
+            request.transport.abortConnection()
+        yield self.port.stopListening()
+        yield deferLater(reactor, 0.05, lambda: None)  # let the sockets go
+
+    @inlineCallbacks
+    def test_blocking_queries_pass_index(self):
+        self.consul.responses = [(10, [entry('10.0.0.1', 50055)]),
+                                 (11, [entry('10.0.0.1', 50055)])]
+        self.watch.start()
+        yield self.consul.wait_for_queries(3)
+        paths, args = zip(*self.consul.queries)
+        self.assertEqual(paths[0], '/v1/health/service/voltha-grpc')
+        self.assertEqual([a.get('index') for a in args],
+                         [None, ['10'], ['11']])
+        self.assertEqual(args[0]['wait'], ['30s'])
+
+    @inlineCallbacks
+    def test_unhealthy_instances_filtered(self):
+        self.consul.responses = [(10, [
+            entry('10.0.0.1', 50055),
+            entry('10.0.0.2', 50055, status='critical')])]
+        self.watch.start()
+        endpoints = yield self.watch.get_endpoints()
+        self.assertEqual(endpoints, ['10.0.0.1:50055'])
+        self.assertIn('passing', self.consul.queries[0][1])
+
+    @inlineCallbacks
+    def test_index_going_backwards_starts_over(self):
+        self.consul.responses = [(10, [entry('10.0.0.1', 50055)]),
+                                 (5, [entry('10.0.0.1', 50055)])]
+        self.watch.start()
+        yield self.consul.wait_for_queries(3)
+        self.assertEqual([a.get('index') for _, a in self.consul.queries],
+                         [None, ['10'], None])
+
+    @inlineCallbacks
+    def test_callback_on_changes_only(self):
+        a, b = entry('10.0.0.1', 50055), entry('10.0.0.2', 50056)
+        self.consul.responses = [(10, [a]), (11, [a]), (12, [b, a]),
+                                 (13, [a, b]), (14, [b])]
+        self.watch.start()
+        yield self.consul.wait_for_queries(6)
+        self.assertEqual(self.changes, [
+            ['10.0.0.1:50055'],
+            ['10.0.0.1:50055', '10.0.0.2:50056'],
+            ['10.0.0.2:50056']])
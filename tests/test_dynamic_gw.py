@@ -0,0 +1,122 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from zlib import compress
+
+import pkg_resources
+from grpc_tools import protoc
+from simplejson import loads
+from twisted.internet.defer import succeed
+from twisted.web.test.requesthelper import DummyRequest
+
+from chameleon.protos.schema_pb2 import ProtoFile, Schemas
+from chameleon.web_server.dynamic_gw import DynamicGateway
+from chameleon.web_server.route_trie import RouteTrie
+
+PROTO = '''
+syntax = "proto3";
+
+package dyntest;
+
+import "google/api/annotations.proto";
+
+message Device {
+    string id = 1;
+}
+
+service DeviceService {
+    rpc GetDevice(Device) returns (Device) {
+        option (google.api.http) = {
+            get: "/api/v1/devices/{id}"
+        };
+    }
+}
+'''
+
+
+class FakeGrpcClient(object):
+    """
+    Answers raw calls with the serialized request, echoing it back
+    """
+
+    schema_key = None
+
+    def invoke(self, stub, method, req, metadata, **kw):
+        self.call = (stub, method, req)
+        return succeed((req, []))
+
+
+class TestSwagger(TestCase):
+
+    def setUp(self):
+        self.proto_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.proto_dir, 'dyntest.proto'), 'w') as f:
+            f.write(PROTO)
+
+    def tearDown(self):
+        shutil.rmtree(self.proto_dir)
+
+    def schemas(self, source_info):
+        desc_fname = os.path.join(self.proto_dir, 'dyntest.desc')
+        rc = protoc.main([
+            'grpc_tools.protoc',
+            '-I%s' % self.proto_dir,
+            '-I%s' % os.path.join(os.path.dirname(__file__), '../protos'),
+            '-I%s' % pkg_resources.resource_filename('grpc_tools', '_proto'),
+            '--include_imports',
+            '--descriptor_set_out=%s' % desc_fname,
+        ] + (['--include_source_info'] if source_info else []) + [
+            os.path.join(self.proto_dir, 'dyntest.proto')])
+        self.assertEqual(rc, 0)
+        with open(desc_fname, 'rb') as f:
+            descriptor = compress(f.read())
+        return Schemas(protos=[ProtoFile(file_name='dyntest.proto',
+                                         proto=PROTO, descriptor=descriptor)],
+                       swagger_from='dyntest.proto')
+
+    def test_swagger_generated(self):
+        gateway = DynamicGateway(self.schemas(source_info=True))
+        self.assertIn('/api/v1/devices/{id}', gateway.swagger_json)
+
+    def test_routes_served_without_swagger(self):
+        gateway = DynamicGateway(self.schemas(source_info=False))
+        self.assertIsNone(gateway.swagger_json)
+        self.assertEqual([m['path'] for m in gateway.methods],
+                         ['/api/v1/devices/{id}'])
+
+    def test_routes_call_backend(self):
+        gateway = DynamicGateway(self.schemas(source_info=False))
+        routes = RouteTrie()
+        grpc_client = FakeGrpcClient()
+        gateway.add_routes(routes, grpc_client)
+
+        handler, kw = routes.match('GET', '/api/v1/devices/d1')
+        results = []
+        handler(DummyRequest(['api', 'v1', 'devices', 'd1']), **kw).addBoth(
+            results.append)
+        self.assertEqual(loads(results[0]), {'id': 'd1'})
+        device_class = gateway.message_class('dyntest.Device')
+        self.assertEqual(grpc_client.call, (
+            None, '/dyntest.DeviceService/GetDevice',
+            device_class(id='d1').SerializeToString()))
+
+        # and over gRPC-Web
+        self.assertIsNotNone(routes.match(
+            'POST', '/dyntest.DeviceService/GetDevice'))
@@ -0,0 +1,346 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from StringIO import StringIO
+from threading import current_thread
+from unittest import TestCase
+
+from simplejson import loads
+from twisted.internet.defer import Deferred, inlineCallbacks, succeed
+from twisted.trial import unittest
+from twisted.web.test.requesthelper import DummyRequest
+from werkzeug.exceptions import BadRequest
+
+from chameleon.protos.schema_pb2 import ProtoFile
+from chameleon.tests.sample_proto import Device, Port
+from chameleon.web_server.gateway import GatewayRoute, GatewaySettings, \
+    NdjsonRequests, ServerStreamingRoute, _accepts_protobuf
+from chameleon.web_server.transcoding import MessageDecoder
+
+
+class FakeCall(object):
+
+    cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TestNdjsonRequests(TestCase):
+
+    def requests(self, body):
+        requests = NdjsonRequests(StringIO(body), ProtoFile,
+                                  MessageDecoder(ProtoFile.DESCRIPTOR), {})
+        requests.bind(FakeCall())
+        return requests
+
+    def test_messages_read_line_by_line(self):
+        requests = self.requests('{"file_name": "a"}\n\n{"file_name": "b"}')
+        self.assertEqual([r.file_name for r in requests], ['a', 'b'])
+        self.assertFalse(requests.call.cancelled)
+        self.assertIsNone(requests.error)
+
+    def test_bad_line_cancels_call(self):
+        requests = self.requests('{"file_name": "a"}\n{"file_name": \n'
+                                 '{"file_name": "c"}\n')
+        self.assertEqual([r.file_name for r in requests], ['a'])
+        self.assertTrue(requests.call.cancelled)
+        self.assertEqual(requests.line_no, 2)
+        self.assertIn('line 2', requests.error.description)
+
+
+class FakeGrpcClient(object):
+
+    schema_key = 'schema-1'
+
+    def __init__(self, response):
+        self.response = response
+
+    def invoke(self, stub, method, req, metadata, **kw):
+        return succeed((self.response, []))
+
+
+def labels_serialized(*keys):
+    """
+    :return: a serialized Device, its labels entries in the order of keys
+    """
+    return ''.join(Device(labels={k: k.upper()}).SerializeToString()
+                   for k in keys)
+
+
+class TestETag(TestCase):
+
+    def route(self, response, raw=True):
+        """
+        :param raw: if set, the route receives the responses serialized
+        """
+        route = GatewayRoute(
+            FakeGrpcClient(response), 'Sample_GetDevice', 'get',
+            '/api/v1/devices', '', None, 'GetDevice', ProtoFile,
+            service='sample.Sample' if raw else None, output_class=Device)
+        route.encoded = []
+        encode = route.encode
+        route.encode = lambda res: route.encoded.append(res) or encode(res)
+        return route
+
+    def get(self, route, etag=None):
+        request = DummyRequest(['api', 'v1', 'devices'])
+        if etag is not None:
+            request.requestHeaders.setRawHeaders('if-none-match', [etag])
+        results = []
+        route.handle(request).addBoth(results.append)
+        self.assertEqual(len(results), 1)
+        return request, results[0]
+
+    def code(self, request):
+        return request.responseCode or 200
+
+    def etag(self, request):
+        return request.responseHeaders.getRawHeaders('etag')[0]
+
+    def test_not_modified_without_encoding(self):
+        route = self.route(labels_serialized('a', 'b'))
+        request, body = self.get(route)
+        self.assertEqual(self.code(request), 200)
+        self.assertIn('"labels"', body)
+        self.assertEqual(len(route.encoded), 1)
+        etag = self.etag(request)
+        self.assertTrue(etag.startswith('W/"'))
+
+        request, body = self.get(route, etag)
+        self.assertEqual(self.code(request), 304)
+        self.assertEqual(body, '')
+        self.assertEqual(len(route.encoded), 1)  # LazyBody left alone
+
+    def test_same_for_any_serialization(self):
+        etags = set()
+        for response, raw in [(labels_serialized('a', 'b'), True),
+                              (labels_serialized('b', 'a'), True),
+                              (Device(labels={'a': 'A', 'b': 'B'}), False)]:
+            etags.add(self.etag(self.get(self.route(response, raw))[0]))
+        self.assertEqual(len(etags), 1)
+        self.assertNotEqual(labels_serialized('a', 'b'),
+                            labels_serialized('b', 'a'))
+
+    def test_changes_with_schema(self):
+        route = self.route(labels_serialized('a'))
+        etag = self.etag(self.get(route)[0])
+        route.grpc_client.schema_key = 'schema-2'
+        request, _ = self.get(route, etag)
+        self.assertEqual(self.code(request), 200)
+        self.assertNotEqual(self.etag(request), etag)
+
+
+class FakeStream(object):
+
+    def __init__(self, on_response):
+        self.on_response = on_response
+        self.count = 0
+        self.done = Deferred()
+
+    def start(self):
+        return self.done
+
+    def deliver(self, response):
+        self.count += 1
+        self.on_response(response)
+
+
+class FakeStreamingClient(object):
+
+    def invoke_stream(self, stub, method, req, metadata, on_response):
+        self.req = req
+        self.stream = FakeStream(on_response)
+        return self.stream
+
+
+class StreamRequest(DummyRequest):
+
+    channel = object()  # connected
+    producer = None
+
+    @property
+    def startedWriting(self):
+        return bool(self.written)
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+def port(port_no, label=''):
+    return {'port_no': port_no, 'label': label, 'color': 'RED'}
+
+
+class TestServerStreaming(TestCase):
+
+    def setUp(self):
+        self.client = FakeStreamingClient()
+        route = ServerStreamingRoute(
+            self.client, 'Sample_StreamPorts', 'get', '/api/v1/ports/{label}',
+            '', None, 'StreamPorts', Port)
+        self.request = StreamRequest(['api', 'v1', 'ports', 'a'])
+        self.results = []
+        route.handle(self.request, label='a').addBoth(self.results.append)
+        self.stream = self.client.stream
+
+    def lines(self):
+        return [loads(line) for line in ''.join(self.request.written)
+                .splitlines()]
+
+    def test_responses_written_as_lines(self):
+        self.assertEqual(self.client.req, Port(label='a'))
+        self.assertIs(self.request.producer, self.stream)
+        self.stream.deliver(Port(port_no=1))
+        self.assertEqual(self.lines(), [port(1)])
+        self.stream.deliver(Port(port_no=2, label='b'))
+        self.stream.done.callback(2)
+
+        self.assertEqual(self.results, [''])
+        self.assertEqual(self.lines(), [port(1), port(2, 'b')])
+        self.assertEqual(
+            self.request.responseHeaders.getRawHeaders('content-type'),
+            ['application/x-ndjson'])
+        self.assertIsNone(self.request.producer)
+
+    def test_error_after_responses_ends_stream(self):
+        self.stream.deliver(Port(port_no=1))
+        self.stream.done.errback(ValueError('backend went away'))
+        self.assertEqual(self.results, [''])
+        self.assertEqual(self.lines(), [
+            port(1), {'error': {'message': 'backend went away'}}])
+
+    def test_error_before_responses_raised(self):
+        self.stream.done.errback(ValueError('backend went away'))
+        self.assertEqual(self.request.written, [])
+        self.results[0].trap(ValueError)
+
+
+class RecordingGrpcClient(object):
+    """
+    Answers raw calls with the serialized request, echoing it back
+    """
+
+    schema_key = None
+
+    def invoke(self, stub, method, req, metadata, **kw):
+        self.call = (stub, method, req)
+        return succeed((req, []))
+
+
+class TestProtobuf(TestCase):
+
+    def setUp(self):
+        self.grpc_client = RecordingGrpcClient()
+        self.route = GatewayRoute(
+            self.grpc_client, 'Sample_UpdateDevice', 'put',
+            '/api/v1/devices/{id}', '*', None, 'UpdateDevice', Device,
+            service='sample.Sample', output_class=Device)
+
+    def put(self, body, content_type, accept=None, **kw):
+        request = DummyRequest(['api', 'v1', 'devices'])
+        request.path = '/api/v1/devices'
+        request.content = StringIO(body)
+        request.requestHeaders.setRawHeaders('content-type', [content_type])
+        if accept is not None:
+            request.requestHeaders.setRawHeaders('accept', [accept])
+        results = []
+        self.route.handle(request, **kw).addBoth(results.append)
+        return request, results[0]
+
+    def content_type(self, request):
+        return request.responseHeaders.getRawHeaders('content-type')[0]
+
+    def test_accept_negotiated(self):
+        for accept, expected in [
+                (None, False),
+                ('application/json', False),
+                ('application/x-protobuf', True),
+                ('application/json, application/x-protobuf', False),
+                ('application/json;q=0.5, application/x-protobuf', True),
+                ('*/*', False)]:
+            request = DummyRequest([])
+            if accept is not None:
+                request.requestHeaders.setRawHeaders('accept', [accept])
+            self.assertEqual(_accepts_protobuf(request), expected, accept)
+
+    def test_bytes_passed_through(self):
+        body = Device(id='d1', counter=7).SerializeToString()
+        request, response = self.put(body, 'application/x-protobuf',
+                                     'application/x-protobuf')
+        self.assertEqual(self.grpc_client.call,
+                         (None, '/sample.Sample/UpdateDevice', body))
+        self.assertEqual(response, body)
+        self.assertEqual(self.content_type(request), 'application/x-protobuf')
+
+    def test_path_parameters_take_precedence(self):
+        body = Device(id='d1', counter=7).SerializeToString()
+        self.put(body, 'application/x-protobuf', 'application/x-protobuf',
+                 id='d2')
+        self.assertEqual(Device.FromString(self.grpc_client.call[2]),
+                         Device(id='d2', counter=7))
+
+    def test_json_request_protobuf_response(self):
+        request, response = self.put('{"id": "d1", "counter": "7"}',
+                                     'application/json',
+                                     'application/x-protobuf')
+        self.assertEqual(Device.FromString(response),
+                         Device(id='d1', counter=7))
+
+    def test_protobuf_request_json_response(self):
+        body = Device(id='d1', counter=7).SerializeToString()
+        request, response = self.put(body, 'application/x-protobuf')
+        self.assertEqual(loads(response)['counter'], '7')
+        self.assertEqual(self.content_type(request), 'application/json')
+
+    def test_invalid_protobuf_rejected(self):
+        request, response = self.put('\xff', 'application/x-protobuf')
+        response.trap(BadRequest)
+
+
+class TestTranscodeOffload(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = GatewaySettings(transcode_offload=100,
+                                        stream_threshold=0)
+        self.settings.start()
+        self.route = GatewayRoute(
+            FakeGrpcClient(None), 'Sample_GetDevice', 'get',
+            '/api/v1/devices', '', None, 'GetDevice', ProtoFile,
+            output_class=Device)
+        self.route.configure(self.settings)
+        self.threads = []
+        transcode = self.route.transcode
+        self.route.transcode = lambda res: self.threads.append(
+            current_thread().name) or transcode(res)
+
+    def tearDown(self):
+        self.settings.stop()
+
+    def test_small_response_transcoded_on_reactor(self):
+        body = self.route.encode(Device(id='d1'))
+        self.assertEqual(loads(body)['id'], 'd1')
+        self.assertEqual(self.threads, [current_thread().name])
+
+    @inlineCallbacks
+    def test_large_response_transcoded_on_pool(self):
+        device = Device(id='d' * 200)
+        body = yield self.route.encode(device.SerializeToString())
+        self.assertEqual(loads(body)['id'], device.id)
+        self.assertEqual(len(self.threads), 1)
+        self.assertNotEqual(self.threads[0], current_thread().name)
@@ -0,0 +1,362 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import socket
+import tempfile
+from concurrent import futures
+from threading import Event
+from unittest import TestCase
+from zlib import compress
+
+import grpc
+from grpc._channel import _Rendezvous
+from simplejson import loads
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, inlineCallbacks, succeed
+from twisted.internet.task import Clock, deferLater
+from twisted.trial import unittest
+
+from chameleon.grpc_client import balancer
+from chameleon.grpc_client.grpc_client import GrpcClient
+from chameleon.protos.schema_pb2 import ProtoFile, Schemas
+
+
+def schemas(version):
+    return Schemas(protos=[ProtoFile(file_name='test.proto',
+                                     proto='// version %d' % version)])
+
+
+class Restarted(Exception):
+    pass
+
+
+class TestSchemaReload(TestCase):
+    """
+    The schema is fetched on every connect, and only reloaded if it changed
+    """
+
+    def setUp(self):
+        # channels are closed after a delay once drained
+        self.reactor, balancer.reactor = balancer.reactor, Clock()
+        self.work_dir = tempfile.mkdtemp()
+        self.client = self.make_client()
+
+    def tearDown(self):
+        self.client.stop()
+        shutil.rmtree(self.work_dir)
+        balancer.reactor = self.reactor
+
+    def make_client(self, dynamic_gateway=False):
+        client = GrpcClient(None, self.work_dir, 'localhost:1',
+                            dynamic_gateway=dynamic_gateway)
+        client._backoff = lambda msg: succeed(None)
+        client.served = schemas(1)  # schema of the backend
+        client._retrieve_schema = lambda: succeed(client.served)
+        client.loaded = []
+        client._load_schema = client.loaded.append
+        return client
+
+    def reconnect(self):
+        self.client.connected = False
+        self.client.connect()
+
+    def test_unchanged_schema_is_not_reloaded(self):
+        self.client.connect()
+        self.reconnect()
+        self.assertEqual(self.client.loaded, [schemas(1)])
+        self.assertTrue(self.client.connected)
+
+    def test_failed_load_is_retried(self):
+        def fail(schemas):
+            raise IOError('cannot compile')
+
+        self.client._load_schema = fail
+        self.client.connect()
+        self.assertFalse(self.client.connected)
+        self.assertIsNone(self.client.schema)
+
+        # the retry must not take the schema for the active one
+        self.client._load_schema = self.client.loaded.append
+        self.client.connect()
+        self.assertTrue(self.client.connected)
+        self.assertEqual(self.client.loaded, [schemas(1)])
+        self.assertEqual(self.client.schema, schemas(1))
+
+    def test_changed_schema_restarts_generated_gateway(self):
+        restarts = []
+
+        def restart(reason):
+            restarts.append(reason)
+            raise Restarted(reason)  # as execv would not return
+
+        self.client._restart = restart
+        self.client.connect()
+        self.client.served = schemas(2)
+        self.reconnect()
+        self.assertEqual(restarts, ['schema changed'])
+        self.assertEqual(self.client.loaded, [schemas(1)])
+        self.assertEqual(self.client.schema, schemas(1))
+
+    def test_changed_schema_is_reloaded_by_dynamic_gateway(self):
+        self.client.stop()
+        self.client = self.make_client(dynamic_gateway=True)
+        self.client.connect()
+        self.client.served = schemas(2)
+        self.reconnect()
+        self.assertTrue(self.client.connected)
+        self.assertEqual(self.client.schema, schemas(2))
+
+    def test_failed_route_reload_keeps_previous_schema(self):
+        def reload_routes():
+            if self.client.schema == schemas(2) and broken:
+                raise ValueError('cannot build routes')
+            reloads.append(self.client.schema)
+
+        broken = True
+        reloads = []
+        self.client.stop()
+        self.client = self.make_client(dynamic_gateway=True)
+        self.client.reconnect_callback = reload_routes
+        self.client.connect()
+        self.client.served = schemas(2)
+        self.reconnect()
+        self.assertFalse(self.client.connected)
+        self.assertEqual(self.client.schema, schemas(1))
+
+        broken = False
+        self.client.connect()
+        self.assertTrue(self.client.connected)
+        self.assertEqual(reloads, [schemas(1), schemas(2)])
+
+
+class TestSchemaRetrieval(TestCase):
+
+    def setUp(self):
+        self.reactor, balancer.reactor = balancer.reactor, Clock()
+        # a backend accepting connections, but never answering
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.work_dir = tempfile.mkdtemp()
+        self.client = GrpcClient(
+            None, self.work_dir,
+            '127.0.0.1:%d' % self.listener.getsockname()[1])
+
+    def tearDown(self):
+        self.client.stop()
+        self.listener.close()
+        shutil.rmtree(self.work_dir)
+        balancer.reactor = self.reactor
+
+    def test_hanging_backend_does_not_block_reactor(self):
+        d = self.client.connect()
+        self.assertFalse(d.called)
+        self.assertTrue(self.client.connecting)
+        self.assertFalse(self.client.connected)
+
+        # connecting already, so not connecting a second time
+        self.client.connect()
+        self.assertEqual(len(self.client.balancer.backends), 1)
+
+        # given up on, rather than retried
+        d.cancel()
+        self.assertFalse(self.client.connecting)
+        self.assertEqual(self.client.retries, 0)
+
+
+COMMON_PROTO = '''
+syntax = "proto3";
+
+package compiletest;
+
+message Device {
+    string id = 1;
+}
+'''
+
+SERVICE_PROTO = '''
+syntax = "proto3";
+
+package compiletest;
+
+import "google/api/annotations.proto";
+import "common.proto";
+
+service DeviceService {
+    rpc GetDevice(Device) returns (Device) {
+        option (google.api.http) = {
+            get: "/api/v1/devices/{id}"
+        };
+    }
+}
+'''
+
+
+class TestCompile(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.schema_dir = tempfile.mkdtemp()
+        self.client = GrpcClient(None, self.work_dir, dynamic_gateway=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+        shutil.rmtree(self.schema_dir)
+
+    def schemas(self, *protos):
+        return Schemas(protos=[ProtoFile(file_name=name, proto=source,
+                                         descriptor=compress(''))
+                               for name, source in protos],
+                       swagger_from='service.proto')
+
+    def test_files_generated_in_one_pass(self):
+        self.client._build_schema(self.schema_dir, self.schemas(
+            ('common.proto', COMMON_PROTO), ('service.proto', SERVICE_PROTO)))
+        generated = set(os.listdir(self.schema_dir))
+        for fname in ['common_pb2.py', 'common_pb2_grpc.py', 'service_pb2.py',
+                      'service_pb2_grpc.py', 'service_gw.py']:
+            self.assertIn(fname, generated)
+            with open(os.path.join(self.schema_dir, fname)) as f:
+                compile(f.read(), fname, 'exec')
+        with open(os.path.join(self.schema_dir, 'service_gw.py')) as f:
+            self.assertIn("'/api/v1/devices/{id}'", f.read())
+        with open(os.path.join(self.schema_dir, 'swagger.json')) as f:
+            self.assertIn('/api/v1/devices/{id}', loads(f.read())['paths'])
+
+    def test_protoc_error_raised(self):
+        self.assertRaises(Exception, self.client._build_schema,
+                          self.schema_dir,
+                          self.schemas(('service.proto', SERVICE_PROTO)))
+
+
+class FakeBackend(object):
+    """
+    gRPC server of the methods of service test.Test, taking and returning
+    serialized messages
+    """
+
+    def __init__(self):
+        self.release = Event()  # lets the Slow calls complete
+        self.cancelled = Event()
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+        self.server.add_generic_rpc_handlers([
+            grpc.method_handlers_generic_handler('test.Test', dict(
+                Echo=grpc.unary_unary_rpc_method_handler(self.echo),
+                Slow=grpc.unary_unary_rpc_method_handler(self.slow),
+                Fail=grpc.unary_unary_rpc_method_handler(self.fail),
+                Stream=grpc.unary_stream_rpc_method_handler(self.stream)))])
+        self.port = self.server.add_insecure_port('127.0.0.1:0')
+        self.server.start()
+
+    def stop(self):
+        self.release.set()
+        self.server.stop(0)
+
+    def echo(self, request, context):
+        context.set_trailing_metadata([('echoed', str(len(request)))])
+        return request
+
+    def slow(self, request, context):
+        context.add_callback(self.cancelled.set)
+        self.release.wait(5)
+        return request
+
+    def fail(self, request, context):
+        context.set_code(grpc.StatusCode.NOT_FOUND)
+        context.set_details('no such thing')
+        return ''
+
+    def stream(self, request, context):
+        for i in range(3):
+            yield '%s %d' % (request, i)
+
+
+class TestInvoke(unittest.TestCase):
+
+    def setUp(self):
+        self.reactor, balancer.reactor = balancer.reactor, Clock()
+        self.backend = FakeBackend()
+        self.work_dir = tempfile.mkdtemp()
+        self.client = GrpcClient(None, self.work_dir,
+                                 '127.0.0.1:%d' % self.backend.port)
+        self.client.balancer.update([self.client.endpoint])
+        self.client.connected = True
+
+    def tearDown(self):
+        self.client.stop()
+        self.backend.stop()
+        shutil.rmtree(self.work_dir)
+        balancer.reactor = self.reactor
+
+    def invoke(self, method, request='request'):
+        return self.client.invoke(None, '/test.Test/' + method, request, [])
+
+    @inlineCallbacks
+    def test_response_and_trailing_metadata(self):
+        response, metadata = yield self.invoke('Echo')
+        self.assertEqual(response, 'request')
+        self.assertIn(('echoed', '7'), metadata)
+        self.assertEqual(self.client.balancer.stats()[
+            self.client.endpoint]['in_flight'], 0)
+
+    @inlineCallbacks
+    def test_reactor_free_while_call_outstanding(self):
+        d = self.invoke('Slow')
+        yield deferLater(reactor, 0.05, lambda: None)
+        self.assertFalse(d.called)
+        self.assertEqual(self.client.balancer.stats()[
+            self.client.endpoint]['in_flight'], 1)
+        self.backend.release.set()
+        response, _ = yield d
+        self.assertEqual(response, 'request')
+
+    @inlineCallbacks
+    def test_cancel_cancels_call(self):
+        d = self.invoke('Slow')
+        yield deferLater(reactor, 0.05, lambda: None)
+        d.cancel()
+        yield self.assertFailure(d, CancelledError)
+        self.assertTrue(self.backend.cancelled.wait(5))
+        self.assertEqual(self.client.balancer.stats()[
+            self.client.endpoint]['in_flight'], 0)
+
+    @inlineCallbacks
+    def test_error_status_raised(self):
+        e = yield self.assertFailure(self.invoke('Fail'), _Rendezvous)
+        self.assertEqual(e.code(), grpc.StatusCode.NOT_FOUND)
+        self.assertEqual(e.details(), 'no such thing')
+
+    @inlineCallbacks
+    def test_method_reused_across_calls(self):
+        yield self.invoke('Echo')
+        backend = self.client.balancer.pick()
+        method = backend.methods[None, '/test.Test/Echo']
+        yield self.invoke('Echo')
+        self.assertIs(backend.methods[None, '/test.Test/Echo'], method)
+
+    @inlineCallbacks
+    def test_stream_responses_delivered(self):
+        responses = []
+        stream = self.client.invoke_stream(None, '/test.Test/Stream',
+                                           'request', [], responses.append)
+        count = yield stream.start()
+        self.assertEqual(count, 3)
+        self.assertEqual(responses,
+                         ['request 0', 'request 1', 'request 2'])
+        self.assertEqual(self.client.balancer.stats()[
+            self.client.endpoint]['in_flight'], 0)
@@ -0,0 +1,185 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from StringIO import StringIO
+from unittest import TestCase
+
+from grpc import StatusCode
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.web.test.requesthelper import DummyRequest
+from werkzeug.exceptions import ServiceUnavailable, UnsupportedMediaType
+
+from chameleon.web_server.grpc_web import COMPRESSED, DATA, TRAILER, \
+    GrpcWebRoute, _FRAME, frame, read_messages, trailers
+
+
+def frames(data):
+    """
+    :return: [(flags, payload)] of the frames in data
+    """
+    result = []
+    while data:
+        flags, length = _FRAME.unpack_from(data)
+        result.append((flags, data[_FRAME.size:_FRAME.size + length]))
+        data = data[_FRAME.size + length:]
+    return result
+
+
+class TestFraming(TestCase):
+
+    def test_frame(self):
+        self.assertEqual(frame(DATA, 'abc'), '\x00\x00\x00\x00\x03abc')
+        self.assertEqual(frame(TRAILER, ''), '\x80\x00\x00\x00\x00')
+
+    def test_read_messages(self):
+        self.assertEqual(read_messages(''), [])
+        self.assertEqual(read_messages(frame(DATA, '') + frame(DATA, 'ab')),
+                         ['', 'ab'])
+
+    def test_malformed_body_rejected(self):
+        for body in ['\x00\x00\x00', frame(DATA, 'abc')[:-1],
+                     frame(COMPRESSED, 'abc'), frame(TRAILER, '')]:
+            self.assertRaises(ValueError, read_messages, body)
+
+    def test_trailers(self):
+        self.assertEqual(frames(trailers(StatusCode.OK)),
+                         [(TRAILER, 'grpc-status:0\r\n')])
+        self.assertEqual(frames(trailers(
+            StatusCode.NOT_FOUND, u'no \xe9 100%\n',
+            [('X-Id', '7'), ('trace-bin', '\x00\x01')])), [(
+                TRAILER, 'grpc-status:5\r\n'
+                         'grpc-message:no %C3%A9 100%25%0A\r\n'
+                         'x-id:7\r\n'
+                         'trace-bin:AAE=\r\n')])
+
+
+class FakeStream(object):
+
+    def __init__(self, call, on_response):
+        self.call = call
+        self.on_response = on_response
+        self.done = Deferred()
+
+    def start(self):
+        return self.done
+
+
+class FakeStreamCall(object):
+
+    def trailing_metadata(self):
+        return [('x-count', '2')]
+
+
+class FakeGrpcClient(object):
+
+    def __init__(self, result=None):
+        self.result = result
+        self.calls = []
+
+    def invoke(self, stub, method, request, metadata, **kw):
+        self.calls.append((method, request, sorted(metadata)))
+        return self.result
+
+    def invoke_stream(self, stub, method, request, metadata, on_response):
+        self.calls.append((method, request, sorted(metadata)))
+        self.stream = FakeStream(FakeStreamCall(), on_response)
+        return self.stream
+
+
+class StreamRequest(DummyRequest):
+
+    channel = object()  # connected
+    producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class TestGrpcWebRoute(TestCase):
+
+    def route(self, result=None, **kw):
+        return GrpcWebRoute(FakeGrpcClient(result), 'test.Test', 'Echo', **kw)
+
+    def post(self, route, body, content_type='application/grpc-web+proto'):
+        request = StreamRequest([])
+        request.content = StringIO(body)
+        request.requestHeaders.setRawHeaders('content-type', [content_type])
+        request.requestHeaders.setRawHeaders('grpc-timeout', ['1S'])
+        request.requestHeaders.setRawHeaders('x-user', ['u1'])
+        results = []
+        route.handle(request).addBoth(results.append)
+        return request, results
+
+    def test_unary_call(self):
+        route = self.route(succeed(('response', [('x-id', '7')])))
+        request, results = self.post(route, frame(DATA, 'request'))
+        self.assertEqual(results, [''])
+        self.assertEqual(route.grpc_client.calls, [(
+            '/test.Test/Echo', 'request',
+            [('content-type', 'application/grpc-web+proto'),
+             ('x-user', 'u1')])])
+        self.assertEqual(frames(''.join(request.written)), [
+            (DATA, 'response'), (TRAILER, 'grpc-status:0\r\nx-id:7\r\n')])
+        self.assertEqual(
+            request.responseHeaders.getRawHeaders('content-type'),
+            ['application/grpc-web+proto'])
+
+    def test_server_streaming_call(self):
+        route = self.route(server_streaming=True)
+        request, results = self.post(route, frame(DATA, 'request'))
+        stream = route.grpc_client.stream
+        self.assertIs(request.producer, stream)
+        stream.on_response('a')
+        stream.on_response('b')
+        stream.done.callback(2)
+        self.assertEqual(results, [''])
+        self.assertEqual(frames(''.join(request.written)), [
+            (DATA, 'a'), (DATA, 'b'),
+            (TRAILER, 'grpc-status:0\r\nx-count:2\r\n')])
+        self.assertIsNone(request.producer)
+
+    def test_unsupported_content_type(self):
+        request, results = self.post(self.route(), frame(DATA, 'request'),
+                                     'application/json')
+        results[0].trap(UnsupportedMediaType)
+
+    def assertStatus(self, request, results, code):
+        self.assertEqual(results, [''])
+        (flags, payload), = frames(''.join(request.written))
+        self.assertEqual(flags, TRAILER)
+        self.assertTrue(payload.startswith(
+            'grpc-status:%d\r\n' % code.value[0]), payload)
+
+    def test_client_streaming_unimplemented(self):
+        route = self.route(client_streaming=True)
+        request, results = self.post(route, frame(DATA, 'request'))
+        self.assertStatus(request, results, StatusCode.UNIMPLEMENTED)
+        self.assertEqual(route.grpc_client.calls, [])
+
+    def test_malformed_request(self):
+        for body in [frame(DATA, 'a') + frame(DATA, 'b'), '\x00\x00']:
+            route = self.route()
+            request, results = self.post(route, body)
+            self.assertStatus(request, results, StatusCode.INTERNAL)
+            self.assertEqual(route.grpc_client.calls, [])
+
+    def test_backend_unavailable(self):
+        route = self.route(fail(ServiceUnavailable()))
+        request, results = self.post(route, frame(DATA, 'request'))
+        self.assertStatus(request, results, StatusCode.UNAVAILABLE)
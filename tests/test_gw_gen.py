@@ -0,0 +1,113 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+
+from google.protobuf.json_format import MessageToDict
+
+from chameleon.protoc_plugins.gw_gen import generate_encoders
+from chameleon.tests.sample_proto import FILES, compile_proto, \
+    message_classes, sample_devices
+from chameleon.web_server.transcoding import load_encoders
+
+FLATTENED_ALIKE = '''
+syntax = "proto3";
+
+package a;
+
+message b_c {
+    string from_a = 1;
+}
+'''
+
+FLATTENED_ALIKE_TOO = '''
+syntax = "proto3";
+
+package a_b;
+
+import "a.proto";
+
+enum c_Kind {
+    X = 0;
+}
+
+message c {
+    enum Kind {
+        Y = 0;
+        Z = 1;
+    }
+    Kind kind = 1;
+    c_Kind other_kind = 2;
+    a.b_c b_c = 3;
+}
+'''
+
+EXTENDABLE = '''
+syntax = "proto2";
+
+package ext;
+
+message Holder {
+    optional Extendable extendable = 1;
+}
+
+message Extendable {
+    optional int32 id = 1;
+    extensions 100 to 199;
+}
+
+extend Extendable {
+    optional string note = 100;
+}
+'''
+
+
+class TestEncoders(TestCase):
+
+    def assertSameAsMessageToDict(self, encoders, message):
+        encode = encoders[message.DESCRIPTOR.full_name]
+        self.assertEqual(encode(message), MessageToDict(message, True, True))
+
+    def test_same_as_message_to_dict(self):
+        encoders = load_encoders(generate_encoders(FILES, ['sample.Device']))
+        for device in sample_devices():
+            self.assertSameAsMessageToDict(encoders, device)
+            for port in device.ports:
+                self.assertSameAsMessageToDict(encoders, port)
+
+    def test_names_flattened_alike_do_not_collide(self):
+        files, pool = compile_proto('a_b.proto', FLATTENED_ALIKE_TOO,
+                                    {'a.proto': FLATTENED_ALIKE})
+        c_class, = message_classes(pool, 'a_b.c')
+        c = c_class(kind=1)
+        c.b_c.from_a = 'a'
+        encoders = load_encoders(generate_encoders(files, ['a_b.c']))
+        self.assertIsNot(encoders['a_b.c'], encoders['a.b_c'])
+        self.assertSameAsMessageToDict(encoders, c)
+        self.assertSameAsMessageToDict(encoders, c.b_c)
+
+    def test_extendable_left_to_message_to_dict(self):
+        files, pool = compile_proto('ext.proto', EXTENDABLE)
+        holder_class, = message_classes(pool, 'ext.Holder')
+        holder = holder_class()
+        holder.extendable.id = 1
+        note = pool.FindExtensionByName('ext.note')
+        holder.extendable.Extensions[note] = 'noted'
+        encoders = load_encoders(generate_encoders(files, ['ext.Holder']))
+        self.assertSameAsMessageToDict(encoders, holder)
+        self.assertEqual(
+            encoders['ext.Holder'](holder)['extendable']['[ext.note]'],
+            'noted')
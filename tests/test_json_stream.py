@@ -0,0 +1,58 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+
+from google.protobuf.descriptor_pb2 import FileDescriptorSet
+from google.protobuf.json_format import MessageToJson
+from simplejson import dumps, loads
+
+from chameleon.tests.sample_proto import FILES, sample_devices
+from chameleon.web_server.json_stream import JsonEncoder
+
+
+def canonical(document):
+    # NaN and the like are compared as text
+    return dumps(loads(document), sort_keys=True)
+
+
+class TestIterencode(TestCase):
+    """
+    The document streamed is the one of MessageToJson(message, True, True),
+    whether the message is walked or encoded at once
+    """
+
+    def assertSameDocument(self, message, chunk_size):
+        chunks = list(JsonEncoder(chunk_size=chunk_size).iterencode(message))
+        self.assertEqual(canonical(''.join(chunks)),
+                         canonical(MessageToJson(message, True, True)))
+        return chunks
+
+    def test_walked(self):
+        for device in sample_devices():
+            self.assertSameDocument(device, 1)
+
+    def test_encoded_at_once(self):
+        for device in sample_devices():
+            chunks = self.assertSameDocument(device, 1024 * 1024)
+            self.assertEqual(len(chunks), 1)
+
+    def test_large_message_chunked(self):
+        fds = FileDescriptorSet(file=FILES)
+        chunks = self.assertSameDocument(fds, 1024)
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks[:-1]:
+            self.assertGreaterEqual(len(chunk), 1024)
@@ -0,0 +1,261 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+from StringIO import StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from simplejson import loads
+from twisted.internet.defer import succeed
+from twisted.web.test.requesthelper import DummyRequest
+
+from chameleon.protos.schema_pb2 import ProtoFile
+from chameleon.web_server.gateway import GatewayRoute, GatewaySettings
+from chameleon.web_server.response_cache import ResponseCache
+from chameleon.web_server.shared_cache import SharedResponseCache
+
+HEADERS = [('Content-Type', 'application/json'), ('ETag', 'W/"1"')]
+
+
+class CacheTests(object):
+    """
+    Tests common to the response caches, made with self.make_cache(bytes)
+    """
+
+    def setUp(self):
+        self.cache = self.make_cache(64 * 1024)
+
+    def put(self, key, body, path='/api/v1/devices', ttl=60, cache=None):
+        cache = cache or self.cache
+        cache.put(key, HEADERS, body, ttl, path, cache.generation)
+
+    def test_put_get(self):
+        self.put('k', '{"id": "d1"}')
+        self.assertEqual(self.cache.get('k'), (HEADERS, '{"id": "d1"}'))
+        self.assertIsNone(self.cache.get('other'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']),
+                         (1, 1, 1))
+
+    def test_put_replaces(self):
+        self.put('k', 'old')
+        self.put('k', 'new')
+        self.assertEqual(self.cache.get('k')[1], 'new')
+        self.assertEqual(self.cache.stats()['entries'], 1)
+
+    def test_expired(self):
+        self.put('k', 'body', ttl=-1)
+        self.assertIsNone(self.cache.get('k'))
+
+    def test_eviction(self):
+        cache = self.make_cache(4096)
+        for i in xrange(20):
+            self.put(i, str(i) * 1000, cache=cache)
+            self.assertEqual(cache.get(i)[1], str(i) * 1000)
+            self.assertLessEqual(cache.stats()['bytes'], 4096)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.get(19)[1], '19' * 1000)
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+    def test_too_large(self):
+        self.put('k', 'x' * 65 * 1024)
+        self.assertIsNone(self.cache.get('k'))
+
+    def test_invalidation_of_overlapping_paths(self):
+        self.put('device', 'd', '/api/v1/devices/d1')
+        self.put('devices', 'ds', '/api/v1/devices')
+        self.put('ports', 'ps', '/api/v1/devices/d1/ports')
+        self.put('other', 'o', '/api/v1/devices/d2')
+        self.put('logical', 'l', '/api/v1/logical_devices')
+        self.cache.invalidate('/api/v1/devices/d1')
+        for key in ('device', 'devices', 'ports'):
+            self.assertIsNone(self.cache.get(key))
+        for key in ('other', 'logical'):
+            self.assertIsNotNone(self.cache.get(key))
+        self.assertEqual(self.cache.stats()['invalidations'], 3)
+
+    def test_put_across_invalidation_dropped(self):
+        generation = self.cache.generation
+        self.cache.invalidate('/api/v1/devices')
+        self.cache.put('k', HEADERS, 'stale', 60, '/api/v1/devices',
+                       generation)
+        self.assertIsNone(self.cache.get('k'))
+
+
+class TestResponseCache(CacheTests, TestCase):
+
+    def make_cache(self, max_bytes):
+        return ResponseCache(max_bytes)
+
+    def test_least_recently_used_evicted(self):
+        cache = self.make_cache(3000)
+        for key in 'abc':
+            self.put(key, 'x' * 600, cache=cache)
+        cache.get('a')
+        self.put('d', 'x' * 600, cache=cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+
+
+class TestSharedResponseCache(CacheTests, TestCase):
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.filename = os.path.join(self.dir, 'cache')
+        CacheTests.setUp(self)
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def make_cache(self, max_bytes, sets=64):
+        return SharedResponseCache(
+            os.path.join(self.dir, 'cache-%d' % max_bytes), max_bytes, sets)
+
+    def test_shared_between_instances(self):
+        self.put('k', 'body')
+        other = self.make_cache(64 * 1024)
+        self.assertEqual(other.get('k'), (HEADERS, 'body'))
+        other.invalidate('/api/v1/devices')
+        self.assertIsNone(self.cache.get('k'))
+
+    def test_wrap_around_keeps_recent_records(self):
+        cache = self.make_cache(4096)
+        wrapped = False
+        for i in xrange(50):
+            body = chr(65 + i % 26) * (300 + i % 7 * 100)
+            self.put(i, body, cache=cache)
+            self.assertEqual(cache.get(i)[1], body)
+            if i:
+                # the previous record always fits alongside
+                self.assertIsNotNone(cache.get(i - 1))
+            header = cache._lock()
+            cache._unlock(header)
+            wrapped = wrapped or header[8]
+        self.assertTrue(wrapped)
+        self.assertIsNone(cache.get(0))
+        self.assertGreater(cache.stats()['evictions'], 0)
+
+    def test_layout_change_replaces_file(self):
+        self.put('k', 'body')
+        filename = self.cache.filename
+        inode = os.stat(filename).st_ino
+
+        resized = SharedResponseCache(filename, 128 * 1024, 64)
+        self.assertIsNone(resized.get('k'))
+        self.assertNotEqual(os.stat(filename).st_ino, inode)
+        self.assertEqual(os.stat(filename).st_size, resized.file_size)
+        self.assertEqual(os.listdir(self.dir), ['cache-65536'])
+
+        # the old mapping is left intact, rather than truncated under it
+        self.assertEqual(self.cache.get('k'), (HEADERS, 'body'))
+
+        # and a new instance with the same layout shares the new file
+        self.put('k2', 'body2', cache=resized)
+        again = SharedResponseCache(filename, 128 * 1024, 64)
+        self.assertEqual(again.get('k2'), (HEADERS, 'body2'))
+
+    def test_forked_process_maps_file_anew(self):
+        self.put('k', 'body')
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.put('child', 'from child')
+                os._exit(0 if self.cache.pid == os.getpid() else 1)
+            except Exception:
+                os._exit(2)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertEqual(self.cache.get('child'), (HEADERS, 'from child'))
+
+
+class FakeGrpcClient(object):
+    """
+    Answers with the requested file, its content telling the calls apart
+    """
+
+    schema_key = None
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, stub, method, req, metadata, **kw):
+        self.calls += 1
+        return succeed((ProtoFile(file_name=req.file_name,
+                                  proto=str(self.calls)), []))
+
+
+class TestCachedRoutes(TestCase):
+
+    def setUp(self):
+        self.grpc_client = FakeGrpcClient()
+        self.settings = GatewaySettings(
+            response_cache='Schema_GetFile=60', transcode_offload=0)
+        self.routes = {}
+        for name, verb, path, body in [
+                ('Schema_GetFile', 'get', '/api/v1/files/{file_name}', ''),
+                ('Schema_ListFiles', 'get', '/api/v1/files', ''),
+                ('Schema_PutFile', 'put', '/api/v1/files/{file_name}', '*')]:
+            route = GatewayRoute(self.grpc_client, name, verb, path, body,
+                                 None, name.split('_')[1], ProtoFile)
+            route.configure(self.settings)
+            self.routes[name] = route
+
+    def request(self, name, file_name, headers=()):
+        path = '/api/v1/files/' + file_name
+        request = DummyRequest(path.split('/')[1:])
+        request.path = path
+        request.content = StringIO('{}')
+        for key, value in headers:
+            request.requestHeaders.setRawHeaders(key, [value])
+        results = []
+        self.routes[name].handle(request, file_name=file_name).addBoth(
+            results.append)
+        return loads(results[0])
+
+    def get(self, file_name, **kw):
+        return self.request('Schema_GetFile', file_name, **kw)['proto']
+
+    def test_ttl_per_route(self):
+        self.assertEqual(self.routes['Schema_GetFile'].cache_ttl, 60)
+        self.assertIsNone(self.routes['Schema_ListFiles'].cache_ttl)
+        self.assertIsNone(self.routes['Schema_PutFile'].cache_ttl)
+        self.assertEqual(GatewaySettings(response_cache='*=5').cache_ttl_for(
+            self.routes['Schema_ListFiles']), 5)
+
+    def test_cached_response_served(self):
+        self.assertEqual(self.get('a'), '1')
+        self.assertEqual(self.get('a'), '1')
+        self.assertEqual(self.get('b'), '2')
+        self.assertEqual(self.grpc_client.calls, 2)
+
+    def test_uncached_route_calls_backend(self):
+        for _ in range(2):
+            self.request('Schema_ListFiles', 'a')
+        self.assertEqual(self.grpc_client.calls, 2)
+
+    def test_key_includes_coalesce_headers(self):
+        self.assertEqual(self.get('a', headers=[('authorization', 'x')]), '1')
+        self.assertEqual(self.get('a', headers=[('authorization', 'y')]), '2')
+        self.assertEqual(self.get('a', headers=[('authorization', 'x')]), '1')
+
+    def test_write_invalidates_overlapping_paths(self):
+        self.get('a')
+        self.get('b')
+        self.request('Schema_PutFile', 'a')
+        self.assertEqual(self.get('a'), '4')
+        self.assertEqual(self.get('b'), '2')
@@ -0,0 +1,120 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from time import sleep
+
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, inlineCallbacks
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import TestCase
+
+from chameleon.grpc_client.response_stream import ResponseStream
+
+
+class FakeCall(object):
+    """
+    Response iterator of a server-streaming call, yielding 1, 2, ... up to
+    length (forever if None), then raising error if given
+    """
+
+    def __init__(self, length=None, error=None):
+        self.length = length
+        self.error = error
+        self.reads = 0
+        self.cancelled = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.cancelled or self.reads == self.length:
+            if self.error is not None:
+                raise self.error
+            raise StopIteration()
+        self.reads += 1
+        return self.reads
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def wait_for(condition, timeout=1):
+    """
+    Block (the reactor) until condition() holds, for at most timeout seconds
+    """
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        sleep(0.01)
+    return condition()
+
+
+class TestResponseStream(TestCase):
+
+    def setUp(self):
+        self.responses = []
+
+    def stream(self, call):
+        return ResponseStream(call, self.responses.append)
+
+    @inlineCallbacks
+    def test_responses_delivered_in_order(self):
+        count = yield self.stream(FakeCall(3)).start()
+        self.assertEqual(count, 3)
+        self.assertEqual(self.responses, [1, 2, 3])
+
+    @inlineCallbacks
+    def test_call_failure(self):
+        stream = self.stream(FakeCall(1, error=ValueError('reset')))
+        yield self.assertFailure(stream.start(), ValueError)
+        self.assertEqual(self.responses, [1])
+
+    @inlineCallbacks
+    def test_failing_consumer_cancels_call(self):
+        def on_response(response):
+            raise ValueError('cannot write')
+
+        call = FakeCall()
+        yield self.assertFailure(ResponseStream(call, on_response).start(),
+                                 ValueError)
+        self.assertTrue(call.cancelled)
+
+    @inlineCallbacks
+    def test_reads_at_most_window_ahead(self):
+        call = FakeCall()
+        stream = self.stream(call)
+        d = stream.start()
+        # with the reactor blocked, nothing gets delivered
+        self.assertTrue(wait_for(lambda: call.reads == ResponseStream.WINDOW))
+        sleep(0.05)
+        self.assertEqual(call.reads, ResponseStream.WINDOW)
+
+        d.cancel()
+        yield self.assertFailure(d, CancelledError)
+        self.assertTrue(call.cancelled)
+
+    @inlineCallbacks
+    def test_paused_stream_not_read(self):
+        call = FakeCall(3)
+        stream = self.stream(call)
+        stream.pauseProducing()
+        d = stream.start()
+        yield deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(call.reads, 0)
+
+        stream.resumeProducing()
+        count = yield d
+        self.assertEqual(count, 3)
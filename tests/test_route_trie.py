@@ -0,0 +1,95 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+
+from werkzeug.exceptions import BadRequest, MethodNotAllowed
+
+from chameleon.web_server.route_trie import RouteTrie
+
+
+def get_device(request, id):
+    pass
+
+
+def head_device(request, id):
+    pass
+
+
+def update_device(request, id):
+    pass
+
+
+class TestHead(TestCase):
+
+    def setUp(self):
+        self.routes = RouteTrie()
+        self.routes.add('get', '/api/v1/devices/{id}', get_device)
+        self.routes.add('put', '/api/v1/devices/{id}', update_device)
+        self.routes.add('post', '/api/v1/reboot/{id}', update_device)
+
+    def test_head_falls_back_to_get(self):
+        self.assertEqual(self.routes.match('HEAD', '/api/v1/devices/d1'),
+                         (get_device, {'id': 'd1'}))
+
+    def test_explicit_head_handler_takes_precedence(self):
+        self.routes.add('head', '/api/v1/devices/{id}', head_device)
+        self.assertEqual(self.routes.match('HEAD', '/api/v1/devices/d1'),
+                         (head_device, {'id': 'd1'}))
+
+    def test_allow_lists_head_with_get(self):
+        try:
+            self.routes.match('DELETE', '/api/v1/devices/d1')
+        except MethodNotAllowed as e:
+            self.assertEqual(e.valid_methods, ['GET', 'HEAD', 'PUT'])
+        else:
+            self.fail('DELETE allowed')
+
+    def test_head_without_get_is_not_allowed(self):
+        self.assertRaises(MethodNotAllowed, self.routes.match, 'HEAD',
+                          '/api/v1/reboot/d1')
+
+
+class TestParams(TestCase):
+
+    def setUp(self):
+        self.routes = RouteTrie()
+
+    def test_names_differ_per_route(self):
+        self.routes.add('get', '/x/{id}', get_device)
+        self.routes.add('get', '/x/{device_id}/ports/{port}', head_device)
+        self.assertEqual(self.routes.match('GET', '/x/d1'),
+                         (get_device, {'id': 'd1'}))
+        self.assertEqual(self.routes.match('GET', '/x/d1/ports/p2'),
+                         (head_device, {'device_id': 'd1', 'port': 'p2'}))
+
+    def test_names_differ_per_verb(self):
+        self.routes.add('get', '/x/{id}', get_device)
+        self.routes.add('put', '/x/{device_id}', update_device)
+        self.assertEqual(self.routes.match('PUT', '/x/d1'),
+                         (update_device, {'device_id': 'd1'}))
+
+    def test_backtracking_drops_bound_values(self):
+        self.routes.add('get', '/x/{id}/a/literal', get_device)
+        self.routes.add('get', '/x/{a}/{b}/{c}', head_device)
+        self.assertEqual(self.routes.match('GET', '/x/1/a/other'),
+                         (head_device, {'a': '1', 'b': 'a', 'c': 'other'}))
+
+    def test_converters(self):
+        self.routes.add('get', '/x/{no}', get_device, {'no': int})
+        self.assertEqual(self.routes.match('GET', '/x/7'),
+                         (get_device, {'no': 7}))
+        self.assertRaises(BadRequest, self.routes.match, 'GET', '/x/seven')
@@ -0,0 +1,136 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from chameleon.grpc_client.grpc_client import GrpcClient
+from chameleon.grpc_client.schema_cache import SchemaCache
+from chameleon.protos.schema_pb2 import ProtoFile, Schemas
+
+
+def schemas(version):
+    return Schemas(protos=[ProtoFile(file_name='test.proto',
+                                     proto='// version %d' % version)])
+
+
+def write_file(schema_dir):
+    with open(os.path.join(schema_dir, 'test_pb2.py'), 'w') as f:
+        f.write('# generated')
+
+
+class TestSchemaCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = SchemaCache(self.cache_dir, max_entries=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def build(self, version, mtime=None):
+        key = self.cache.key_for(schemas(version))
+        schema_dir = self.cache.build(key, write_file)
+        if mtime is not None:
+            os.utime(os.path.join(schema_dir, SchemaCache.COMPLETE_MARKER),
+                     (mtime, mtime))
+        return key
+
+    def test_key_depends_on_schema_and_salt(self):
+        self.assertEqual(self.cache.key_for(schemas(1)),
+                         self.cache.key_for(schemas(1)))
+        self.assertNotEqual(self.cache.key_for(schemas(1)),
+                            self.cache.key_for(schemas(2)))
+        self.assertNotEqual(
+            self.cache.key_for(schemas(1)),
+            SchemaCache(self.cache_dir, salt='x').key_for(schemas(1)))
+
+    def test_built_entry_found(self):
+        key = self.cache.key_for(schemas(1))
+        self.assertIsNone(self.cache.lookup(key))
+        schema_dir = self.cache.build(key, write_file)
+        self.assertEqual(self.cache.lookup(key), schema_dir)
+        self.assertTrue(os.path.exists(
+            os.path.join(schema_dir, 'test_pb2.py')))
+
+        # and by another instance, as after a restart
+        self.assertEqual(SchemaCache(self.cache_dir).lookup(key), schema_dir)
+
+    def test_failed_build_leaves_nothing_behind(self):
+        def fail(schema_dir):
+            write_file(schema_dir)
+            raise ValueError('protoc failed')
+
+        key = self.cache.key_for(schemas(1))
+        self.assertRaises(ValueError, self.cache.build, key, fail)
+        self.assertIsNone(self.cache.lookup(key))
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_incomplete_entry_not_used(self):
+        key = self.cache.key_for(schemas(1))
+        os.makedirs(self.cache.path_for(key))
+        self.assertIsNone(self.cache.lookup(key))
+
+    def test_entry_built_concurrently_kept(self):
+        key = self.build(1)
+
+        def build_again(schema_dir):
+            with open(os.path.join(schema_dir, 'test_pb2.py'), 'w') as f:
+                f.write('# built again')
+
+        schema_dir = self.cache.build(key, build_again)
+        with open(os.path.join(schema_dir, 'test_pb2.py')) as f:
+            self.assertEqual(f.read(), '# generated')
+        self.assertEqual(os.listdir(self.cache_dir), [key])
+
+    def test_least_recently_used_evicted(self):
+        first = self.build(1, mtime=1000)
+        second = self.build(2, mtime=2000)
+        self.cache.lookup(first)  # now used more recently than second
+        third = self.build(3)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         sorted([first, third]))
+        self.assertIsNone(self.cache.lookup(second))
+
+
+class TestLoadSchema(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def load(self, version):
+        """
+        Load a schema with a fresh client, as after a restart
+        :return: the calls to the compiler
+        """
+        client = GrpcClient(None, self.work_dir)
+        builds = []
+        client._build_schema = lambda d, s: builds.append(s) or write_file(d)
+        client._import_schema = lambda d: None
+        client._load_schema(schemas(version))
+        self.assertEqual(client.schema_key,
+                         client.schema_cache.key_for(schemas(version)))
+        return builds
+
+    def test_unchanged_schema_compiled_once(self):
+        self.assertEqual(self.load(1), [schemas(1)])
+        self.assertEqual(self.load(1), [])
+        self.assertEqual(self.load(2), [schemas(2)])
@@ -0,0 +1,142 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from unittest import TestCase
+
+from twisted.internet.defer import CancelledError, Deferred, succeed
+from twisted.web.test.requesthelper import DummyRequest
+
+from chameleon.protos.schema_pb2 import ProtoFile
+from chameleon.web_server.gateway import GatewayRoute, GatewaySettings
+from chameleon.web_server.single_flight import SingleFlight
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.executions = []
+
+    def execute(self):
+        d = Deferred(lambda d: self.executions.remove(d))
+        self.executions.append(d)
+        return d
+
+    def results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_concurrent_calls_merged(self):
+        a = self.results(self.single_flight.call('k', self.execute))
+        b = self.results(self.single_flight.call('k', self.execute))
+        c = self.results(self.single_flight.call('other', self.execute))
+        self.assertEqual(len(self.executions), 2)
+        self.assertEqual(self.single_flight.stats(),
+                         dict(calls=2, merged=1, in_flight=2))
+
+        self.executions[0].callback('result')
+        self.assertEqual(a, ['result'])
+        self.assertEqual(b, ['result'])
+        self.assertEqual(c, [])
+        self.assertEqual(self.single_flight.stats()['in_flight'], 1)
+
+    def test_calls_after_landing_execute_again(self):
+        self.single_flight.call('k', self.execute)
+        self.executions.pop().callback('first')
+        d = self.results(self.single_flight.call('k', self.execute))
+        self.executions.pop().callback('second')
+        self.assertEqual(d, ['second'])
+        self.assertEqual(self.single_flight.stats()['calls'], 2)
+
+    def test_cancelling_one_waiter_keeps_execution(self):
+        a = self.single_flight.call('k', self.execute)
+        b = self.results(self.single_flight.call('k', self.execute))
+        a.addErrback(lambda f: f.trap(CancelledError))
+        a.cancel()
+        self.assertEqual(len(self.executions), 1)
+
+        self.executions[0].callback('result')
+        self.assertEqual(b, ['result'])
+
+    def test_cancelling_last_waiter_cancels_execution(self):
+        a = self.single_flight.call('k', self.execute)
+        b = self.single_flight.call('k', self.execute)
+        for d in (a, b):
+            d.addErrback(lambda f: f.trap(CancelledError))
+            d.cancel()
+        self.assertEqual(self.executions, [])
+        self.assertEqual(self.single_flight.stats()['in_flight'], 0)
+
+        # a new call no longer joins the cancelled execution
+        self.single_flight.call('k', self.execute)
+        self.assertEqual(len(self.executions), 1)
+
+    def test_error_fanned_out(self):
+        a = self.results(self.single_flight.call('k', self.execute))
+        b = self.results(self.single_flight.call('k', self.execute))
+        self.executions[0].errback(ValueError('backend down'))
+        for results in (a, b):
+            self.assertEqual(len(results), 1)
+            results[0].trap(ValueError)
+        self.assertEqual(self.single_flight.stats()['in_flight'], 0)
+
+    def test_synchronous_exception_fanned_out(self):
+        def fail():
+            raise ValueError('bad')
+        a = self.results(self.single_flight.call('k', fail))
+        a[0].trap(ValueError)
+        self.assertEqual(self.single_flight.stats()['in_flight'], 0)
+
+
+class FakeGrpcClient(object):
+
+    schema_key = None
+
+    def __init__(self):
+        self.metadata = []
+
+    def invoke(self, stub, method, req, metadata, **kw):
+        self.metadata.append(sorted(metadata))
+        return succeed((ProtoFile(file_name='f'), []))
+
+
+class TestCoalescedHeaders(TestCase):
+
+    def setUp(self):
+        self.grpc_client = FakeGrpcClient()
+        self.route = GatewayRoute(
+            self.grpc_client, 'Schema_GetFile', 'get', '/files', '', None,
+            'GetFile', ProtoFile)
+
+    def get(self):
+        request = DummyRequest(['files'])
+        request.requestHeaders.setRawHeaders('authorization', ['Bearer t'])
+        request.requestHeaders.setRawHeaders('x-trace-id', ['1234'])
+        return self.route.read(request, ProtoFile())
+
+    def test_uncoalesced_route_passes_all_headers(self):
+        self.route.configure(GatewaySettings(transcode_offload=0))
+        self.get()
+        self.assertEqual(self.grpc_client.metadata, [
+            [('authorization', 'Bearer t'), ('x-trace-id', '1234')]])
+
+    def test_coalesced_route_passes_coalesce_headers_only(self):
+        self.route.configure(GatewaySettings(
+            single_flight='Schema_GetFile', transcode_offload=0))
+        self.get()
+        self.assertEqual(self.grpc_client.metadata, [
+            [('authorization', 'Bearer t')]])
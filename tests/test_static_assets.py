@@ -0,0 +1,226 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import zlib
+from unittest import TestCase
+
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.trial import unittest
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+from twisted.web.server import Site
+from twisted.web.test.requesthelper import DummyRequest
+
+from chameleon.web_server.etags import make_etag, not_modified
+from chameleon.web_server.static_assets import StaticAsset, StaticDirectory
+from chameleon.web_server.web_server import WebServer
+
+DOCUMENT = '{"paths": {%s}}' % ', '.join('"/api/v1/x%d": {}' % i
+                                          for i in xrange(100))
+
+
+def request(headers=()):
+    request = DummyRequest([])
+    for key, value in headers:
+        request.requestHeaders.setRawHeaders(key, [value])
+    return request
+
+
+def header(request, name):
+    return request.responseHeaders.getRawHeaders(name, [None])[0]
+
+
+class TestETags(TestCase):
+
+    def test_make_etag(self):
+        etag = make_etag('data')
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(make_etag('data'), etag)
+        self.assertNotEqual(make_etag('other'), etag)
+        self.assertTrue(make_etag('data', '-gzip').endswith('-gzip"'))
+        self.assertNotEqual(make_etag('data', salt='schema-1'), etag)
+
+    def test_not_modified(self):
+        etag = make_etag('data')
+        for if_none_match, expected in [
+                (None, False),
+                (etag, True),
+                ('W/' + etag, True),
+                ('"other", %s' % etag, True),
+                ('"other"', False),
+                ('*', True)]:
+            headers = [('if-none-match', if_none_match)] \
+                if if_none_match else []
+            self.assertEqual(not_modified(request(headers), etag), expected,
+                             if_none_match)
+        self.assertTrue(not_modified(request([('if-none-match', etag)]),
+                                     'W/' + etag))
+
+
+class TestStaticAsset(TestCase):
+
+    def setUp(self):
+        self.asset = StaticAsset(DOCUMENT, 'application/json')
+
+    def test_identity(self):
+        req = request()
+        self.assertEqual(self.asset.render(req), DOCUMENT)
+        self.assertEqual(header(req, 'etag'), make_etag(DOCUMENT))
+        self.assertEqual(header(req, 'content-type'), 'application/json')
+        self.assertEqual(header(req, 'cache-control'), 'no-cache')
+        self.assertEqual(header(req, 'vary'), 'Accept-Encoding')
+        self.assertIsNone(header(req, 'content-encoding'))
+
+    def test_gzip(self):
+        req = request([('accept-encoding', 'gzip, deflate')])
+        body = self.asset.render(req)
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS),
+                         DOCUMENT)
+        self.assertEqual(header(req, 'content-encoding'), 'gzip')
+        self.assertEqual(header(req, 'content-length'), str(len(body)))
+        self.assertNotEqual(header(req, 'etag'), self.asset.etag)
+        self.assertIs(self.asset.render(request([('accept-encoding',
+                                                  'gzip')])), body)
+
+    def test_not_modified(self):
+        req = request([('if-none-match', self.asset.etag)])
+        self.assertEqual(self.asset.render(req), '')
+        self.assertEqual(req.responseCode, 304)
+        self.assertEqual(header(req, 'etag'), self.asset.etag)
+
+        # the gzip-encoded form is another representation
+        req = request([('if-none-match', self.asset.etag),
+                       ('accept-encoding', 'gzip')])
+        self.assertNotEqual(self.asset.render(req), '')
+        self.assertIsNone(req.responseCode)
+
+    def test_incompressible_served_as_is(self):
+        asset = StaticAsset(os.urandom(1000), 'image/png')
+        self.assertIsNone(asset.gzipped)
+        req = request([('accept-encoding', 'gzip')])
+        self.assertEqual(asset.render(req), asset.body)
+        self.assertIsNone(header(req, 'content-encoding'))
+        self.assertIsNone(header(req, 'vary'))
+
+
+class TestStaticDirectory(TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root_dir, 'css'))
+        for path in ['index.html', 'css/index.html', 'css/ui.css']:
+            with open(os.path.join(self.root_dir, path), 'w') as f:
+                f.write(path)
+        self.directory = StaticDirectory(self.root_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_get(self):
+        for path, expected in [('', 'index.html'),
+                               ('css/', 'css/index.html'),
+                               ('css/ui.css', 'css/ui.css'),
+                               ('css/../index.html', 'index.html')]:
+            self.assertEqual(self.directory.get(path).body, expected)
+        self.assertEqual(self.directory.get('css/ui.css').content_type,
+                         'text/css')
+        self.assertIsNone(self.directory.get('missing.js'))
+        self.assertIsNone(self.directory.get('../' +
+                                             os.path.basename(self.root_dir)))
+
+    def test_loaded_once(self):
+        asset = self.directory.get('css/ui.css')
+        with open(os.path.join(self.root_dir, 'css/ui.css'), 'w') as f:
+            f.write('changed')
+        self.assertIs(self.directory.get('css/ui.css'), asset)
+
+
+class FakeGrpcClient(object):
+
+    dynamic_gateway = False
+
+    def __init__(self, schema_dir):
+        self.schema_dir = schema_dir
+
+
+class TestSwaggerJson(unittest.TestCase):
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        self.server = WebServer(0, self.schema_dir, '/swagger',
+                                FakeGrpcClient(self.schema_dir))
+        self.port = reactor.listenTCP(0, Site(self.server.dispatcher),
+                                      interface='127.0.0.1')
+        self.pool = HTTPConnectionPool(reactor, persistent=False)
+        self.agent = Agent(reactor, pool=self.pool)
+
+    @inlineCallbacks
+    def tearDown(self):
+        yield self.pool.closeCachedConnections()
+        yield self.port.stopListening()
+        shutil.rmtree(self.schema_dir)
+
+    def write_swagger(self, document):
+        with open(os.path.join(self.schema_dir, 'swagger.json'), 'w') as f:
+            f.write(document)
+
+    @inlineCallbacks
+    def get(self, path, headers=None):
+        url = 'http://127.0.0.1:%d%s' % (self.port.getHost().port, path)
+        response = yield self.agent.request('GET', url,
+                                            Headers(headers or {}))
+        response.body = yield readBody(response)
+        returnValue(response)
+
+    def etag(self, response):
+        return response.headers.getRawHeaders('etag')[0]
+
+    @inlineCallbacks
+    def test_swagger_json_reloaded_with_routes(self):
+        self.write_swagger('{"version": 1}')
+        response = yield self.get('/swagger/v1/swagger.json')
+        self.assertEqual(response.body, '{"version": 1}')
+        etag = self.etag(response)
+        response = yield self.get('/swagger/v1/swagger.json',
+                                  {'If-None-Match': [etag]})
+        self.assertEqual(response.code, 304)
+
+        # served from memory until the next schema
+        self.write_swagger('{"version": 2}')
+        response = yield self.get('/swagger/v1/swagger.json')
+        self.assertEqual(response.body, '{"version": 1}')
+
+        self.server.reload_generated_routes()
+        response = yield self.get('/swagger/v1/swagger.json',
+                                  {'If-None-Match': [etag]})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, '{"version": 2}')
+        self.assertNotEqual(self.etag(response), etag)
+
+    @inlineCallbacks
+    def test_swagger_ui_served(self):
+        response = yield self.get('/swagger/', {'Accept-Encoding': ['gzip']})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers.getRawHeaders('content-encoding'),
+                         ['gzip'])
+        self.assertIn('<html', zlib.decompress(response.body,
+                                               16 + zlib.MAX_WBITS))
+        response = yield self.get('/swagger/no-such-file.js')
+        self.assertEqual(response.code, 404)
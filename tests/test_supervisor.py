@@ -0,0 +1,108 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import sys
+from itertools import count
+from unittest import TestCase
+
+from twisted.internet.error import ProcessDone, ProcessTerminated
+from twisted.internet.task import Clock
+from twisted.python.failure import Failure
+
+from chameleon import supervisor
+from chameleon.supervisor import Supervisor
+
+
+class FakeProcess(object):
+
+    def __init__(self, protocol, argv, pid):
+        self.protocol = protocol
+        self.argv = argv
+        self.pid = pid
+        self.signals = []
+
+    def signalProcess(self, signal):
+        self.signals.append(signal)
+
+    def end(self, reason=None):
+        self.protocol.processEnded(
+            Failure(reason or ProcessTerminated(signal=9)))
+
+
+class FakeReactor(Clock):
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.spawned = []
+        self.pids = count(100)
+
+    def spawnProcess(self, protocol, executable, args, **kw):
+        process = FakeProcess(protocol, args, next(self.pids))
+        self.spawned.append(process)
+        protocol.transport = process
+        protocol.connectionMade()
+        return process
+
+
+class TestSupervisor(TestCase):
+
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.patched = supervisor.reactor, supervisor.time
+        supervisor.reactor = self.reactor
+        supervisor.time = self.reactor.seconds
+        self.supervisor = Supervisor(2, ['main.py', '--workers', '2']).start()
+
+    def tearDown(self):
+        supervisor.reactor, supervisor.time = self.patched
+
+    def test_workers_started_with_their_id(self):
+        self.assertEqual([p.argv for p in self.reactor.spawned], [
+            [sys.executable, 'main.py', '--workers', '2', '--worker-id', '0'],
+            [sys.executable, 'main.py', '--workers', '2', '--worker-id', '1']])
+
+    def test_dead_worker_restarted_with_backoff(self):
+        delays = []
+        for _ in range(len(Supervisor.RESTART_BACKOFF) + 1):
+            spawned = len(self.reactor.spawned)
+            self.supervisor.processes[1].end()
+            self.reactor.advance(0)
+            self.assertEqual(len(self.reactor.spawned), spawned)
+            delays.append(self.reactor.getDelayedCalls()[0].getTime() -
+                          self.reactor.seconds())
+            self.reactor.advance(delays[-1])
+            self.assertEqual(len(self.reactor.spawned), spawned + 1)
+            self.assertEqual(self.reactor.spawned[-1].argv[-1], '1')
+        self.assertEqual(delays, Supervisor.RESTART_BACKOFF +
+                         Supervisor.RESTART_BACKOFF[-1:])
+
+        # back to the shortest delay after running stably
+        self.reactor.advance(Supervisor.STABLE_AFTER + 1)
+        self.supervisor.processes[1].end()
+        self.assertEqual(self.reactor.getDelayedCalls()[0].getTime() -
+                         self.reactor.seconds(), Supervisor.RESTART_BACKOFF[0])
+
+    def test_stop_terminates_workers(self):
+        workers = list(self.reactor.spawned)
+        stopped = []
+        self.supervisor.stop().addCallback(stopped.append)
+        self.assertEqual([p.signals for p in workers], [['TERM'], ['TERM']])
+
+        workers[0].end(ProcessDone(0))
+        self.assertEqual(stopped, [])
+        workers[1].end(ProcessDone(0))
+        self.assertEqual(stopped, [None])
+        self.assertEqual(self.reactor.getDelayedCalls(), [])
@@ -0,0 +1,136 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+from unittest import TestCase
+
+from google.protobuf.json_format import MessageToDict, ParseDict, ParseError
+from simplejson import loads
+
+from chameleon.tests.sample_proto import Device, sample_devices
+from chameleon.web_server.transcoding import DecodeError, MessageDecoder
+
+INVALID = [
+    '{"unknown": 1}',
+    '{"id": 1}',
+    '{"counter": "1.5"}',
+    '{"counter": true}',
+    '{"ratio": NaN}',
+    '{"ratio": "nan"}',
+    '{"enabled": "true"}',
+    '{"color": "PURPLE"}',
+    '{"payload": 12}',
+    '{"ports": {}}',
+    '{"ports": [{"port_no": -1}]}',
+    '{"labels": []}',
+    '{"flags": {"yes": "y"}}',
+    '{"ports_by_no": {"one": {}}}',
+    '{"created": "yesterday"}',
+    '{"max_counter": "x"}',
+    # several fields of one oneof
+    '{"mac": "00:11:22:33:44:55", "vlan": 10}',
+    '{"vlan": 0, "via": {}}',
+]
+
+# one field under its name and its JSON name, which ParseDict lets through
+# as long as the keys differ
+DUPLICATE = [
+    '{"proto_name_differs": 1, "protoNameDiffers": 2}',
+    '{"main_port": {"port_no": 1, "portNo": 2}}',
+    '{"ports": [{"portNo": 1, "port_no": 1}]}',
+]
+
+VALID = [
+    '{}',
+    '{"id": "d1", "counter": "-12", "serial": 18446744073709551615, '
+    '"ratio": "Infinity", "weight": "-Infinity", "enabled": false}',
+    '{"counter": 1e3, "color": 2, "colors": ["RED", 1, 7]}',
+    '{"protoNameDiffers": 5, "mainPort": {"portNo": 3}}',
+    # a null oneof field does not count as set
+    '{"mac": null, "vlan": 3}',
+    '{"via": null, "mac": "m"}',
+    '{"labels": null, "main_port": null, "anything": null}',
+    '{"payload": "AP8-_w", "blobs": {"12": "AP8+/w=="}}',
+    '{"flags": {"true": "y", "false": "n"}, "ports_by_no": {"-3": {}}}',
+    '{"created": "2017-07-14T02:40:00Z", "uptime": "1.5s", '
+    '"extra": {"a": [1, null, {"b": true}]}, "nickname": "n", '
+    '"max_counter": "5", "active": null}',
+]
+
+
+class TestParity(TestCase):
+    """
+    MessageDecoder accepts the JSON objects ParseDict accepts, into the
+    same messages, and rejects the others
+    """
+
+    def decode(self, js):
+        message = Device()
+        MessageDecoder(Device.DESCRIPTOR).decode(js, message)
+        return message
+
+    def parse(self, js):
+        return ParseDict(js, Device())
+
+    def assertParity(self, js):
+        try:
+            expected = self.parse(js)
+        except ParseError:
+            self.assertRaises(DecodeError, self.decode, js)
+            return False
+        self.assertEqual(self.decode(js), expected)
+        return True
+
+    def test_invalid(self):
+        for document in INVALID:
+            try:
+                self.assertFalse(self.assertParity(loads(document)))
+            except AssertionError as e:
+                self.fail('%s: %s' % (document, e))
+
+    def test_duplicate_fields(self):
+        for document in DUPLICATE:
+            self.assertRaises(DecodeError, self.decode, loads(document))
+
+    def test_valid(self):
+        for document in VALID:
+            try:
+                self.assertTrue(self.assertParity(loads(document)))
+            except AssertionError as e:
+                self.fail('%s: %s' % (document, e))
+
+    def test_round_trip(self):
+        for device in sample_devices()[:2]:  # NaN != NaN
+            for proto_names in (False, True):
+                js = MessageToDict(device, True, proto_names)
+                self.assertParity(js)
+                self.assertEqual(self.decode(js), device)
+
+    def test_error_paths(self):
+        for document, path in [
+                ('{"ports": [{}, {"label": 1}]}', 'ports[1].label'),
+                ('{"ports_by_no": {"2": {"color": "X"}}}',
+                 'ports_by_no[2].color'),
+                ('{"main_port": {"port_no": 1, "portNo": 2}}',
+                 'main_port.portNo'),
+                ('{"mac": "m", "via": {}}', 'via')]:
+            try:
+                self.decode(loads(document, object_pairs_hook=OrderedDict))
+            except DecodeError as e:
+                self.assertEqual(e.path, path)
+            else:
+                self.fail('%s decoded' % document)
+
@@ -0,0 +1,181 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+from time import time
+from unittest import TestCase
+
+from simplejson import dumps, loads
+from twisted.internet.defer import gatherResults, inlineCallbacks, succeed
+from twisted.trial import unittest
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+from twisted.web.test.requesthelper import DummyRequest
+
+from chameleon.web_server.gateway import GatewaySettings
+from chameleon.web_server.web_server import WebServer, aggregate_stats
+
+GW_MODULE = '''
+def add_routes(app, grpc_client):
+    app.add('get', '/api/v1/%(name)s', lambda request: '%(name)s')
+    %(after)s
+'''
+
+
+class FakeGrpcClient(object):
+
+    dynamic_gateway = False
+
+    def __init__(self, schema_dir):
+        self.schema_dir = schema_dir
+
+
+class TestReloadRoutes(TestCase):
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        sys.path.insert(0, self.schema_dir)
+        self.server = WebServer(0, self.schema_dir, '/swagger',
+                                FakeGrpcClient(self.schema_dir))
+
+    def tearDown(self):
+        sys.path.remove(self.schema_dir)
+        for fname in os.listdir(self.schema_dir):
+            sys.modules.pop(fname.partition('.')[0], None)
+        shutil.rmtree(self.schema_dir)
+
+    def add_gw_module(self, name, after='pass'):
+        with open(os.path.join(self.schema_dir, name + '_gw.py'), 'w') as f:
+            f.write(GW_MODULE % dict(name=name, after=after))
+
+    def match(self, path):
+        return self.server.dispatcher.routes.match('GET', path)
+
+    def test_reload_swaps_in_new_table(self):
+        self.add_gw_module('reload_first')
+        self.server.reload_generated_routes()
+        self.assertEqual(self.server.dispatcher.routes.version, 1)
+        self.assertIsNotNone(self.match('/api/v1/reload_first'))
+
+    def test_reload_failing_partway_keeps_previous_table(self):
+        self.add_gw_module('reload_kept')
+        self.server.reload_generated_routes()
+        routes = self.server.dispatcher.routes
+        swagger_asset = self.server.swagger_asset = object()
+
+        # routes of the broken module get added before it fails
+        self.add_gw_module('reload_broken',
+                           after="raise ValueError('cannot build routes')")
+        self.assertRaises(ValueError, self.server.reload_generated_routes)
+        self.assertIs(self.server.dispatcher.routes, routes)
+        self.assertIs(self.server.swagger_asset, swagger_asset)
+        self.assertIsNotNone(self.match('/api/v1/reload_kept'))
+        self.assertIsNone(self.match('/api/v1/reload_broken'))
+
+
+class TestLifecycle(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    @inlineCallbacks
+    def test_transcode_pool_runs_while_started(self):
+        settings = GatewaySettings()
+        self.assertFalse(settings.transcode_pool.started)
+        server = WebServer(0, self.work_dir, '/swagger',
+                           FakeGrpcClient(None), gateway_settings=settings)
+        server._open_endpoint = lambda: succeed(None)  # not listening
+        yield server.start()
+        self.assertTrue(settings.transcode_pool.started)
+        yield server.stop()
+        self.assertFalse(settings.transcode_pool.started)
+
+
+class TestAggregateStats(TestCase):
+
+    def test_counters_summed(self):
+        self.assertEqual(aggregate_stats([
+            dict(routes_version=2, single_flight=dict(calls=3, merged=1),
+                 response_cache=dict(shared=True, hits=7)),
+            dict(routes_version=3, single_flight=dict(calls=4, merged=0),
+                 response_cache=dict(shared=True, hits=7)),
+        ]), dict(routes_version=3, single_flight=dict(calls=7, merged=1),
+                 response_cache=dict(shared=True, hits=7)))
+
+    def test_per_backend_counters_summed(self):
+        self.assertEqual(aggregate_stats([
+            dict(backends={'a:1': dict(in_flight=1, draining=False)}),
+            dict(backends={'a:1': dict(in_flight=2, draining=False),
+                           'b:1': dict(in_flight=1, draining=True)}),
+        ]), dict(backends={'a:1': dict(in_flight=3), 'b:1': dict(in_flight=1)}))
+
+
+class TestWorkerStats(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.server = self.make_server(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def make_server(self, worker_id):
+        server = WebServer(0, self.work_dir, '/swagger', FakeGrpcClient(None),
+                           worker_id=worker_id)
+        server.collect_stats = lambda: dict(routes_version=1, requests=10)
+        if not os.path.isdir(server.stats_dir):
+            os.makedirs(server.stats_dir)
+        return server
+
+    def test_stats_of_live_workers_aggregated(self):
+        self.make_server(1)._publish_stats()
+        with open(os.path.join(self.server.stats_dir, '2.json'), 'w') as f:
+            f.write(dumps(dict(requests=5, pid=1, updated=time() - 3600)))
+        stats = loads(self.server.stats(DummyRequest([])))
+        self.assertEqual(stats['worker_id'], 0)
+        self.assertEqual(sorted(stats['workers']), ['0', '1'])
+        self.assertEqual(stats['totals'], dict(routes_version=1,
+                                               requests=20))
+
+
+class TestSharedPort(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_workers_listen_on_same_port(self):
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        ports = []
+        for worker_id in (0, 1):
+            server = WebServer(port, self.work_dir, '/swagger',
+                               FakeGrpcClient(None), worker_id=worker_id)
+            ports.append(server._listen_shared(Site(Resource())))
+        self.assertEqual([p.getHost().port for p in ports], [port, port])
+        return gatherResults([p.stopListening() for p in ports])
@@ -0,0 +1,189 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+HTTP compression of the responses, negotiated through Accept-Encoding, and
+decoding of gzip-encoded request bodies.
+
+Responses are compressed as they are written, one write at a time, so that
+neither the whole body nor its compressed form need to be held in memory.
+Whether a response is compressed is decided on its first write: responses
+whose body is written at once are left alone if it is smaller than the
+threshold, while streamed ones (NDJSON, gRPC-Web) are always compressed,
+each write being flushed through to the client as it is made.
+
+brotli is used if the brotli module is installed and the client prefers
+it, gzip otherwise.
+"""
+
+import zlib
+from gzip import GzipFile
+
+# private, but the interfaces behind twisted.web's EncodingResourceWrapper;
+# Twisted is pinned in requirements.txt to the versions tested with
+from twisted.web.iweb import _IRequestEncoder, _IRequestEncoderFactory
+from werkzeug.exceptions import BadRequest, UnsupportedMediaType
+from werkzeug.http import parse_accept_header
+from zope.interface import implementer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# content types of the responses written out piecemeal, as they are
+# produced
+STREAMING_TYPES = ('application/x-ndjson', 'application/grpc-web+proto')
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+@implementer(_IRequestEncoderFactory)
+class ResponseCompression(object):
+
+    def __init__(self, threshold=1024, level=6):
+        """
+        :param threshold: size in bytes under which bodies written at once
+        are not compressed
+        :param level: compression level, 1 (fastest) to 9 (smallest); the
+        brotli quality is derived from it
+        """
+        self.threshold = threshold
+        self.level = level
+
+    def encoderForRequest(self, request):
+        accept = request.getHeader('accept-encoding')
+        if not accept:
+            return None
+        encoding = parse_accept_header(accept).best_match(ENCODINGS)
+        if encoding is None:
+            return None
+        return _ResponseEncoder(request, encoding, self.threshold, self.level)
+
+
+@implementer(_IRequestEncoder)
+class _ResponseEncoder(object):
+
+    def __init__(self, request, encoding, threshold, level):
+        self.request = request
+        self.encoding = encoding
+        self.threshold = threshold
+        self.level = level
+        self.compressor = None
+        self.flush = False  # flush each write through, for streams
+        self.decided = False
+
+    def _start(self, data):
+        self.decided = True
+        headers = self.request.responseHeaders
+        if headers.hasHeader('content-encoding'):
+            return  # encoded already
+        headers.addRawHeader('vary', 'Accept-Encoding')
+        content_type = (headers.getRawHeaders('content-type') or [''])[0]
+        self.flush = content_type.partition(';')[0].strip() in \
+            STREAMING_TYPES
+        if not self.flush and len(data) < self.threshold:
+            return
+        headers.setRawHeaders('content-encoding', [self.encoding])
+        headers.removeHeader('content-length')
+        if self.encoding == 'br':
+            self.compressor = _BrotliCompressor(self.level)
+        else:
+            self.compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def encode(self, data):
+        if not self.decided:
+            self._start(data)
+        if self.compressor is None:
+            return data
+        data = self.compressor.compress(data)
+        if self.flush:
+            data += self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    def finish(self):
+        if self.compressor is None:
+            return ''
+        compressor, self.compressor = self.compressor, None
+        return compressor.flush()
+
+
+class _BrotliCompressor(object):
+    """
+    brotli.Compressor behind the zlib compressor interface
+    """
+
+    def __init__(self, level):
+        # brotli qualities go from 0 to 11; those above 5 are too slow to
+        # compress responses on the fly
+        self.compressor = brotli.Compressor(quality=min(level, 5))
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        if mode == zlib.Z_FINISH:
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+class _GzipBody(object):
+    """
+    File-like gzip-encoded request body, decoded as it is read, and reported
+    as a bad request if it cannot be
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.body = GzipFile(fileobj=content, mode='rb')
+
+    def _decoded(self, read, *args):
+        try:
+            return read(*args)
+        except (IOError, EOFError, zlib.error) as e:
+            raise BadRequest('invalid gzip request body: %s' % e)
+
+    def read(self, size=-1):
+        return self._decoded(self.body.read, size)
+
+    def readline(self, size=-1):
+        return self._decoded(self.body.readline, size)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        self.body.close()
+        self.content.close()
+
+
+def decode_request_body(request):
+    """
+    Have request.content decode a gzip-encoded body as it is read
+    :raises UnsupportedMediaType: for other encodings than gzip
+    """
+    encoding = request.getHeader('content-encoding')
+    if not encoding or encoding.strip().lower() == 'identity':
+        return
+    if encoding.strip().lower() not in ('gzip', 'x-gzip'):
+        raise UnsupportedMediaType('unsupported content encoding %s' %
+                                   encoding)
+    request.content.seek(0)
+    request.content = _GzipBody(request.content)
+    # the body the handlers see, and pass on, is not encoded anymore
+    request.requestHeaders.removeHeader('content-encoding')
+    request.requestHeaders.removeHeader('content-length')
@@ -0,0 +1,162 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Descriptor-driven REST gateway. Instead of compiling the retrieved schema
+into *_pb2.py, *_pb2_grpc.py and *_gw.py modules, the compiled
+FileDescriptors shipped with the schema are loaded into a DescriptorPool,
+and the message classes, service stubs and routes are built in memory.
+"""
+
+from zlib import decompress
+
+from google.protobuf import descriptor_pool
+from google.protobuf.descriptor_pb2 import FileDescriptorProto, \
+    FileDescriptorSet
+from google.protobuf.message_factory import MessageFactory
+from structlog import get_logger
+
+from chameleon.protoc_plugins.gw_gen import generate_encoders, \
+    traverse_grpc_web_methods, traverse_methods
+from chameleon.protoc_plugins.swagger_gen import generate_swagger
+from chameleon.web_server import gateway
+from chameleon.web_server.gateway import add_route
+from chameleon.web_server.grpc_web import GrpcWebRoute
+from chameleon.web_server.transcoding import load_encoders
+
+log = get_logger()
+
+
+class DynamicGateway(object):
+    """
+    Offers the same add_routes(app, grpc_client) entry point as the
+    generated *_gw.py modules.
+    """
+
+    # (client_streaming, server_streaming) -> grpc.Channel factory method
+    MULTI_CALLABLES = {
+        (False, False): 'unary_unary',
+        (False, True): 'unary_stream',
+        (True, False): 'stream_unary',
+        (True, True): 'stream_stream',
+    }
+
+    def __init__(self, schemas):
+        self.pool = descriptor_pool.DescriptorPool()
+        self.factory = MessageFactory(self.pool)
+        self.proto_files = []  # dependency first
+        self._added = set()
+
+        by_name = {}
+        for proto_file in schemas.protos:
+            descriptor_set = FileDescriptorSet()
+            descriptor_set.ParseFromString(decompress(proto_file.descriptor))
+            for file_descriptor in descriptor_set.file:
+                by_name.setdefault(file_descriptor.name, file_descriptor)
+        for file_descriptor in by_name.itervalues():
+            self._add_file(file_descriptor, by_name)
+
+        self.methods = []
+        self.grpc_web_methods = []
+        self.stubs = {}  # full service name -> stub class
+        for proto_file in self.proto_files:
+            for service in proto_file.service:
+                full_name = self._full_name(proto_file.package, service.name)
+                self.stubs[full_name] = self._make_stub_class(full_name,
+                                                              service)
+            self.methods.extend(traverse_methods(proto_file))
+            self.grpc_web_methods.extend(traverse_grpc_web_methods(proto_file))
+        self.encoders = load_encoders(generate_encoders(
+            self.proto_files, set(m['output_type'] for m in self.methods)))
+
+        self.swagger_json = None
+        if schemas.swagger_from:
+            try:
+                self.swagger_json = generate_swagger(self.proto_files,
+                                                     schemas.swagger_from)
+            except Exception:
+                # the docs are not worth failing the routes over, e.g. for
+                # descriptors shipped without their source_code_info
+                log.exception('swagger-generation-failed',
+                              swagger_from=schemas.swagger_from)
+
+    @staticmethod
+    def _full_name(package, name):
+        return package + '.' + name if package else name
+
+    def _add_file(self, file_descriptor, by_name):
+        """
+        Add file_descriptor to the pool, after its dependencies. Those not
+        shipped with the schema (such as the well-known types) are taken
+        from the default pool.
+        """
+        if file_descriptor.name in self._added:
+            return
+        self._added.add(file_descriptor.name)
+        for dependency in file_descriptor.dependency:
+            if dependency not in by_name:
+                by_name[dependency] = FileDescriptorProto()
+                descriptor_pool.Default().FindFileByName(
+                    dependency).CopyToProto(by_name[dependency])
+            self._add_file(by_name[dependency], by_name)
+        self.pool.Add(file_descriptor)
+        self.proto_files.append(file_descriptor)
+
+    def message_class(self, full_name):
+        return self.factory.GetPrototype(
+            self.pool.FindMessageTypeByName(full_name))
+
+    def _make_stub_class(self, full_name, service):
+        """
+        Build the equivalent of a generated *_pb2_grpc.<Service>Stub class
+        """
+        methods = []
+        for method in service.method:
+            methods.append((
+                method.name,
+                '/%s/%s' % (full_name, method.name),
+                self.MULTI_CALLABLES[(method.client_streaming,
+                                      method.server_streaming)],
+                self.message_class(method.input_type.lstrip('.')),
+                self.message_class(method.output_type.lstrip('.'))))
+
+        def __init__(stub, channel):
+            for name, path, kind, input_class, output_class in methods:
+                setattr(stub, name, getattr(channel, kind)(
+                    path,
+                    request_serializer=input_class.SerializeToString,
+                    response_deserializer=output_class.FromString))
+
+        return type(str(service.name + 'Stub'), (object,),
+                    {'__init__': __init__})
+
+    def add_routes(self, app, grpc_client):
+        for method in self.methods:
+            if method['route_class'] is None:
+                continue
+            add_route(app, getattr(gateway, method['route_class'])(
+                grpc_client,
+                method['service'].rpartition('.')[2] + '_' + method['method'],
+                method['verb'], method['path'], method['body'],
+                self.stubs[method['service']], method['method'],
+                self.message_class(method['input_type']),
+                encoders=self.encoders, service=method['service'],
+                output_class=self.message_class(method['output_type'])))
+        for method in self.grpc_web_methods:
+            add_route(app, GrpcWebRoute(
+                grpc_client, method['service'], method['method'],
+                client_streaming=method['client_streaming'],
+                server_streaming=method['server_streaming']))
@@ -0,0 +1,57 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Entity tags, and the If-None-Match conditional requests made with them
+"""
+
+from hashlib import sha1
+
+
+def make_etag(data, suffix='', salt=''):
+    """
+    :return: the strong entity tag of a representation whose content is
+    data
+    :param suffix: distinguishes representations of the same content, such
+    as its gzip-encoded one
+    :param salt: what else the representation depends on, such as the
+    schema it is encoded with
+    """
+    digest = sha1(salt)
+    digest.update(data)
+    return '"%s%s"' % (digest.hexdigest(), suffix)
+
+
+def not_modified(request, etag):
+    """
+    :return: True if the If-None-Match header of request lists etag, i.e.
+    if the client has the representation of etag already. As RFC 7232
+    mandates for If-None-Match, the weak comparison is used.
+    """
+    header = request.getHeader('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
@@ -0,0 +1,707 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Runtime side of the REST gateway. Both the generated *_gw.py modules and
+the descriptor-driven dynamic gateway map each HTTP-annotated RPC onto a
+GatewayRoute, so the request handling logic lives in one place.
+
+Unary routes speak JSON by default. Clients having the message classes may
+send the serialized input message (Content-Type: application/x-protobuf)
+and/or ask for the serialized output message (Accept:
+application/x-protobuf), in which case the method is called through the raw
+call path of the GrpcClient and its response bytes passed on as received.
+"""
+
+import re
+from threading import Event
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.json_format import MessageToDict, _IsMapEntry
+from google.protobuf.message import DecodeError as WireDecodeError
+from grpc import FutureCancelledError
+from grpc._channel import _Rendezvous
+from simplejson import dumps, load, loads
+from structlog import get_logger
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred, fail, \
+    inlineCallbacks, maybeDeferred, returnValue, succeed
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import BadRequest
+from werkzeug.http import parse_accept_header
+
+from chameleon.web_server.compression import ResponseCompression
+from chameleon.web_server.etags import make_etag, not_modified
+from chameleon.web_server.json_stream import JsonBody, JsonEncoder
+from chameleon.web_server.response_cache import ResponseCache
+from chameleon.web_server.shared_cache import SharedResponseCache
+from chameleon.web_server.single_flight import SingleFlight
+from chameleon.web_server.transcoding import DecodeError, MessageDecoder
+
+log = get_logger()
+
+JSON = 'application/json'
+PROTOBUF = 'application/x-protobuf'
+
+
+def add_route(routes, route):
+    """
+    Register route with the gateway's RouteTrie, configured after the
+    trie's GatewaySettings
+    """
+    if routes.settings is not None:
+        route.configure(routes.settings)
+    routes.add(route.verb, route.path, route.handle,
+               route.path_converters())
+
+
+class GatewaySettings(object):
+    """
+    Gateway behaviour configurable per route. Routes are named after their
+    gRPC method, as <Service>_<Method>.
+    """
+
+    def __init__(self, single_flight='',
+                 coalesce_headers=('authorization', 'cookie'),
+                 response_cache='', response_cache_size=16 * 1024 * 1024,
+                 response_cache_file=None, transcode_offload=16 * 1024,
+                 transcode_threads=4, stream_threshold=1024 * 1024,
+                 compress_threshold=1024, compress_level=6):
+        """
+        :param single_flight: comma separated names of the GET routes to
+        coalesce concurrent identical requests of, '*' for all of them
+        :param coalesce_headers: request headers the response may depend
+        on; only requests agreeing on them are coalesced or share a cached
+        response, and only they are passed on to the backend for those
+        :param response_cache: comma separated <name>=<seconds> time to
+        live of the cached responses of GET routes, '*' naming all others
+        :param response_cache_size: bytes the cached responses may take
+        :param response_cache_file: if set, the responses are cached in this
+        memory-mapped file, shared by the Chameleon processes of the host
+        :param transcode_offload: serialized size in bytes above which
+        responses are transcoded to JSON on a thread pool rather than on the
+        reactor, 0 to always transcode on the reactor
+        :param transcode_threads: maximum size of that thread pool
+        :param stream_threshold: serialized size in bytes above which the
+        responses of uncached routes are encoded and written out in chunks,
+        0 to never stream them
+        :param compress_threshold: size in bytes above which responses are
+        compressed, for clients accepting it, 0 to never compress them
+        :param compress_level: compression level, 1 (fastest) to 9
+        """
+        self.single_flight_routes = set(
+            name.strip() for name in single_flight.split(',') if name.strip())
+        self.coalesce_headers = coalesce_headers
+        self.single_flight = SingleFlight()
+        self.cache_ttls = {}
+        for item in response_cache.split(','):
+            if item.strip():
+                name, _, ttl = item.partition('=')
+                self.cache_ttls[name.strip()] = float(ttl)
+        if response_cache_file:
+            self.response_cache = SharedResponseCache(
+                response_cache_file, response_cache_size)
+        else:
+            self.response_cache = ResponseCache(response_cache_size)
+        self.transcode_offload = transcode_offload
+        self.transcode_pool = None
+        if transcode_offload > 0:
+            # threads are created on demand, once started
+            self.transcode_pool = ThreadPool(0, transcode_threads,
+                                             name='transcode')
+        self.stream_threshold = stream_threshold
+        self.compression = None
+        if compress_threshold > 0:
+            self.compression = ResponseCompression(compress_threshold,
+                                                   compress_level)
+
+    def start(self):
+        if self.transcode_pool is not None:
+            self.transcode_pool.start()
+
+    def stop(self):
+        if self.transcode_pool is not None and self.transcode_pool.started:
+            self.transcode_pool.stop()
+
+    def single_flight_for(self, route):
+        """
+        :return: the SingleFlight to coalesce the requests of route with, or
+        None
+        """
+        if route.verb == 'get' and (
+                '*' in self.single_flight_routes or
+                route.name in self.single_flight_routes):
+            return self.single_flight
+        return None
+
+    def cache_ttl_for(self, route):
+        """
+        :return: seconds to cache the responses of route for, or None
+        """
+        if route.verb == 'get':
+            return self.cache_ttls.get(route.name, self.cache_ttls.get('*'))
+        return None
+
+
+def _parse_bool(value):
+    if value not in ('true', 'false'):
+        raise ValueError(value)
+    return value == 'true'
+
+
+# protobuf cpp_type -> path parameter converter; other types are passed on
+# as strings, to be converted by the route's MessageDecoder
+PATH_CONVERTERS = {
+    FieldDescriptor.CPPTYPE_INT32: int,
+    FieldDescriptor.CPPTYPE_INT64: int,
+    FieldDescriptor.CPPTYPE_UINT32: int,
+    FieldDescriptor.CPPTYPE_UINT64: int,
+    FieldDescriptor.CPPTYPE_DOUBLE: float,
+    FieldDescriptor.CPPTYPE_FLOAT: float,
+    FieldDescriptor.CPPTYPE_BOOL: _parse_bool,
+}
+
+
+def _content_type(request):
+    content_type = request.getHeader('content-type')
+    return content_type and content_type.partition(';')[0].strip().lower()
+
+
+def _accepts_protobuf(request):
+    """
+    :return: True if the client prefers serialized protobuf responses over
+    JSON ones
+    """
+    accept = request.getHeader('accept')
+    if not accept or PROTOBUF not in accept:
+        return False
+    return parse_accept_header(accept, MIMEAccept).best_match(
+        (JSON, PROTOBUF)) == PROTOBUF
+
+
+def _has_map_fields(descriptor, seen=None):
+    """
+    :return: True if messages of type descriptor may hold map fields, at
+    any depth
+    """
+    seen = set() if seen is None else seen
+    seen.add(descriptor.full_name)
+    for field in descriptor.fields:
+        if field.message_type is None:
+            continue
+        if _IsMapEntry(field):
+            return True
+        if field.message_type.full_name not in seen and \
+                _has_map_fields(field.message_type, seen):
+            return True
+    return False
+
+
+class LazyBody(object):
+    """
+    The body of a response message, encoded on first use, once for all the
+    requests sharing the response. Requests answered with 304 Not Modified
+    never need it.
+    """
+
+    def __init__(self, encode, res):
+        """
+        :param encode: encode(res) -> body, or Deferred fired with it
+        :param res: response message
+        """
+        self.encode = encode
+        self.res = res
+        self.result = None  # body or Failure, once encoded
+        self.waiters = None  # Deferreds waiting for the encoding
+
+    def get(self):
+        """
+        :return: Deferred fired with the body
+        """
+        if self.result is not None:
+            if isinstance(self.result, Failure):
+                return fail(self.result)
+            return succeed(self.result)
+        d = Deferred()
+        if self.waiters is None:
+            self.waiters = [d]
+            maybeDeferred(self.encode, self.res).addBoth(self._encoded)
+        else:
+            self.waiters.append(d)
+        return d
+
+    def _encoded(self, result):
+        self.result = result
+        self.res = None
+        waiters, self.waiters = self.waiters, None
+        for d in waiters:
+            if d.called:
+                continue  # cancelled
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+class GatewayRoute(object):
+    """
+    A REST route mapped onto a unary gRPC method
+    """
+
+    def __init__(self, grpc_client, name, verb, path, body, stub, method,
+                 input_class, encoders=None, service=None,
+                 output_class=None):
+        """
+        :param encoders: message full name -> JSON encoder generated for the
+        message type by gw_gen, for the output messages of the method
+        :param service: full name of the service of the method, to call it
+        through the raw call path; without it, serialized responses are
+        re-serialized from the response messages
+        :param output_class: output message class of the method; with it
+        and service, responses are received serialized, and only parsed if
+        their JSON body is needed
+        """
+        self.grpc_client = grpc_client
+        self.name = name
+        self.verb = verb
+        self.path = path
+        self.body = body
+        self.stub = stub
+        self.method = method
+        self.input_class = input_class
+        self.output_class = output_class
+        self.method_path = '/%s/%s' % (service, method) if service else None
+        self.decoder = MessageDecoder(input_class.DESCRIPTOR)
+        self.has_maps = output_class is not None and \
+            _has_map_fields(output_class.DESCRIPTOR)
+        self.encoders = encoders or {}
+        self.json_encoder = JsonEncoder(self.encoders)
+        self.single_flight = None
+        self.coalesce_headers = ()
+        self.cache = None
+        self.cache_ttl = None
+        self.transcode_offload = 0
+        self.transcode_pool = None
+        self.stream_threshold = 0
+
+    def configure(self, settings):
+        self.single_flight = settings.single_flight_for(self)
+        self.coalesce_headers = settings.coalesce_headers
+        self.cache = settings.response_cache
+        self.cache_ttl = settings.cache_ttl_for(self)
+        self.transcode_offload = settings.transcode_offload
+        self.transcode_pool = settings.transcode_pool
+        self.stream_threshold = settings.stream_threshold
+
+    def path_converters(self):
+        """
+        Converters for the path parameters, typed after the input message
+        fields they map onto
+        """
+        converters = {}
+        fields = self.input_class.DESCRIPTOR.fields_by_name
+        for name in re.findall(r'{([^}=]+)', self.path):
+            if name in fields and fields[name].label != \
+                    FieldDescriptor.LABEL_REPEATED:
+                converter = PATH_CONVERTERS.get(fields[name].cpp_type)
+                if converter is not None:
+                    converters[name] = converter
+        return converters
+
+    def parse_request(self, request, kw):
+        """
+        :return: the input message, built from the request body and/or the
+        path parameters kw
+        """
+        req = self.input_class()
+        if self.body == '*':
+            if _content_type(request) == PROTOBUF:
+                try:
+                    req.MergeFromString(request.content.read())
+                except WireDecodeError as e:
+                    raise BadRequest('invalid protobuf body: %s' % e)
+                data = {}
+            else:
+                try:
+                    data = load(request.content)
+                except ValueError as e:
+                    raise BadRequest('invalid JSON body: %s' % e)
+        elif self.body == '':
+            data = {}
+        else:
+            raise NotImplementedError('cannot handle specific body field list')
+        self._decode(data, req)
+        self._decode(kw, req)  # path parameters take precedence
+        return req
+
+    def parse_raw_request(self, request, kw):
+        """
+        :return: the serialized input message. A serialized request body is
+        passed on unparsed, followed by the serialization of a message of
+        the path parameters: the backend merges both, the values of the
+        path parameters taking precedence, as they do over JSON bodies.
+        """
+        if self.body == '*' and _content_type(request) == PROTOBUF:
+            data = request.content.read()
+            if kw:
+                req = self.input_class()
+                self._decode(kw, req)
+                data += req.SerializeToString()
+            return data
+        return self.parse_request(request, kw).SerializeToString(
+            deterministic=True)
+
+    def _decode(self, data, req):
+        try:
+            self.decoder.decode(data, req)
+        except DecodeError as e:
+            log.info('cannot-convert-to-protobuf', name=self.name, e=e)
+            raise BadRequest(str(e))
+
+    def to_dict(self, res):
+        encode = self.encoders.get(res.DESCRIPTOR.full_name)
+        if encode is not None:
+            return encode(res)
+        try:
+            return MessageToDict(res, True, True)
+        except AttributeError as e:
+            filename = '/tmp/chameleon_failed_to_convert_data.pbd'
+            with open(filename, 'w') as f:
+                f.write(res.SerializeToString())
+            log.error('cannot-convert-from-protobuf', outdata_saved=filename)
+            raise
+
+    def transcode(self, res):
+        """
+        :return: the JSON body for response message res, or for its
+        serialization
+        """
+        if isinstance(res, str):
+            res = self.output_class.FromString(res)
+        out_data = self.to_dict(res)
+        log.debug(self.name, **out_data)
+        return dumps(out_data)
+
+    def metadata(self, request, shared=False):
+        """
+        :return: the request headers to pass on to the backend, as call
+        metadata
+        :param shared: if set, the response is shared by all the requests
+        agreeing on coalesce_headers, and only those are passed on
+        """
+        headers = request.getAllHeaders()
+        if shared:
+            return [(h, headers[h]) for h in self.coalesce_headers
+                    if h in headers]
+        return headers.items()
+
+    def call(self, request, req, shared=False):
+        """
+        :return: Deferred fired with (response, trailing metadata), the
+        response being the serialized output message if the route can parse
+        it, the output message otherwise
+        """
+        metadata = self.metadata(request, shared)
+        if self.method_path is not None and self.output_class is not None:
+            return self.grpc_client.invoke(
+                None, self.method_path, req.SerializeToString(), metadata)
+        return self.grpc_client.invoke(self.stub, self.method, req, metadata)
+
+    @inlineCallbacks
+    def fetch(self, request, req, shared=False):
+        """
+        :return: Deferred fired with the headers and the LazyBody of the
+        response. The headers of GET responses include an ETag, derived
+        from the serialized response rather than from its JSON encoding.
+        """
+        res, metadata = yield self.call(request, req, shared)
+        headers = list(metadata) + [('Content-Type', JSON)]
+        if self.verb == 'get':
+            headers.append(('ETag', self.etag(res)))
+        returnValue((headers, LazyBody(self.encode, res)))
+
+    def etag(self, res, suffix=''):
+        """
+        :return: weak ETag of response message res (or of its
+        serialization), the same for equal messages however they were
+        serialized, and changing with the schema, which the JSON encoding
+        depends on
+        """
+        if isinstance(res, str) and self.has_maps:
+            # map entries are serialized in no particular order
+            res = self.output_class.FromString(res)
+        if not isinstance(res, str):
+            res = res.SerializeToString(deterministic=True)
+        return 'W/' + make_etag(res, suffix,
+                                self.grpc_client.schema_key or '')
+
+    def encode(self, res):
+        """
+        :return: the JSON body of response message res (or of its
+        serialization), or a Deferred fired with it, being either a string
+        or, for large responses of uncached routes, a JsonBody
+        """
+        size = len(res) if isinstance(res, str) else res.ByteSize()
+        if self.stream_threshold and self.cache_ttl is None and \
+                size > self.stream_threshold:
+            # never held as a whole in memory, but as a message
+            if isinstance(res, str):
+                res = self.output_class.FromString(res)
+            return JsonBody(res, self.json_encoder, self.transcode_pool)
+        if self.transcode_pool is not None and \
+                size > self.transcode_offload:
+            # large responses would stall the reactor for as long as they
+            # take to transcode
+            return deferToThreadPool(
+                reactor, self.transcode_pool, self.transcode, res)
+        return self.transcode(res)
+
+    @inlineCallbacks
+    def fetch_raw(self, request, data, shared=False):
+        """
+        :return: Deferred fired with the headers and body of the response,
+        the serialized output message, for serialized input message data
+        """
+        metadata = self.metadata(request, shared)
+        if self.method_path is None:
+            res, metadata = yield self.grpc_client.invoke(
+                self.stub, self.method, self.input_class.FromString(data),
+                metadata)
+            body = res.SerializeToString()
+        else:
+            body, metadata = yield self.grpc_client.invoke(
+                None, self.method_path, data, metadata)
+            res = body
+        headers = list(metadata) + [('Content-Type', PROTOBUF)]
+        if self.verb == 'get':
+            headers.append(('ETag', self.etag(res, '-pb')))
+        returnValue((headers, body))
+
+    @inlineCallbacks
+    def handle(self, request, **kw):
+        log.debug(self.name, request=request, **kw)
+        protobuf = _accepts_protobuf(request)
+        if protobuf:
+            req = self.parse_raw_request(request, kw)
+        else:
+            req = self.parse_request(request, kw)
+        if self.verb == 'get':
+            headers, body = yield self.read(request, req, protobuf)
+        else:
+            fetch = self.fetch_raw if protobuf else self.fetch
+            try:
+                headers, body = yield fetch(request, req)
+            finally:
+                if self.cache is not None:
+                    self.cache.invalidate(request.path)
+        for key, value in headers:
+            request.setHeader(key, value)
+        etag = request.responseHeaders.getRawHeaders('etag')
+        if etag and not_modified(request, etag[0]):
+            request.setResponseCode(304)
+            returnValue('')  # without encoding the body
+        if isinstance(body, LazyBody):
+            body = yield body.get()
+        if isinstance(body, JsonBody):
+            yield body.write_to(request)
+            returnValue('')
+        returnValue(body)
+
+    @inlineCallbacks
+    def read(self, request, req, protobuf=False):
+        """
+        fetch for GET routes, through the response cache and coalescing
+        identical concurrent requests, as configured for the route
+        :param protobuf: if set, req is the serialized input message, and
+        the response the serialized output message
+        """
+        fetch = self.fetch_raw if protobuf else self.fetch
+        if self.single_flight is None and self.cache_ttl is None:
+            result = yield fetch(request, req)
+            returnValue(result)
+
+        if protobuf:
+            key = (self.name, PROTOBUF, req)
+        else:
+            key = (self.name, JSON, req.SerializeToString(deterministic=True))
+        key += tuple(request.getHeader(h) for h in self.coalesce_headers)
+        if self.cache_ttl is not None:
+            result = self.cache.get(key)
+            if result is not None:
+                returnValue(result)
+            generation = self.cache.generation
+
+        # the response is shared by the requests with the same key: only
+        # the headers in it may reach the backend
+        if self.single_flight is None:
+            headers, body = yield fetch(request, req, True)
+        else:
+            # identical concurrent reads share one call and one body
+            headers, body = yield self.single_flight.call(
+                key, fetch, request, req, True)
+
+        if self.cache_ttl is not None:
+            if isinstance(body, LazyBody):
+                body = yield body.get()
+            self.cache.put(key, headers, body, self.cache_ttl, request.path,
+                           generation)
+        returnValue((headers, body))
+
+
+class NdjsonRequests(object):
+    """
+    Iterator over the input messages of a client-streaming call, read from
+    an NDJSON request body. Lines are parsed one at a time, as the call
+    consumes them (on a gRPC thread), so the body is never held in memory
+    as a whole.
+    """
+
+    def __init__(self, content, input_class, decoder, kw):
+        """
+        :param content: file-like request body
+        :param input_class: input message class of the call
+        :param decoder: MessageDecoder of input_class
+        :param kw: path parameters, applied to each message
+        """
+        self.content = content
+        self.input_class = input_class
+        self.decoder = decoder
+        self.kw = kw
+        self.line_no = 0
+        self.error = None  # BadRequest for the line that failed to parse
+        self.call = None  # the gRPC call consuming the messages
+        self.bound = Event()
+
+    def bind(self, call):
+        """
+        :param call: the gRPC call consuming the messages, cancelled on a
+        line failing to parse
+        """
+        self.call = call
+        self.bound.set()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = ''
+        while not line.strip():
+            line = self.content.readline()
+            if not line:
+                raise StopIteration
+            self.line_no += 1
+        try:
+            req = self.input_class()
+            self.decoder.decode(loads(line), req)
+            self.decoder.decode(self.kw, req)
+            return req
+        except Exception as e:
+            log.debug('cannot-convert-to-protobuf', e=e, line_no=self.line_no)
+            self.error = BadRequest('line %d: %s' % (self.line_no, e))
+        # cancel the call rather than raise, which would have gRPC abort it
+        # as UNKNOWN; the call is cancelled before the iteration ends, so
+        # that the messages read so far are not taken for the whole stream
+        self.bound.wait()  # the first lines are read before invoke returns
+        self.call.cancel()
+        raise StopIteration
+
+
+class ClientStreamingRoute(GatewayRoute):
+    """
+    A REST route mapped onto a client-streaming gRPC method. The request
+    body holds one input message per line (NDJSON), all sent in one call.
+    """
+
+    def parse_request(self, request, kw):
+        if self.body != '*':
+            raise NotImplementedError('client-streaming routes take the '
+                                      'messages from the whole body')
+        return NdjsonRequests(request.content, self.input_class,
+                              self.decoder, kw)
+
+    parse_raw_request = parse_request
+
+    @inlineCallbacks
+    def fetch_raw(self, request, requests, shared=False):
+        # the input messages being JSON, the call is not a raw one
+        res, metadata = yield self.call(request, requests, shared)
+        returnValue((list(metadata) + [('Content-Type', PROTOBUF)],
+                     res.SerializeToString()))
+
+    @inlineCallbacks
+    def call(self, request, requests, shared=False):
+        try:
+            result = yield self.grpc_client.invoke(
+                self.stub, self.method, requests,
+                self.metadata(request, shared), retry=0,
+                on_call=requests.bind)
+        except (_Rendezvous, FutureCancelledError):
+            if requests.error is not None:
+                raise requests.error  # the call was cancelled on a bad line
+            raise
+        log.debug('stream-sent', name=self.name, lines=requests.line_no)
+        returnValue(result)
+
+
+class ServerStreamingRoute(GatewayRoute):
+    """
+    A REST route mapped onto a server-streaming gRPC method. The responses
+    are written out as they arrive, one JSON document per line (NDJSON), in
+    a chunked HTTP response. The call is read no faster than the client
+    takes the response in.
+    """
+
+    CONTENT_TYPE = 'application/x-ndjson'
+
+    @inlineCallbacks
+    def handle(self, request, **kw):
+        log.debug(self.name, request=request, **kw)
+        req = self.parse_request(request, kw)
+        stream = self.grpc_client.invoke_stream(
+            self.stub, self.method, req, request.getAllHeaders().items(),
+            lambda res: self._write_line(request, res))
+        request.registerProducer(stream, True)
+        try:
+            count = yield stream.start()
+        except CancelledError:
+            raise  # client went away
+        except Exception as e:
+            if stream.count == 0:
+                raise  # nothing sent yet, fail as a unary call would
+            # too late for an error status, end the stream with the error
+            if isinstance(e, _Rendezvous):
+                error = {'code': e.code().name, 'message': e.details()}
+            else:
+                error = {'message': str(e)}
+            log.info('stream-failed', name=self.name, count=stream.count,
+                     **error)
+            request.write(dumps({'error': error}) + '\n')
+        else:
+            log.debug('stream-ended', name=self.name, count=count)
+        finally:
+            if request.channel is not None:  # else the client went away
+                request.unregisterProducer()
+        if stream.count == 0:
+            request.setHeader('Content-Type', self.CONTENT_TYPE)
+        returnValue('')
+
+    def _write_line(self, request, res):
+        if not request.startedWriting:
+            request.setHeader('Content-Type', self.CONTENT_TYPE)
+        request.write(dumps(self.to_dict(res)) + '\n')
@@ -0,0 +1,198 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+gRPC-Web endpoint, next to the REST gateway. Every method of the schema is
+served at /<package>.<Service>/<Method>, for POSTs of binary gRPC-Web
+(application/grpc-web+proto) requests. The request message is passed on to
+the backend as received, through the raw call path of the GrpcClient, and
+the response messages written back as received, framed as gRPC-Web data
+frames and followed by a trailer frame carrying the call status.
+
+As browsers cannot stream requests, client-streaming and bidirectional
+methods are answered with UNIMPLEMENTED.
+"""
+
+import struct
+from base64 import b64encode
+
+from grpc import StatusCode
+from grpc._channel import _Rendezvous
+from structlog import get_logger
+from twisted.internet.defer import inlineCallbacks, returnValue
+from werkzeug.exceptions import ServiceUnavailable, UnsupportedMediaType
+
+log = get_logger()
+
+GRPC_WEB_PROTO = 'application/grpc-web+proto'
+CONTENT_TYPES = ('application/grpc-web', GRPC_WEB_PROTO)
+
+_FRAME = struct.Struct('>BI')  # flags, length
+
+# frame flags
+DATA = 0x00
+COMPRESSED = 0x01
+TRAILER = 0x80
+
+
+def frame(flags, payload):
+    return _FRAME.pack(flags, len(payload)) + payload
+
+
+def read_messages(body):
+    """
+    :return: the messages of the data frames of a request body
+    :raises ValueError: if the body is not a sequence of uncompressed data
+    frames
+    """
+    messages = []
+    offset = 0
+    while offset < len(body):
+        if len(body) - offset < _FRAME.size:
+            raise ValueError('truncated frame header')
+        flags, length = _FRAME.unpack_from(body, offset)
+        offset += _FRAME.size
+        if flags != DATA:
+            raise ValueError('unsupported frame flags 0x%02x' % flags)
+        if len(body) - offset < length:
+            raise ValueError('truncated frame')
+        messages.append(body[offset:offset + length])
+        offset += length
+    return messages
+
+
+def _percent_encode(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return ''.join(c if ' ' <= c <= '~' and c != '%' else '%%%02X' % ord(c)
+                   for c in text)
+
+
+def trailers(code, details=None, metadata=()):
+    """
+    :return: the trailer frame of a call ended with status code
+    :param details: status message
+    :param metadata: trailing metadata of the call
+    """
+    lines = ['grpc-status:%d' % code.value[0]]
+    if details:
+        lines.append('grpc-message:' + _percent_encode(details))
+    for key, value in metadata:
+        if key.endswith('-bin'):
+            value = b64encode(value)
+        lines.append('%s:%s' % (key.lower(), value))
+    return frame(TRAILER, ''.join(line + '\r\n' for line in lines))
+
+
+class _Status(Exception):
+
+    def __init__(self, code, details):
+        Exception.__init__(self, details)
+        self.code = code
+        self.details = details
+
+
+class GrpcWebRoute(object):
+    """
+    A gRPC-Web route, mapped onto the gRPC method of the same path
+    """
+
+    verb = 'post'
+
+    def __init__(self, grpc_client, service, method, client_streaming=False,
+                 server_streaming=False):
+        """
+        :param service: full name of the service of the method
+        """
+        self.grpc_client = grpc_client
+        self.name = service.rpartition('.')[2] + '_' + method
+        self.path = '/%s/%s' % (service, method)
+        self.client_streaming = client_streaming
+        self.server_streaming = server_streaming
+
+    def configure(self, settings):
+        pass  # the gateway settings are about the REST routes
+
+    def path_converters(self):
+        return {}
+
+    @staticmethod
+    def metadata(request):
+        # gRPC reserves the grpc-* keys to itself
+        return [(key, value) for key, value in request.getAllHeaders().items()
+                if not key.startswith('grpc-')]
+
+    @inlineCallbacks
+    def handle(self, request):
+        content_type = request.getHeader('content-type') or ''
+        if content_type.partition(';')[0].strip().lower() not in \
+                CONTENT_TYPES:
+            raise UnsupportedMediaType('expected %s' % GRPC_WEB_PROTO)
+        request.setHeader('Content-Type', GRPC_WEB_PROTO)
+
+        try:
+            if self.client_streaming:
+                raise _Status(StatusCode.UNIMPLEMENTED,
+                              'streaming requests are not supported')
+            try:
+                messages = read_messages(request.content.read())
+            except ValueError as e:
+                raise _Status(StatusCode.INTERNAL, str(e))
+            if len(messages) != 1:
+                raise _Status(StatusCode.INTERNAL,
+                              'expected one request message, got %d' %
+                              len(messages))
+
+            if self.server_streaming:
+                metadata = yield self._stream(request, messages[0])
+                request.write(trailers(StatusCode.OK, None, metadata))
+            else:
+                response, metadata = yield self.grpc_client.invoke(
+                    None, self.path, messages[0], self.metadata(request))
+                request.write(frame(DATA, response) +
+                              trailers(StatusCode.OK, None, metadata))
+
+        except _Rendezvous as e:
+            log.debug('grpc-web-call-failed', name=self.name,
+                      code=e.code().name)
+            request.write(trailers(e.code(), e.details(),
+                                   e.trailing_metadata() or ()))
+        except ServiceUnavailable as e:
+            request.write(trailers(StatusCode.UNAVAILABLE, e.description))
+        except _Status as e:
+            log.info('grpc-web-call-rejected', name=self.name,
+                     code=e.code.name, details=e.details)
+            request.write(trailers(e.code, e.details))
+        returnValue('')
+
+    @inlineCallbacks
+    def _stream(self, request, message):
+        """
+        Write out the responses of a server-streaming call as they arrive,
+        no faster than the client takes them in
+        :return: Deferred fired with the trailing metadata of the call
+        """
+        stream = self.grpc_client.invoke_stream(
+            None, self.path, message, self.metadata(request),
+            lambda response: request.write(frame(DATA, response)))
+        request.registerProducer(stream, True)
+        try:
+            count = yield stream.start()
+        finally:
+            if request.channel is not None:  # else the client went away
+                request.unregisterProducer()
+        log.debug('grpc-web-stream-ended', name=self.name, count=count)
+        returnValue(stream.call.trailing_metadata() or ())
@@ -0,0 +1,236 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Incremental JSON encoding of large response messages. Instead of building
+the dict and then the string of the whole response, the message is walked
+and its JSON document written out to the request a chunk at a time, as the
+client takes it in. The document is the one of
+dumps(MessageToDict(message, True, True)), but for the order of the keys.
+"""
+
+from google.protobuf.descriptor import FieldDescriptor
+# the printer behind MessageToDict, used to convert the leaves of the walk
+# exactly as MessageToDict would; being private, protobuf is pinned in
+# requirements.txt to the versions tested with
+from google.protobuf.json_format import _IsMapEntry, _IsWrapperMessage, \
+    _Printer, _WKTJSONMETHODS
+from simplejson import dumps
+from structlog import get_logger
+from twisted.internet import reactor
+from twisted.internet.defer import CancelledError, Deferred, \
+    inlineCallbacks
+from twisted.internet.interfaces import IPushProducer
+from twisted.internet.threads import deferToThreadPool
+from zope.interface import implementer
+
+log = get_logger()
+
+
+class JsonEncoder(object):
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, encoders=None, chunk_size=CHUNK_SIZE):
+        """
+        :param encoders: message full name -> JSON encoder generated by
+        gw_gen, used for the message types it has
+        :param chunk_size: chunk size in bytes
+        """
+        self.encoders = encoders or {}
+        self.chunk_size = chunk_size
+        self.printer = _Printer(including_default_value_fields=True,
+                                preserving_proto_field_name=True)
+
+    def iterencode(self, message):
+        """
+        :return: iterator over the JSON document of message, in chunks of
+        about chunk_size bytes
+        """
+        chunk = []
+        size = 0
+        for piece in self._message(message):
+            chunk.append(piece)
+            size += len(piece)
+            if size >= self.chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk)
+
+    def _message(self, message):
+        descriptor = message.DESCRIPTOR
+        if message.ByteSize() < self.chunk_size or \
+                _IsWrapperMessage(descriptor) or \
+                descriptor.full_name in _WKTJSONMETHODS:
+            # small enough to be encoded at once
+            encode = self.encoders.get(descriptor.full_name)
+            if encode is None:
+                encode = self.printer._MessageToJsonObject
+            yield dumps(encode(message))
+            return
+
+        yield '{'
+        separator = ''
+        names = set()
+        for field, value in message.ListFields():
+            name = '[%s]' % field.full_name if field.is_extension \
+                else field.name
+            names.add(name)
+            yield separator + dumps(name) + ': '
+            separator = ', '
+            for piece in self._field(field, value):
+                yield piece
+
+        # default values, as MessageToDict includes them
+        for field in descriptor.fields:
+            if field.name in names or field.containing_oneof or (
+                    field.label != FieldDescriptor.LABEL_REPEATED and
+                    field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE):
+                continue
+            if _IsMapEntry(field):
+                value = '{}'
+            elif field.label == FieldDescriptor.LABEL_REPEATED:
+                value = '[]'
+            else:
+                value = dumps(self.printer._FieldToJsonObject(
+                    field, field.default_value))
+            yield separator + dumps(field.name) + ': ' + value
+            separator = ', '
+        yield '}'
+
+    def _field(self, field, value):
+        if _IsMapEntry(field):
+            value_field = field.message_type.fields_by_name['value']
+            yield '{'
+            separator = ''
+            for key in value:
+                if isinstance(key, bool):
+                    name = 'true' if key else 'false'
+                else:
+                    name = key if isinstance(key, basestring) else str(key)
+                yield separator + dumps(name) + ': '
+                separator = ', '
+                for piece in self._value(value_field, value[key]):
+                    yield piece
+            yield '}'
+        elif field.label == FieldDescriptor.LABEL_REPEATED:
+            if field.cpp_type != FieldDescriptor.CPPTYPE_MESSAGE:
+                yield dumps([self.printer._FieldToJsonObject(field, v)
+                             for v in value])
+                return
+            yield '['
+            separator = ''
+            for v in value:
+                yield separator
+                separator = ', '
+                for piece in self._message(v):
+                    yield piece
+            yield ']'
+        else:
+            for piece in self._value(field, value):
+                yield piece
+
+    def _value(self, field, value):
+        if field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+            for piece in self._message(value):
+                yield piece
+        else:
+            yield dumps(self.printer._FieldToJsonObject(field, value))
+
+
+class JsonBody(object):
+    """
+    Response body holding a message, to be written out as JSON by a
+    JsonEncoder. Can be written to several requests.
+    """
+
+    def __init__(self, message, encoder, pool=None):
+        """
+        :param message: response message
+        :param encoder: JsonEncoder
+        :param pool: if set, thread pool encoding the chunks
+        """
+        self.message = message
+        self.encoder = encoder
+        self.pool = pool
+
+    def write_to(self, request):
+        """
+        :return: Deferred fired once the whole body is written. Cancelling
+        it stops the writing.
+        """
+        return _BodyProducer(
+            self.encoder.iterencode(self.message), request, self.pool).run()
+
+
+@implementer(IPushProducer)
+class _BodyProducer(object):
+    """
+    Writes the chunks of a body to a request, no faster than its client
+    takes them in
+    """
+
+    def __init__(self, chunks, request, pool):
+        self.chunks = chunks
+        self.request = request
+        self.pool = pool
+        self.resumed = None  # Deferred fired by resumeProducing, if paused
+        self.stopped = False
+
+    @inlineCallbacks
+    def run(self):
+        self.request.registerProducer(self, True)
+        try:
+            while True:
+                if self.resumed is not None:
+                    yield self.resumed
+                if self.stopped:
+                    raise CancelledError()  # client went away
+                if self.pool is None:
+                    chunk = next(self.chunks, None)
+                else:
+                    chunk = yield deferToThreadPool(
+                        reactor, self.pool, next, self.chunks, None)
+                if chunk is None:
+                    break
+                self.request.write(chunk)
+        except Exception as e:
+            if not self.request.startedWriting or \
+                    isinstance(e, CancelledError):
+                raise
+            # too late for an error status, drop the connection so that the
+            # client does not take the truncated document for a whole one
+            log.error('cannot-encode-response', e=e)
+            self.request.loseConnection()
+            raise CancelledError()
+        finally:
+            if self.request.channel is not None:
+                self.request.unregisterProducer()
+
+    def pauseProducing(self):
+        if self.resumed is None:
+            self.resumed = Deferred()
+
+    def resumeProducing(self):
+        resumed, self.resumed = self.resumed, None
+        if resumed is not None:
+            resumed.callback(None)
+
+    def stopProducing(self):
+        self.stopped = True
+        self.resumeProducing()
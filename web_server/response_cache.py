@@ -0,0 +1,131 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+In-process cache of serialized gateway responses, bounded in size (least
+recently used entries are evicted first), with a time to live per entry.
+Entries are invalidated by writes to any path overlapping theirs, i.e. to
+the path itself, to a parent path or to a child path.
+"""
+
+from collections import OrderedDict
+from time import time
+
+from structlog import get_logger
+
+from chameleon.web_server.route_trie import split_path
+
+log = get_logger()
+
+
+class _Entry(object):
+
+    __slots__ = ('headers', 'body', 'expires', 'path', 'size')
+
+    OVERHEAD = 256  # rough per entry bookkeeping, in bytes
+
+    def __init__(self, headers, body, expires, path):
+        self.headers = headers
+        self.body = body
+        self.expires = expires
+        self.path = path
+        self.size = self.OVERHEAD + len(body) + sum(
+            len(k) + len(v) for k, v in headers)
+
+
+class ResponseCache(object):
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> _Entry, least recent first
+        self.paths = {}  # path segments tuple -> set of keys
+        self.size = 0
+        # bumped on each invalidation, so that responses fetched across one
+        # are not cached
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        :return: (headers, body) of the live entry for key, or None
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry.expires <= time():
+            self._unindex(key, entry)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key] = entry  # most recently used now
+        self.hits += 1
+        return entry.headers, entry.body
+
+    def put(self, key, headers, body, ttl, path, generation):
+        """
+        Cache a response for ttl seconds.
+        :param path: request path of the response, for invalidation
+        :param generation: value of self.generation when the response was
+        requested; the response is dropped if an invalidation happened since
+        """
+        if generation != self.generation:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self._unindex(key, old)
+
+        entry = _Entry(headers, body, time() + ttl,
+                       tuple(split_path(path)))
+        if entry.size > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.paths.setdefault(entry.path, set()).add(key)
+        self.size += entry.size
+
+        while self.size > self.max_bytes:
+            key, entry = self.entries.popitem(last=False)
+            self._unindex(key, entry)
+            self.evictions += 1
+
+    def invalidate(self, path):
+        """
+        Drop the entries of the paths overlapping path
+        """
+        self.generation += 1
+        segments = tuple(split_path(path))
+        for cached in self.paths.keys():
+            n = min(len(cached), len(segments))
+            if cached[:n] == segments[:n]:
+                for key in list(self.paths[cached]):
+                    self._unindex(key, self.entries.pop(key))
+                    self.invalidations += 1
+        log.debug('invalidated', path=path)
+
+    def _unindex(self, key, entry):
+        self.size -= entry.size
+        keys = self.paths[entry.path]
+        keys.discard(key)
+        if not keys:
+            del self.paths[entry.path]
+
+    def stats(self):
+        return dict(entries=len(self.entries), bytes=self.size,
+                    hits=self.hits, misses=self.misses,
+                    evictions=self.evictions,
+                    invalidations=self.invalidations)
@@ -0,0 +1,205 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Route dispatching for the REST gateway. All gateway routes are kept in a
+trie keyed on path segments, so that a lookup costs O(path depth) instead
+of trying every route's regular expression in turn, as werkzeug (and
+hence Klein) does. Requests not matching any gateway route are passed on
+to a fallback resource (the Klein app serving e.g. the swagger docs).
+"""
+
+from urllib import unquote
+
+from twisted.internet.defer import CancelledError, maybeDeferred
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+from werkzeug.exceptions import BadRequest, HTTPException, MethodNotAllowed
+
+from chameleon.web_server.compression import decode_request_body
+
+
+class _Node(object):
+
+    __slots__ = ('children', 'param_node', 'handlers')
+
+    def __init__(self):
+        self.children = {}  # literal segment -> _Node
+        self.param_node = None  # node of any segment, bound to a parameter
+        # verb -> (handler, names of the path parameters in order,
+        # converters)
+        self.handlers = {}
+
+
+def split_path(path):
+    return [unquote(s) for s in path.strip('/').split('/')]
+
+
+class RouteTrie(object):
+    """
+    Maps (verb, path) onto handlers registered against google.api.http
+    style path templates, such as /api/v1/devices/{id}
+    """
+
+    def __init__(self, version=0, settings=None):
+        """
+        :param version: version number of the route table
+        :param settings: GatewaySettings applied to the gateway routes
+        registered with the trie
+        """
+        self.root = _Node()
+        self.size = 0
+        self.version = version
+        self.settings = settings
+
+    def add(self, verb, path, handler, converters=None):
+        """
+        Register handler(request, **params) for verb and path template.
+        Path parameters are named per route, so that templates may name
+        the parameter at the same position differently, as in /x/{id} and
+        /x/{device_id}/ports.
+        :param converters: Optional dict of param name -> callable, used to
+        convert the path parameters from their string form. A ValueError
+        raised by a converter is reported as 400 Bad Request.
+        """
+        node = self.root
+        names = []
+        for segment in split_path(path):
+            if segment.startswith('{') and segment.endswith('}'):
+                names.append(segment[1:-1].partition('=')[0])
+                if node.param_node is None:
+                    node.param_node = _Node()
+                node = node.param_node
+            else:
+                node = node.children.setdefault(segment, _Node())
+        node.handlers[verb.upper()] = (handler, names, converters or {})
+        self.size += 1
+
+    def match(self, verb, path):
+        """
+        :return: (handler, params) or None if no route matches path. HEAD
+        requests are handled as GET ones, unless registered on their own.
+        :raises MethodNotAllowed: if the path matches, but not the verb
+        """
+        values = []
+        node = self._match(self.root, split_path(path), 0, values)
+        if node is None:
+            return None
+
+        verb = verb.upper()
+        if verb == 'HEAD' and verb not in node.handlers:
+            verb = 'GET'  # Twisted leaves the body out of HEAD responses
+        try:
+            handler, names, converters = node.handlers[verb]
+        except KeyError:
+            valid_methods = set(node.handlers)
+            if 'GET' in valid_methods:
+                valid_methods.add('HEAD')
+            raise MethodNotAllowed(valid_methods=sorted(valid_methods))
+
+        params = dict(zip(names, values))
+        for name, converter in converters.iteritems():
+            if name in params:
+                try:
+                    params[name] = converter(params[name])
+                except ValueError:
+                    raise BadRequest('invalid value for path parameter %s'
+                                     % name)
+        return handler, params
+
+    def _match(self, node, segments, i, values):
+        # literal segments take precedence over parameters; backtrack to
+        # the parameter branch if the literal one leads nowhere. values
+        # collects the segments bound to parameters, in order.
+        if i == len(segments):
+            return node if node.handlers else None
+        segment = segments[i]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._match(child, segments, i + 1, values)
+            if found is not None:
+                return found
+        if node.param_node is not None and segment:
+            values.append(segment)
+            found = self._match(node.param_node, segments, i + 1, values)
+            if found is not None:
+                return found
+            values.pop()
+        return None
+
+
+class DispatcherResource(Resource):
+    """
+    Twisted resource dispatching requests through a RouteTrie
+    """
+
+    isLeaf = True
+
+    def __init__(self, routes, fallback, error_handler):
+        """
+        :param routes: RouteTrie
+        :param fallback: Resource rendering requests matching no route
+        :param error_handler: error_handler(request, failure) returning the
+        response body of a failed request
+        """
+        Resource.__init__(self)
+        self.routes = routes
+        self.fallback = fallback
+        self.error_handler = error_handler
+
+    def render(self, request):
+        try:
+            decode_request_body(request)
+            match = self.routes.match(request.method, request.path)
+        except HTTPException as e:
+            return self._http_error(request, e)
+        if match is None:
+            return self.fallback.render(request)
+
+        handler, params = match
+        d = maybeDeferred(handler, request, **params)
+        request.notifyFinish().addErrback(lambda _: d.cancel())
+        d.addCallbacks(self._write, self._failed,
+                       callbackArgs=(request,), errbackArgs=(request,))
+        return NOT_DONE_YET
+
+    def _failed(self, failure, request):
+        if failure.check(CancelledError):
+            return  # client went away
+        if failure.check(HTTPException):
+            body = self._http_error(request, failure.value)
+        else:
+            body = self.error_handler(request, failure)
+        self._write(body, request)
+
+    @staticmethod
+    def _http_error(request, e):
+        request.setResponseCode(e.code)
+        for header, value in e.get_response({}).headers:
+            request.setHeader(header, value)
+        return e.get_body({}).encode('utf-8')
+
+    @staticmethod
+    def _write(body, request):
+        if request.finished:
+            return  # the handler took care of the response itself
+        if request.channel is None:
+            return  # client went away
+        if body:
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+            request.write(body)
+        request.finish()
@@ -0,0 +1,324 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Response cache shared by all the Chameleon processes of a host, kept in a
+memory-mapped file (e.g. under /dev/shm). Drop-in replacement for
+ResponseCache.
+
+The file holds a header, a set-associative hash index and a slab. The
+slab is a circular log of records (key digest, path, headers, body):
+records are appended at its head, and the oldest ones are evicted from
+its tail to make room, so the cache is bounded by the size of the slab.
+Index entries point at the records of the live keys. All accesses are
+serialized with an flock on the file.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+from hashlib import sha1
+from time import time
+
+from simplejson import dumps, loads
+from structlog import get_logger
+
+from chameleon.web_server.route_trie import split_path
+
+log = get_logger()
+
+MAGIC = 'CHMCACHE'
+VERSION = 2
+
+# magic, version, sets, ways, slab size, head, tail, wrap, wrapped,
+# generation, entries, hits, misses, evictions, invalidations
+HEADER = struct.Struct('<8s3I11Q')
+HEADER_SIZE = 4096
+
+WAY = struct.Struct('<20sQd')  # key digest, record offset + 1, expires
+RECORD = struct.Struct('<I20sHI')  # length, key digest, path len, hdrs len
+
+
+class SharedResponseCache(object):
+
+    WAYS = 8  # index entries per set
+
+    def __init__(self, filename, max_bytes=16 * 1024 * 1024, sets=4096):
+        """
+        :param filename: file to map; created, or replaced with a new one if
+        its layout does not match
+        :param max_bytes: size of the slab
+        :param sets: number of sets of the hash index
+        """
+        self.filename = filename
+        self.slab_size = max_bytes
+        self.sets = sets
+        self.index_size = sets * self.WAYS * WAY.size
+        self.index = struct.Struct('<' + WAY.format[1:] * sets * self.WAYS)
+        self.slab_offset = HEADER_SIZE + \
+            (self.index_size + mmap.PAGESIZE - 1) // mmap.PAGESIZE * \
+            mmap.PAGESIZE
+        self.file_size = self.slab_offset + self.slab_size
+        self.pid = None
+        self.fd = None
+        self.mm = None
+
+    def _open(self):
+        # the flock must be taken on a file description of our own, so
+        # processes forked after opening map the file anew
+        if self.pid == os.getpid():
+            return
+        if self.mm is not None:
+            # inherited from the parent process, which keeps them open
+            self.mm.close()
+            os.close(self.fd)
+            self.fd = self.mm = None
+        self.pid = os.getpid()
+        while self.fd is None:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino != os.stat(self.filename).st_ino:
+                    continue  # replaced while we waited for the lock
+                size = os.fstat(fd).st_size
+                if size == self.file_size and self._layout_matches(fd):
+                    self.fd = fd
+                elif size == 0:
+                    self._initialize(fd)
+                    self.fd = fd
+                else:
+                    # other processes may have the file mapped, under
+                    # another layout: shrinking it would get them a SIGBUS
+                    # and rewriting it would corrupt their view, so they
+                    # are left with the old file
+                    self._replace()
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                if self.fd is None:
+                    os.close(fd)
+        self.mm = mmap.mmap(self.fd, self.file_size)
+
+    def _layout_matches(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        header = HEADER.unpack(os.read(fd, HEADER.size))
+        return header[:5] == (MAGIC, VERSION, self.sets, self.WAYS,
+                              self.slab_size)
+
+    def _initialize(self, fd):
+        """
+        Lay out the empty file fd, its index zeroed by the truncation
+        """
+        log.info('initializing', filename=self.filename, size=self.file_size)
+        os.ftruncate(fd, self.file_size)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, HEADER.pack(MAGIC, VERSION, self.sets, self.WAYS,
+                                 self.slab_size, *([0] * 10)))
+
+    def _replace(self):
+        """
+        Atomically replace the file with a new one, laid out for us
+        """
+        new = '%s.%d' % (self.filename, os.getpid())
+        fd = os.open(new, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            self._initialize(fd)
+        finally:
+            os.close(fd)
+        os.rename(new, self.filename)
+
+    def _lock(self):
+        self._open()
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return list(HEADER.unpack_from(self.mm, 0))
+
+    def _unlock(self, header):
+        HEADER.pack_into(self.mm, 0, *header)
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    @property
+    def generation(self):
+        self._open()
+        return HEADER.unpack_from(self.mm, 0)[9]
+
+    @staticmethod
+    def _digest(key):
+        return sha1(repr(key)).digest()
+
+    def _set_offset(self, digest):
+        return HEADER_SIZE + \
+            struct.unpack_from('<I', digest)[0] % self.sets * \
+            self.WAYS * WAY.size
+
+    def _find(self, digest):
+        """
+        :return: (way offset, record offset + 1, expires) of digest's index
+        entry, or None
+        """
+        way_offset = self._set_offset(digest)
+        for _ in xrange(self.WAYS):
+            way_digest, ref, expires = WAY.unpack_from(self.mm, way_offset)
+            if ref and way_digest == digest:
+                return way_offset, ref, expires
+            way_offset += WAY.size
+        return None
+
+    def get(self, key):
+        """
+        :return: (headers, body) of the live entry for key, or None
+        """
+        digest = self._digest(key)
+        header = self._lock()
+        try:
+            found = self._find(digest)
+            if found is None or found[2] <= time():
+                header[12] += 1
+                return None
+            offset = self.slab_offset + found[1] - 1
+            length, _, path_len, headers_len = RECORD.unpack_from(
+                self.mm, offset)
+            start = offset + RECORD.size + path_len
+            headers = loads(self.mm[start:start + headers_len])
+            body = self.mm[start + headers_len:offset + length]
+            header[11] += 1
+            return [(str(k), str(v)) for k, v in headers], body
+        finally:
+            self._unlock(header)
+
+    def put(self, key, headers, body, ttl, path, generation):
+        """
+        Cache a response for ttl seconds.
+        :param path: request path of the response, for invalidation
+        :param generation: value of self.generation when the response was
+        requested; the response is dropped if an invalidation happened since
+        """
+        digest = self._digest(key)
+        path = '/'.join(split_path(path))
+        headers = dumps(headers)
+        length = RECORD.size + len(path) + len(headers) + len(body)
+        if length > self.slab_size:
+            return
+
+        header = self._lock()
+        try:
+            if generation != header[9]:
+                return
+            ref = self._allocate(header, length) + 1
+            offset = self.slab_offset + ref - 1
+            RECORD.pack_into(self.mm, offset, length, digest, len(path),
+                             len(headers))
+            offset += RECORD.size
+            self.mm[offset:offset + length - RECORD.size] = \
+                path + headers + body
+            self._index(header, digest, ref, time() + ttl)
+        finally:
+            self._unlock(header)
+
+    def _allocate(self, header, length):
+        """
+        Make room for length bytes at the head of the slab, evicting the
+        oldest records as needed
+        :return: slab offset of the room
+        """
+        while True:
+            head, tail, wrap, wrapped = header[5:9]
+            if not wrapped:
+                # records in [tail, head)
+                if head + length <= self.slab_size:
+                    header[5] = head + length
+                    return head
+                header[5:9] = 0, tail, head, 1
+            elif head + length <= tail:
+                # records in [tail, wrap) and [0, head)
+                header[5] = head + length
+                return head
+            elif tail >= wrap:
+                header[5:9] = head, 0, 0, 0
+            else:
+                self._evict_record(header, tail)
+
+    def _evict_record(self, header, slab_offset):
+        length, digest = RECORD.unpack_from(
+            self.mm, self.slab_offset + slab_offset)[:2]
+        found = self._find(digest)
+        if found is not None and found[1] == slab_offset + 1:
+            self._clear(header, found[0])
+            header[13] += 1
+        header[6] = slab_offset + length
+
+    def _index(self, header, digest, ref, expires):
+        way_offset = self._set_offset(digest)
+        victim = None
+        for i in xrange(self.WAYS):
+            offset = way_offset + i * WAY.size
+            way_digest, way_ref, way_expires = WAY.unpack_from(self.mm, offset)
+            if not way_ref or way_digest == digest:
+                victim = offset
+                break
+            if victim is None or way_expires < victim_expires:
+                victim, victim_expires = offset, way_expires
+        else:
+            header[13] += 1  # set full, drop the entry closest to expiry
+        if WAY.unpack_from(self.mm, victim)[1]:
+            header[10] -= 1
+        WAY.pack_into(self.mm, victim, digest, ref, expires)
+        header[10] += 1
+
+    def _clear(self, header, way_offset):
+        WAY.pack_into(self.mm, way_offset, '', 0, 0)
+        header[10] -= 1
+
+    def invalidate(self, path):
+        """
+        Drop the entries of the paths overlapping path
+        """
+        prefix = '/'.join(split_path(path))
+        if prefix:
+            prefix += '/'
+        header = self._lock()
+        try:
+            header[9] += 1
+            refs = self.index.unpack_from(self.mm, HEADER_SIZE)[1::3]
+            for i, ref in enumerate(refs):
+                if not ref:
+                    continue
+                way_offset = HEADER_SIZE + i * WAY.size
+                offset = self.slab_offset + ref - 1
+                path_len = RECORD.unpack_from(self.mm, offset)[2]
+                start = offset + RECORD.size
+                # overlapping when one is a prefix of the other, on whole
+                # segments
+                cached = self.mm[start:start + path_len] + '/'
+                if cached.startswith(prefix) or prefix.startswith(cached):
+                    self._clear(header, way_offset)
+                    header[14] += 1
+        finally:
+            self._unlock(header)
+        log.debug('invalidated', path=path)
+
+    def stats(self):
+        header = self._lock()
+        try:
+            return dict(entries=header[10], bytes=self._used(header),
+                        hits=header[11], misses=header[12],
+                        evictions=header[13], invalidations=header[14],
+                        shared=self.filename)
+        finally:
+            self._unlock(header)
+
+    def _used(self, header):
+        head, tail, wrap, wrapped = header[5:9]
+        return wrap - tail + head if wrapped else head - tail
@@ -0,0 +1,83 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Request coalescing: concurrent calls with the same key share a single
+execution, and all get its result.
+"""
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+
+class _Flight(object):
+
+    __slots__ = ('call', 'waiters')
+
+    def __init__(self):
+        self.call = None  # Deferred of the shared execution
+        self.waiters = []  # Deferreds handed out to the callers
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        self.flights = {}  # key -> _Flight
+        self.calls = 0  # executions
+        self.merged = 0  # calls that joined an execution in flight
+
+    def call(self, key, f, *args, **kw):
+        """
+        Call f(*args, **kw), unless a call with the same key is still in
+        flight, in which case its result is shared.
+        :return: Deferred fired with the result. Cancelling it only cancels
+        the execution if no other caller is waiting on it.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = _Flight()
+            self.calls += 1
+        else:
+            self.merged += 1
+
+        d = Deferred(lambda d: self._cancel(key, flight, d))
+        flight.waiters.append(d)
+        if flight.call is None:
+            flight.call = maybeDeferred(f, *args, **kw)
+            flight.call.addBoth(self._landed, key, flight)
+        return d
+
+    def _landed(self, result, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        for d in list(flight.waiters):
+            if d.called:
+                continue  # cancelled by the callbacks of another waiter
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def _cancel(self, key, flight, d):
+        flight.waiters.remove(d)
+        if not flight.waiters:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            flight.call.cancel()
+
+    def stats(self):
+        return dict(calls=self.calls, merged=self.merged,
+                    in_flight=len(self.flights))
@@ -0,0 +1,115 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Static assets (the swagger UI and swagger.json) held in memory, along with
+their gzip-encoded form, computed once, and served with strong ETags,
+Cache-Control and 304 Not Modified responses to conditional requests.
+"""
+
+import mimetypes
+import os
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+from chameleon.web_server.etags import make_etag, not_modified
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class StaticAsset(object):
+
+    # below this ratio of the size of the original, the gzip-encoded form is
+    # kept
+    GZIP_RATIO = 0.9
+
+    def __init__(self, body, content_type, cache_control='no-cache'):
+        """
+        :param body: content of the asset
+        :param content_type: Content-Type header of the asset
+        :param cache_control: Cache-Control header of the asset
+        """
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = make_etag(body)
+        self.gzipped = _gzip(body)
+        if len(self.gzipped) > len(body) * self.GZIP_RATIO:
+            self.gzipped = None  # not worth it, e.g. for images
+        self.gzipped_etag = make_etag(body, '-gzip')
+
+    def render(self, request):
+        """
+        :return: the response body to request, setting its headers
+        """
+        gzipped = self.gzipped is not None and \
+            parse_accept_header(request.getHeader('accept-encoding') or
+                                '').best_match(('gzip',)) == 'gzip'
+        body, etag = (self.gzipped, self.gzipped_etag) if gzipped \
+            else (self.body, self.etag)
+        request.setHeader('ETag', etag)
+        request.setHeader('Cache-Control', self.cache_control)
+        if self.gzipped is not None:
+            request.setHeader('Vary', 'Accept-Encoding')
+        if not_modified(request, etag):
+            request.setResponseCode(304)
+            return ''
+        request.setHeader('Content-Type', self.content_type)
+        if gzipped:
+            request.setHeader('Content-Encoding', 'gzip')
+        request.setHeader('Content-Length', str(len(body)))
+        return body
+
+
+class StaticDirectory(object):
+    """
+    The files under a directory, loaded into memory as StaticAssets on
+    first use
+    """
+
+    def __init__(self, root_dir, cache_control='public, max-age=3600'):
+        self.root_dir = root_dir
+        self.cache_control = cache_control
+        self.assets = None  # path relative to root_dir -> StaticAsset
+
+    def _load(self):
+        assets = {}
+        for dir_path, _, file_names in os.walk(self.root_dir):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                content_type, encoding = mimetypes.guess_type(path)
+                if content_type is None or encoding is not None:
+                    content_type = 'application/octet-stream'
+                with open(path, 'rb') as f:
+                    assets[os.path.relpath(path, self.root_dir)] = \
+                        StaticAsset(f.read(), content_type,
+                                    self.cache_control)
+        self.assets = assets
+        return assets
+
+    def get(self, path):
+        """
+        :param path: path relative to root_dir, '' or a trailing '/' naming
+        the index.html of a directory
+        :return: the StaticAsset of path, or None
+        """
+        if not path or path.endswith('/'):
+            path += 'index.html'
+        return (self.assets or self._load()).get(os.path.normpath(path))
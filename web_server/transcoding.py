@@ -0,0 +1,351 @@
+#
+# Copyright 2017 the original author or authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Conversion between protobuf messages and JSON objects, specialized per
+message type:
+- runtime support of the JSON encoders generated by gw_gen (see
+gw_gen.EncoderGenerator), which convert messages to the same JSON objects
+as MessageToDict(message, True, True)
+- MessageDecoder, filling messages from JSON objects as ParseDict does,
+driven by per-message-type field tables
+"""
+
+import math
+from base64 import b64encode, urlsafe_b64decode
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.internal.type_checkers import ToShortestFloat
+from google.protobuf.json_format import ParseDict, ParseError, _IsMapEntry, \
+    _IsWrapperMessage, _Printer, _WKTJSONMETHODS
+from simplejson import dumps
+
+_PRINTER = _Printer(including_default_value_fields=True,
+                    preserving_proto_field_name=True)
+
+
+def encode_double(value):
+    if math.isinf(value):
+        return '-Infinity' if value < 0 else 'Infinity'
+    if math.isnan(value):
+        return 'NaN'
+    return value
+
+
+def encode_float(value):
+    value = encode_double(value)
+    if isinstance(value, float):
+        return ToShortestFloat(value)
+    return value
+
+
+def encode_bytes(value):
+    return b64encode(value).decode('utf-8')
+
+
+def encode_wkt(message):
+    """
+    Encode a well-known type message, whose JSON mapping is special
+    """
+    return _PRINTER._MessageToJsonObject(message)
+
+
+def load_encoders(source):
+    """
+    :param source: encoders generated by gw_gen.generate_encoders
+    :return: message full name -> encoder, as defined by source
+    """
+    namespace = dict(encode_bytes=encode_bytes, encode_double=encode_double,
+                     encode_float=encode_float, encode_wkt=encode_wkt)
+    exec compile(source, '<generated encoders>', 'exec') in namespace
+    return namespace['ENCODERS']
+
+
+class DecodeError(ValueError):
+
+    def __init__(self, path, message):
+        """
+        :param path: path of the offending field, e.g. ports[2].label
+        :param message: what is wrong with it
+        """
+        ValueError.__init__(self, '%s: %s' % (path, message) if path
+                            else message)
+        self.path = path
+
+
+def _decode_integer(value):
+    if type(value) in (int, long):
+        return value
+    if isinstance(value, bool) or \
+            isinstance(value, float) and not value.is_integer() or \
+            isinstance(value, basestring) and ' ' in value:
+        raise ValueError('invalid integer %s' % dumps(value))
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('invalid integer %s' % dumps(value))
+
+
+def _decode_float(value):
+    if type(value) in (float, int, long):
+        if math.isnan(value) or math.isinf(value):
+            raise ValueError('use quoted "NaN", "Infinity" or "-Infinity"')
+        return value
+    if value in ('NaN', 'Infinity', '-Infinity'):
+        return float(value)
+    if not isinstance(value, basestring) or value.lower() in (
+            'nan', 'inf', '-inf', 'infinity', '-infinity'):
+        raise ValueError('invalid number %s' % dumps(value))
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError('invalid number %s' % dumps(value))
+
+
+def _decode_bool(value):
+    if value is not True and value is not False:
+        raise ValueError('expected true or false without quotes')
+    return value
+
+
+def _decode_string(value):
+    if not isinstance(value, basestring):
+        raise ValueError('expected a string')
+    return value
+
+
+def _decode_bytes(value):
+    if not isinstance(value, basestring):
+        raise ValueError('expected a base64 string')
+    value = value.encode('utf-8')
+    return urlsafe_b64decode(value.replace('+', '-').replace('/', '_') +
+                             '=' * (-len(value) % 4))
+
+
+def _decode_map_key(key_field):
+    """
+    :return: converter of the JSON keys of a map field to its key type
+    """
+    if key_field.cpp_type == FieldDescriptor.CPPTYPE_BOOL:
+        def decode(key):
+            if key not in ('true', 'false'):
+                raise ValueError('expected "true" or "false"')
+            return key == 'true'
+        return decode
+    if key_field.cpp_type == FieldDescriptor.CPPTYPE_STRING:
+        return _decode_string
+    return _decode_integer
+
+
+def _decode_enum(field):
+    numbers = dict((v.name, v.number) for v in field.enum_type.values)
+    known = set(numbers.itervalues())
+    closed = field.file.syntax != 'proto3'
+
+    def decode(value):
+        if isinstance(value, basestring) and value in numbers:
+            return numbers[value]
+        try:
+            number = _decode_integer(value)
+        except ValueError:
+            number = None
+        if number is None or closed and number not in known:
+            raise ValueError('invalid %s value %s' % (
+                field.enum_type.full_name, dumps(value)))
+        return number
+    return decode
+
+
+_SCALAR_DECODERS = {
+    FieldDescriptor.CPPTYPE_INT32: _decode_integer,
+    FieldDescriptor.CPPTYPE_INT64: _decode_integer,
+    FieldDescriptor.CPPTYPE_UINT32: _decode_integer,
+    FieldDescriptor.CPPTYPE_UINT64: _decode_integer,
+    FieldDescriptor.CPPTYPE_DOUBLE: _decode_float,
+    FieldDescriptor.CPPTYPE_FLOAT: _decode_float,
+    FieldDescriptor.CPPTYPE_BOOL: _decode_bool,
+}
+
+# kinds of fields
+_SCALAR, _MESSAGE, _REPEATED_SCALAR, _REPEATED_MESSAGE, _MAP = range(5)
+
+
+def _path(path, name):
+    return path + '.' + name if path else name
+
+
+class _WktDecoder(object):
+    """
+    Decoder of the well-known types, whose JSON mapping is special, left
+    to ParseDict
+    """
+
+    def __init__(self, descriptor):
+        # a null google.protobuf.Value is a null_value
+        self.accepts_null = descriptor.full_name == 'google.protobuf.Value'
+
+    def decode(self, js, message, path=''):
+        try:
+            ParseDict(js, message)
+        except ParseError as e:
+            raise DecodeError(path, str(e))
+
+
+class MessageDecoder(object):
+    """
+    Fills messages of one type from JSON objects (as returned by loads),
+    as ParseDict would, but going through a table of the fields of the type
+    computed once, rather than through the descriptors on every call.
+    Errors are raised as DecodeErrors naming the path of the offending
+    field.
+    """
+
+    accepts_null = False
+
+    def __init__(self, descriptor, decoders=None):
+        """
+        :param descriptor: message type descriptor
+        :param decoders: message full name -> decoder, shared by the
+        decoders of the types the type refers to
+        """
+        self.descriptor = descriptor
+        self.decoders = {} if decoders is None else decoders
+        self.decoders[descriptor.full_name] = self
+        self.fields = None  # JSON name -> field entry, built on first use
+
+    def _decoder(self, descriptor):
+        decoder = self.decoders.get(descriptor.full_name)
+        if decoder is None:
+            if _IsWrapperMessage(descriptor) or \
+                    descriptor.full_name in _WKTJSONMETHODS:
+                decoder = self.decoders[descriptor.full_name] = \
+                    _WktDecoder(descriptor)
+            else:
+                decoder = MessageDecoder(descriptor, self.decoders)
+        return decoder
+
+    def _build(self):
+        """
+        Build the field table: (name, kind, value converter or decoder,
+        map key converter, oneof name) of each field, under both its name
+        and its JSON name
+        """
+        fields = {}
+        for field in self.descriptor.fields:
+            oneof = field.containing_oneof.name \
+                if field.containing_oneof is not None else None
+            if _IsMapEntry(field):
+                key_field, value_field = field.message_type.fields
+                entry = (field.name, _MAP,
+                         self._value_decoder(value_field),
+                         _decode_map_key(key_field), None)
+            elif field.label == FieldDescriptor.LABEL_REPEATED:
+                kind = _REPEATED_MESSAGE \
+                    if field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE \
+                    else _REPEATED_SCALAR
+                entry = (field.name, kind, self._value_decoder(field), None,
+                         None)
+            else:
+                kind = _MESSAGE \
+                    if field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE \
+                    else _SCALAR
+                entry = (field.name, kind, self._value_decoder(field), None,
+                         oneof)
+            fields[field.name] = fields[field.json_name] = entry
+        self.fields = fields
+        return fields
+
+    def _value_decoder(self, field):
+        if field.cpp_type == FieldDescriptor.CPPTYPE_MESSAGE:
+            return self._decoder(field.message_type)
+        if field.cpp_type == FieldDescriptor.CPPTYPE_ENUM:
+            return _decode_enum(field)
+        if field.cpp_type == FieldDescriptor.CPPTYPE_STRING:
+            if field.type == FieldDescriptor.TYPE_BYTES:
+                return _decode_bytes
+            return _decode_string
+        return _SCALAR_DECODERS[field.cpp_type]
+
+    def decode(self, js, message, path=''):
+        """
+        Fill message from JSON object js
+        :param path: path of message, for errors
+        """
+        if not isinstance(js, dict):
+            raise DecodeError(path, 'expected an object')
+        fields = self.fields or self._build()
+        seen = set()  # names of the fields and oneofs set, as ParseDict
+        for key, value in js.iteritems():
+            entry = fields.get(key)
+            if entry is None:
+                raise DecodeError(_path(path, key), 'unknown field')
+            name, kind, decode, decode_key, oneof = entry
+            if name in seen:
+                raise DecodeError(_path(path, key),
+                                  'field %s given more than once' % name)
+            seen.add(name)
+            if oneof is not None and value is not None:
+                if oneof in seen:
+                    raise DecodeError(_path(path, key),
+                                      'more than one field of oneof %s'
+                                      % oneof)
+                seen.add(oneof)
+            if value is None and not (
+                    kind == _MESSAGE and decode.accepts_null):
+                message.ClearField(name)
+                continue
+            try:
+                if kind == _SCALAR:
+                    setattr(message, name, decode(value))
+                elif kind == _MESSAGE:
+                    sub_message = getattr(message, name)
+                    sub_message.SetInParent()
+                    decode.decode(value, sub_message, _path(path, key))
+                elif kind == _REPEATED_SCALAR:
+                    if not isinstance(value, list):
+                        raise ValueError('expected an array')
+                    getattr(message, name).extend(decode(v) for v in value)
+                elif kind == _REPEATED_MESSAGE:
+                    if not isinstance(value, list):
+                        raise ValueError('expected an array')
+                    items = getattr(message, name)
+                    for i, v in enumerate(value):
+                        decode.decode(v, items.add(),
+                                      '%s[%d]' % (_path(path, key), i))
+                else:
+                    self._decode_map(getattr(message, name), value, decode,
+                                     decode_key, _path(path, key))
+            except DecodeError:
+                raise
+            except (ValueError, TypeError) as e:
+                raise DecodeError(_path(path, key), str(e))
+
+    @staticmethod
+    def _decode_map(entries, value, decode, decode_key, path):
+        if not isinstance(value, dict):
+            raise DecodeError(path, 'expected an object')
+        for k, v in value.iteritems():
+            item_path = '%s[%s]' % (path, k)
+            try:
+                key = decode_key(k)
+                if isinstance(decode, (MessageDecoder, _WktDecoder)):
+                    decode.decode(v, entries[key], item_path)
+                else:
+                    entries[key] = decode(v)
+            except DecodeError:
+                raise
+            except (ValueError, TypeError) as e:
+                raise DecodeError(item_path, str(e))
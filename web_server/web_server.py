@@ -16,6 +16,10 @@
 #
 
 import os
+import socket
+import weakref
+from glob import glob
+from time import time
 
 import grpc
 from klein import Klein
@@ -23,38 +27,80 @@ from simplejson import dumps, load
 from structlog import get_logger
 from twisted.internet import reactor, endpoints
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.task import LoopingCall
 from twisted.internet.tcp import Port
 from twisted.internet.endpoints import SSL4ServerEndpoint
 from twisted.internet.ssl import DefaultOpenSSLContextFactory
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from twisted.web.resource import EncodingResourceWrapper, NoResource
 from twisted.web.server import Site
-from twisted.web.static import File
 from OpenSSL.SSL import TLSv1_2_METHOD
 from werkzeug.exceptions import BadRequest
 from grpc import StatusCode
 import json
 
+from chameleon.web_server.dynamic_gw import DynamicGateway
+from chameleon.web_server.gateway import GatewaySettings
+from chameleon.web_server.route_trie import DispatcherResource, RouteTrie
+from chameleon.web_server.static_assets import StaticAsset, StaticDirectory
 
 log = get_logger()
 
 
+def aggregate_stats(stats_list):
+    """
+    Sum the counters of the stats of several workers. Versions and the
+    counters of caches shared by the workers are taken as they are.
+    """
+    totals = {}
+    for stats in stats_list:
+        for k, v in stats.iteritems():
+            if k == 'routes_version':
+                totals[k] = max(totals.get(k, 0), v)
+            elif isinstance(v, dict):
+                if 'shared' in v:
+                    totals[k] = v
+                else:
+                    totals[k] = aggregate_stats([totals.get(k, {}), v])
+            elif isinstance(v, (int, long, float)) and \
+                    not isinstance(v, bool):
+                totals[k] = totals.get(k, 0) + v
+    return totals
+
+
 class WebServer(object):
 
     app = Klein()
 
-    def __init__(self, port, work_dir, swagger_url, grpc_client, key=None, cert=None):
+    STATS_INTERVAL = 5  # seconds between publications of worker stats
+
+    def __init__(self, port, work_dir, swagger_url, grpc_client, key=None, cert=None,
+                 gateway_settings=None, worker_id=None):
         self.port = port
         self.site = None
         self.work_dir = work_dir
         self.swagger_url = swagger_url
         self.grpc_client = grpc_client
+        self.gateway_settings = gateway_settings or GatewaySettings()
         self.key = key
         self.cert = cert
+        # in pre-fork mode, the port is shared with the other workers and
+        # the stats of all of them are published under work_dir
+        self.worker_id = worker_id
+        self.stats_dir = os.path.join(work_dir, 'workers')
+        self.stats_loop = None
 
         self.swagger_ui_root_dir = os.path.abspath(
             os.path.join(os.path.dirname(__file__), '../swagger_ui'))
+        self.swagger_ui = StaticDirectory(self.swagger_ui_root_dir)
 
         self.tcp_port = None
         self.shutting_down = False
+        self.swagger_json = None  # in-memory swagger.json of dynamic gateway
+        self.swagger_asset = None  # StaticAsset of the current swagger.json
+        self.dispatcher = DispatcherResource(
+            RouteTrie(), self.app.resource(), self.render_error)
+        self.retired_routes = {}  # version -> weakref to retired RouteTrie
 
         self.add_swagger_routes(self.app, swagger_url)
 
@@ -64,22 +110,44 @@ class WebServer(object):
         @app.route(swagger_url + '/', branch=True)
         def static(self, request):
             try:
-                log.debug(request=request)
-                return File(self.swagger_ui_root_dir)
+                log.debug('swagger-ui', request=request)
+                asset = self.swagger_ui.get('/'.join(request.postpath))
+                if asset is None:
+                    return NoResource()
+                return asset.render(request)
             except Exception as e:
                 log.exception('file-not-found', request=request)
 
         @app.route(swagger_url + '/v1/swagger.json')
         def swagger_json(self, request):
             try:
-                return File(os.path.join(self.work_dir, 'swagger.json'))
+                if self.swagger_asset is None:
+                    if self.swagger_json is not None:
+                        body = self.swagger_json
+                    elif self.grpc_client.schema_dir is None:
+                        return NoResource()  # no schema retrieved yet
+                    else:
+                        path = os.path.join(self.grpc_client.schema_dir,
+                                            'swagger.json')
+                        if not os.path.isfile(path):
+                            return NoResource()
+                        with open(path, 'rb') as f:
+                            body = f.read()
+                    self.swagger_asset = StaticAsset(body, 'application/json')
+                return self.swagger_asset.render(request)
             except Exception as e:
                 log.exception('file-not-found', request=request)
 
     @inlineCallbacks
     def start(self):
         log.debug('starting')
+        self.gateway_settings.start()
         yield self._open_endpoint()
+        if self.worker_id is not None:
+            if not os.path.isdir(self.stats_dir):
+                os.makedirs(self.stats_dir)
+            self.stats_loop = LoopingCall(self._publish_stats)
+            self.stats_loop.start(self.STATS_INTERVAL)
         log.info('started')
         returnValue(self)
 
@@ -87,9 +155,16 @@ class WebServer(object):
     def stop(self):
         log.debug('stopping')
         self.shutting_down = True
+        if self.stats_loop is not None:
+            self.stats_loop.stop()
+            try:
+                os.remove(self._stats_file(self.worker_id))
+            except OSError:
+                pass
         if self.tcp_port is not None:
             assert isinstance(self.tcp_port, Port)
             yield self.tcp_port.socket.close()
+        self.gateway_settings.stop()
         log.info('stopped')
 
     @inlineCallbacks
@@ -102,21 +177,141 @@ class WebServer(object):
                 ctx = DefaultOpenSSLContextFactory(self.key, self.cert, TLSv1_2_METHOD)
                 endpoint = SSL4ServerEndpoint(reactor, self.port, ctx)
 
-            self.site = Site(self.app.resource())
-            self.tcp_port = yield endpoint.listen(self.site)
+            resource = self.dispatcher
+            if self.gateway_settings.compression is not None:
+                resource = EncodingResourceWrapper(
+                    resource, [self.gateway_settings.compression])
+            self.site = Site(resource)
+            if self.worker_id is not None:
+                self.tcp_port = self._listen_shared(self.site)
+            else:
+                self.tcp_port = yield endpoint.listen(self.site)
             log.info('web-server-started', port=self.port)
             self.endpoint = endpoint
         except Exception as e:
             self.log.exception('web-server-failed-to-start', e=e)
 
+    def _listen_shared(self, factory):
+        """
+        Listen on a SO_REUSEPORT socket, so that the kernel balances the
+        connections across the workers listening on the same port
+        """
+        if self.key is not None and self.cert is not None:
+            ctx = DefaultOpenSSLContextFactory(self.key, self.cert, TLSv1_2_METHOD)
+            factory = TLSMemoryBIOFactory(ctx, False, factory)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', self.port))
+            sock.listen(50)
+            sock.setblocking(False)
+            return reactor.adoptStreamPort(
+                sock.fileno(), socket.AF_INET, factory)
+        finally:
+            sock.close()  # the port holds its own duplicate
+
     def reload_generated_routes(self):
-        for fname in os.listdir(self.work_dir):
-            if fname.endswith('_gw.py'):
-                module_name = fname.replace('.py', '')
-                m = __import__(module_name)
-                assert hasattr(m, 'add_routes')
-                m.add_routes(self.app, self.grpc_client)
-                log.info('routes-loaded', module=module_name)
+        """
+        Build the route table of the current schema off to the side, and
+        swap it in once complete. Requests already dispatched finish on the
+        previous table, which is then garbage collected. Should the build
+        fail, the previous table stays in place, and the error is raised to
+        the GrpcClient, which then keeps the previous schema active too.
+        """
+        routes = RouteTrie(version=self.dispatcher.routes.version + 1,
+                           settings=self.gateway_settings)
+        swagger_json = None
+
+        if self.grpc_client.dynamic_gateway:
+            t0 = time()
+            gateway = DynamicGateway(self.grpc_client.schema)
+            gateway.add_routes(routes, self.grpc_client)
+            swagger_json = gateway.swagger_json
+            log.info('routes-loaded', dynamic=True,
+                     routes=len(gateway.methods), load_time=time() - t0)
+        else:
+            for fname in os.listdir(self.grpc_client.schema_dir):
+                if fname.endswith('_gw.py'):
+                    module_name = fname.replace('.py', '')
+                    m = __import__(module_name)
+                    assert hasattr(m, 'add_routes')
+                    m.add_routes(routes, self.grpc_client)
+                    log.info('routes-loaded', module=module_name)
+
+        self._swap_routes(routes)
+        self.swagger_json = swagger_json
+        self.swagger_asset = None  # built from the new swagger.json on use
+
+    def _swap_routes(self, routes):
+        retired = self.dispatcher.routes
+        self.dispatcher.routes = routes
+        log.info('routes-activated', version=routes.version,
+                 routes=routes.size)
+
+        def released(_, version=retired.version):
+            del self.retired_routes[version]
+            log.debug('routes-released', version=version)
+
+        self.retired_routes[retired.version] = weakref.ref(retired, released)
+
+    def render_error(self, request, failure):
+        if failure.check(grpc._channel._Rendezvous):
+            return self.grpc_exception(request, failure)
+        log.error('request-failed', path=request.path,
+                  failure=failure.getTraceback())
+        request.setResponseCode(500)
+        return json.dumps({'error': 'Internal Server Error'})
+
+    def collect_stats(self):
+        return dict(
+            routes_version=self.dispatcher.routes.version,
+            backends=self.grpc_client.balancer.stats(),
+            single_flight=self.gateway_settings.single_flight.stats(),
+            response_cache=self.gateway_settings.response_cache.stats())
+
+    @app.route('/chameleon/stats')
+    def stats(self, request):
+        request.setHeader('Content-Type', 'application/json')
+        stats = self.collect_stats()
+        if self.worker_id is None:
+            return dumps(stats)
+        workers = self._read_worker_stats()
+        workers[str(self.worker_id)] = stats
+        return dumps(dict(worker_id=self.worker_id, workers=workers,
+                          totals=aggregate_stats(workers.values())))
+
+    def _stats_file(self, worker_id):
+        return os.path.join(self.stats_dir, '%s.json' % worker_id)
+
+    def _publish_stats(self):
+        stats = dict(self.collect_stats(), pid=os.getpid(), updated=time())
+        path = self._stats_file(self.worker_id)
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(dumps(stats))
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            log.warning('stats-publish-failed', path=path, e=e)
+
+    def _read_worker_stats(self):
+        """
+        :return: worker id -> last stats published by the other live workers
+        """
+        workers = {}
+        for path in glob(os.path.join(self.stats_dir, '*.json')):
+            try:
+                with open(path) as f:
+                    stats = load(f)
+            except (IOError, ValueError):
+                continue  # removed or being replaced
+            # skip the leftovers of workers gone for good
+            if stats.pop('updated', 0) < time() - 3 * self.STATS_INTERVAL:
+                continue
+            stats.pop('pid', None)
+            workers[os.path.basename(path)[:-len('.json')]] = stats
+        return workers
 
     @app.handle_errors(grpc._channel._Rendezvous)
     def grpc_exception(self, request, failure):